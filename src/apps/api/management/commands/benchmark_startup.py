@@ -0,0 +1,45 @@
+"""python manage.py benchmark_startup"""
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+IMPORT_WSGI = 'import time; start = time.perf_counter(); import remy_api.wsgi; '
+BUILD_REGISTRY = 'from common.utils import get_unit_registry; get_unit_registry(); '
+PRINT_ELAPSED = 'print(time.perf_counter() - start)'
+
+SCENARIOS = [
+    # what every worker paid before, when the registry was built at import time
+    ('import + registry, no disk cache', IMPORT_WSGI + BUILD_REGISTRY + PRINT_ELAPSED,
+     {'UNIT_REGISTRY_CACHE_FOLDER': ''}),
+    ('import + registry, disk cache', IMPORT_WSGI + BUILD_REGISTRY + PRINT_ELAPSED, {}),
+    ('import only (lazy registry)', IMPORT_WSGI + PRINT_ELAPSED, {}),
+]
+
+
+class Command(BaseCommand):
+    help = 'time importing remy_api.wsgi in fresh interpreters, with and without building the unit registry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Interpreters started per scenario')
+
+    def handle(self, *args, **options):
+        for name, code, env in SCENARIOS:
+            env = {'DJANGO_SETTINGS_MODULE': 'remy_api.settings', **os.environ, **env}
+            if 'UNIT_REGISTRY_CACHE_FOLDER' not in env:
+                # first run fills the disk cache, so the timed ones read it
+                subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env,
+                               check=True, capture_output=True)
+
+            times = []
+            for _ in range(options['runs']):
+                result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env,
+                                        check=True, capture_output=True, text=True)
+                times.append(float(result.stdout.strip().splitlines()[-1]))
+
+            self.stdout.write(f'{name}: median {statistics.median(times) * 1000:.0f} ms, '
+                              f'min {min(times) * 1000:.0f} ms over {len(times)} runs')
@@ -6,7 +6,7 @@ from rest_framework import status
 from rest_framework.test import APITestCase
 
 from common.utils import query_reverse
-from apps.inventories.models import Place
+from apps.inventories.models import InventoryItem, Place
 from apps.recipes.models import Recipe, Interaction
 
 
@@ -76,6 +76,32 @@ class CookingTest(APITestCase):
         self.assertEqual(items.get(id=3).quantity, 500)
         self.assertEqual(items.get(id=3).unit.name, 'milliliter')
 
+    def test_cooking_takes_from_the_item_in_a_convertible_unit(self):
+        """
+        Cooking a recipe whose product has another item in a unit that can't be converted,
+        should reduce the item that can be converted and leave the other one.
+        """
+        recipe_1 = Recipe.objects.get(id=1)
+        self.client.force_authenticate(user=self.u_1)
+        # leche has no weight per unit, so units can't be converted to liters; the item in liters is moved
+        # after it, so it isn't just the first one
+        liters_item = InventoryItem.objects.get(id=1)
+        liters_item.delete()
+        units_item = InventoryItem.objects.create(place=self.place, product_id=1, quantity=3, unit_id=1)
+        liters_item = InventoryItem.objects.create(place=self.place, product_id=1, quantity=1, unit_id=4)
+
+        resp = self.client.post(
+            cook_recipe_url(recipe_id=recipe_1.id, place_id=self.place.id)
+        )
+
+        # 1 L leche - 500 mL leche = 0.5 L leche
+        items = self.place.inventory.all()
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(items.get(id=liters_item.id).quantity, 0.5)
+        self.assertEqual(items.get(id=liters_item.id).unit.name, 'liter')
+        self.assertEqual(items.get(id=units_item.id).quantity, 3)
+        self.assertEqual(items.get(id=units_item.id).unit.name, 'unit')
+
     def test_cooking_with_exact_inventory_for_ingredient(self):
         """
         Cooking a recipe where an ingredient's amount is the same
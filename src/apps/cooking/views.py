@@ -7,9 +7,8 @@ from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
 from apps.recipes.models import Recipe
-from apps.products.models import Amount
 from apps.recipes.serializers import InteractionSerializer
-from apps.inventories.utils import get_place_or_default
+from apps.inventories.utils import get_request_place, take_from_place
 
 
 @swagger_auto_schema(
@@ -55,7 +54,7 @@ def cook_recipe(request):
         )
 
     recipe = get_object_or_404(Recipe, id=recipe_id)
-    place = get_place_or_default(request.user.profile, place_id)
+    place = get_request_place(request, place_id)
 
     if not place:
         return Response(
@@ -70,10 +69,8 @@ def cook_recipe(request):
         interaction = interaction_serializer.save(profile=request.user.profile)
         interaction.cook()
 
-        for ingredient in recipe.ingredient_set.all():
-            # TODO: en la línea de abajo, que pasa si cocina con algo que no tiene?? sustitutos??
-            item = place.inventory.filter(product=ingredient.product).first()
-            if item:
-                item.reduce_amount(Amount(ingredient.quantity, ingredient.unit.id))
+        # TODO: que pasa si cocina con algo que no tiene?? sustitutos??
+        take_from_place(place, [(ingredient.product, ingredient.quantity, ingredient.unit)
+                                for ingredient in recipe.ingredient_set.select_related('product', 'unit')])
 
     return Response(interaction_serializer.data, status=status.HTTP_200_OK)
@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_items(apps, schema_editor):
+    """Merges every place's items of the same product and unit into the oldest one, before they're made unique.
+
+    Only amounts in the same unit are added up, so no conversion is needed and nothing is lost: items of
+    the same product in other units are kept as they are.
+    """
+    for model_name in ['InventoryItem', 'Cart']:
+        model = apps.get_model('inventories', model_name)
+        duplicated = (model.objects
+                      .filter(unit__isnull=False)
+                      .values('place_id', 'product_id', 'unit_id')
+                      .annotate(items=Count('id'))
+                      .filter(items__gt=1))
+        for duplicate in duplicated:
+            kept, *others = (model.objects
+                             .filter(place_id=duplicate['place_id'],
+                                     product_id=duplicate['product_id'],
+                                     unit_id=duplicate['unit_id'])
+                             .order_by('id'))
+            quantities = [item.quantity for item in [kept, *others] if item.quantity is not None]
+            kept.quantity = sum(quantities) if quantities else None
+            kept.save(update_fields=['quantity'])
+            model.objects.filter(id__in=[other.id for other in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventories', '0014_barcode'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventories', '0015_merge_duplicate_items'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='inventoryitem',
+            constraint=models.UniqueConstraint(fields=('place', 'product', 'unit'),
+                                               name='unique_inventory_item_product_unit'),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('place', 'product', 'unit'), name='unique_cart_product_unit'),
+        ),
+    ]
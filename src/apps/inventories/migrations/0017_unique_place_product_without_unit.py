@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+def merge_duplicate_items_without_unit(apps, schema_editor):
+    """Merges every place's items of the same product without unit into the oldest one, before they're made unique.
+
+    As in 0015_merge_duplicate_items, which left them out: the unique constraint on the unit doesn't apply to them.
+    """
+    for model_name in ['InventoryItem', 'Cart']:
+        model = apps.get_model('inventories', model_name)
+        duplicated = (model.objects
+                      .filter(unit__isnull=True)
+                      .values('place_id', 'product_id')
+                      .annotate(items=models.Count('id'))
+                      .filter(items__gt=1))
+        for duplicate in duplicated:
+            kept, *others = (model.objects
+                             .filter(place_id=duplicate['place_id'],
+                                     product_id=duplicate['product_id'],
+                                     unit__isnull=True)
+                             .order_by('id'))
+            quantities = [item.quantity for item in [kept, *others] if item.quantity is not None]
+            kept.quantity = sum(quantities) if quantities else None
+            kept.save(update_fields=['quantity'])
+            model.objects.filter(id__in=[other.id for other in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventories', '0016_unique_place_product_unit'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items_without_unit, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='inventoryitem',
+            constraint=models.UniqueConstraint(condition=models.Q(unit=None), fields=('place', 'product'),
+                                               name='unique_inventory_item_product_without_unit'),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(unit=None), fields=('place', 'product'),
+                                               name='unique_cart_product_without_unit'),
+        ),
+    ]
@@ -20,6 +20,15 @@ class Place(models.Model):
 class InventoryItem(ProductWithAmount):
     place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='inventory')
 
+    class Meta:
+        # a product has more than one item only for amounts that can't be converted to each other
+        constraints = [
+            models.UniqueConstraint(fields=['place', 'product', 'unit'], name='unique_inventory_item_product_unit'),
+            # NULLs are never equal, so the one without unit needs its own
+            models.UniqueConstraint(fields=['place', 'product'], condition=models.Q(unit=None),
+                                    name='unique_inventory_item_product_without_unit'),
+        ]
+
 
 class PlaceMember(models.Model):
     place = models.ForeignKey(Place, on_delete=models.CASCADE)
@@ -39,6 +48,15 @@ class PurchaseItem(ProductWithAmount):
 class Cart(ProductWithAmount):
     place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='cart')
 
+    class Meta:
+        # a product has more than one item only for amounts that can't be converted to each other
+        constraints = [
+            models.UniqueConstraint(fields=['place', 'product', 'unit'], name='unique_cart_product_unit'),
+            # NULLs are never equal, so the one without unit needs its own
+            models.UniqueConstraint(fields=['place', 'product'], condition=models.Q(unit=None),
+                                    name='unique_cart_product_without_unit'),
+        ]
+
 
 class BarCode(ProductWithAmount):
     id = models.CharField(primary_key=True, max_length=13)
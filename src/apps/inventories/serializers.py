@@ -1,3 +1,6 @@
+from decimal import Decimal
+
+from django.db import transaction
 from rest_framework import serializers
 
 from apps.products.models import Amount, Product
@@ -10,7 +13,9 @@ from apps.inventories.models import (Place,
                                      BarCode,
                                      DEFAULT_PLACE_NAME,
                                      )
+from apps.inventories.utils import add_to_place, add_amounts_to_place
 from apps.products.serializers import AmountSerializer
+from common.fields import PrefetchedSlugRelatedField
 
 
 class PlaceSerializer(serializers.ModelSerializer):
@@ -38,30 +43,38 @@ class PlaceSerializer(serializers.ModelSerializer):
         return place
 
 
+class InventoryItemListSerializer(serializers.ListSerializer):
+
+    @transaction.atomic
+    def create(self, validated_data):
+        """Adds all the items to their (single) place at once, see add_amounts_to_place."""
+        if not validated_data:
+            return []
+
+        place = validated_data[0].get('place')
+        if not place:
+            place = PlaceSerializer.create(self, {'name': DEFAULT_PLACE_NAME})
+
+        return add_amounts_to_place(InventoryItem, place, [
+            (item_data['product'], item_data.get('quantity'), item_data.get('unit')) for item_data in validated_data])
+
+
 class InventoryItemSerializer(AmountSerializer):
     id = serializers.PrimaryKeyRelatedField(read_only=True)
-    product = serializers.SlugRelatedField(slug_field='name', queryset=Product.objects.all())
+    product = PrefetchedSlugRelatedField('products', slug_field='name', queryset=Product.objects.all())
 
     class Meta:
         model = InventoryItem
         fields = ['id', 'product']
+        list_serializer_class = InventoryItemListSerializer
 
     def create(self, validated_data):
-        product = validated_data.get('product')
         place = validated_data.get('place')
-
-        if place:
-            existing_items = place.inventory.filter(product=product)
-            if existing_items.exists():
-                item = existing_items.first()
-                item.add_amount(Amount(validated_data.get('quantity'), validated_data.get('unit').id))
-            else:
-                item = InventoryItem.objects.create(**validated_data)
-        else:
+        if not place:
             place = PlaceSerializer.create(self, {'name': DEFAULT_PLACE_NAME})
-            item = InventoryItem.objects.create(**validated_data, place=place)
 
-        return item
+        return add_to_place(InventoryItem, place, validated_data.get('product'),
+                            validated_data.get('quantity'), validated_data.get('unit'))
 
 
 class PurchaseItemSerializer(AmountSerializer):
@@ -117,14 +130,18 @@ class CartSerializer(serializers.ModelSerializer, AmountSerializer):
 
     def create(self, validated_data):
         place = validated_data.get('place')
-
-        if place:
-            item = Cart.objects.create(**validated_data)
-        else:
+        if not place:
             place = PlaceSerializer.create(self, {'name': DEFAULT_PLACE_NAME})
-            item = Cart.objects.create(**validated_data, place=place)
 
-        return item
+        return add_to_place(Cart, place, validated_data.get('product'),
+                            validated_data.get('quantity'), validated_data.get('unit'))
+
+
+class ShoppingListRecipeSerializer(serializers.Serializer):
+    """A recipe to shop for, its ingredients' quantities multiplied by multiplier (e.g. 2 to cook it twice)."""
+    recipe = serializers.IntegerField()
+    multiplier = serializers.DecimalField(max_digits=7, decimal_places=3, min_value=Decimal('0.001'),
+                                          default=Decimal(1))
 
 
 class BarCodeSerializer(serializers.ModelSerializer, AmountSerializer):
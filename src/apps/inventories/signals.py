@@ -1,9 +1,19 @@
-from django.db.models.signals import m2m_changed
-from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
 
 from apps.inventories.models import PlaceMember
 
 
+# Sent with place_id and product_ids when inventory items are written in bulk or upserted, which sends no post_save
+inventory_items_upserted = Signal()
+
+
+def _invalidate_default_places(profile_ids):
+    # imported here, as utils imports this module
+    from apps.inventories.utils import invalidate_default_place
+    invalidate_default_place(*profile_ids)
+
+
 @receiver(m2m_changed, sender=PlaceMember)
 def create_place_member(action, instance, pk_set, **_kwargs):
     if action == 'post_add':
@@ -17,3 +27,12 @@ def create_place_member(action, instance, pk_set, **_kwargs):
                 if placemember:
                     placemember.is_the_default_one = True
                     placemember.save()
+    if action in ('post_add', 'post_remove'):
+        _invalidate_default_places(pk_set)
+
+
+@receiver(post_save, sender=PlaceMember)
+@receiver(post_delete, sender=PlaceMember)
+def invalidate_default_place_of_member(instance, **_kwargs):
+    # also when members are removed from a place or the place is deleted, which delete their PlaceMember
+    _invalidate_default_places([instance.member_id])
@@ -1,22 +1,28 @@
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from common.utils import query_reverse
 
-from apps.recipes.models import Recipe
+from apps.inventories.models import Cart, InventoryItem, Place, PlaceMember
+from apps.products.models import Product, Unit
+from apps.recipes.models import Ingredient, Recipe
 
 ITEM_URL = reverse('cart-list')
+RECIPES_URL = reverse('cart-add-recipes')
 
 
-def cart_recipe(place, recipe, only_missing=False):
+def cart_recipe(place, recipe, only_missing=False, only_missing_quantity=False):
     """Return friendship detail accept url"""
     return query_reverse(
         'cart-add-recipe',
         query_kwargs={
             'place': place,
             'recipe': recipe,
-            'only_missing': only_missing
+            'only_missing': only_missing,
+            'only_missing_quantity': only_missing_quantity
         }
     )
 
@@ -64,7 +70,7 @@ class InventoryItemTests(APITestCase):
         self.assertEqual(item.quantity, 1)
         self.assertEqual(item.unit.short_name, 'L')
 
-    def test_adding_a_item_that_exists_should_create_it(self):
+    def test_adding_a_item_that_exists_should_add_amount(self):
         u_1 = sample_user_1()
         self.client.force_authenticate(user=u_1)
 
@@ -90,8 +96,31 @@ class InventoryItemTests(APITestCase):
 
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
         self.assertIsNotNone(res.data)
+        items = u_1.profile.places.first().cart
+        self.assertEqual(items.count(), 1)
+        item = items.first()
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual(item.unit.short_name, 'L')
+
+    def test_adding_a_item_that_exists_in_a_unit_that_cannot_be_converted_should_create_another(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+
+        for unit in ['unit', 'gram']:
+            res = self.client.post(
+                ITEM_URL,
+                data={
+                    'product': 'Leche',
+                    'quantity': 1,
+                    'unit': unit
+                },
+                format='json'
+            )
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
         items = u_1.profile.places.first().cart
         self.assertEqual(items.count(), 2)
+        self.assertEqual(sorted(items.values_list('unit__name', 'quantity')), [('gram', 1), ('unit', 1)])
 
     def test_adding_multiple_items_to_cart_should_create_them(self):
         u_1 = sample_user_1()
@@ -118,3 +147,179 @@ class InventoryItemTests(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIsNotNone(res.data)
         self.assertEqual(u_1.profile.places.count(), 0)
+
+    def sample_place(self, user):
+        place = Place.objects.create()
+        PlaceMember.objects.create(place=place, member=user.profile, is_the_default_one=True)
+        return place
+
+    def test_adding_recipe_with_only_missing_should_skip_products_in_inventory(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        recipe = Recipe.objects.first()
+        ingredient = recipe.ingredient_set.first()
+        InventoryItem.objects.create(place=place, product=ingredient.product, quantity=1, unit=ingredient.unit)
+
+        res = self.client.post(cart_recipe(place.id, recipe.id, only_missing=True), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(place.cart.count(), recipe.ingredients.count() - 1)
+        self.assertFalse(place.cart.filter(product=ingredient.product).exists())
+
+    def test_adding_recipe_with_only_missing_quantity_should_add_the_shortfall(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        recipe = Recipe.objects.first()
+        ingredients = recipe.ingredient_set.filter(quantity__isnull=False).order_by('pk')
+        short, covered = ingredients[0], ingredients[1]
+        not_quantified = recipe.ingredient_set.filter(quantity__isnull=True).first()
+        InventoryItem.objects.create(place=place, product=short.product,
+                                     quantity=short.quantity - 1, unit=short.unit)
+        InventoryItem.objects.create(place=place, product=covered.product,
+                                     quantity=covered.quantity + 1, unit=covered.unit)
+        InventoryItem.objects.create(place=place, product=not_quantified.product, quantity=1,
+                                     unit=Unit.objects.get(name='unit'))
+
+        res = self.client.post(cart_recipe(place.id, recipe.id, only_missing_quantity=True), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(place.cart.count(), recipe.ingredients.count() - 2)
+        item = place.cart.get(product=short.product)
+        self.assertEqual(item.quantity, 1)
+        self.assertEqual(item.unit, short.unit)
+        self.assertFalse(place.cart.filter(product__in=[covered.product, not_quantified.product]).exists())
+
+    def test_adding_recipe_should_add_to_existing_cart_items(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        recipe = Recipe.objects.first()
+        ingredient = recipe.ingredient_set.filter(quantity__isnull=False).first()
+        Cart.objects.create(place=place, product=ingredient.product, quantity=1, unit=ingredient.unit)
+
+        res = self.client.post(cart_recipe(place.id, recipe.id), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(place.cart.count(), recipe.ingredients.count())
+        self.assertEqual(place.cart.get(product=ingredient.product).quantity, ingredient.quantity + 1)
+
+    def sample_recipe(self, *amounts):
+        recipe = Recipe.objects.create(title='Licuado', description='Licuado')
+        for product, quantity, unit in amounts:
+            Ingredient.objects.create(recipe=recipe, product=Product.objects.get(name=product),
+                                      quantity=quantity, unit=Unit.objects.get(name=unit))
+        return recipe
+
+    def test_adding_recipe_with_amounts_that_cannot_be_converted_should_keep_them_apart(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        Cart.objects.create(place=place, product=Product.objects.get(name='Leche'), quantity=3, unit=None)
+        recipe = self.sample_recipe(('Leche', 2, 'unit'), ('Leche', 100, 'gram'), ('Leche', 50, 'gram'))
+
+        for only_missing_quantity in [False, True]:
+            res = self.client.post(cart_recipe(place.id, recipe.id, only_missing_quantity=only_missing_quantity),
+                                   format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(sorted(place.cart.values_list('unit__name', 'quantity'), key=str),
+                         [('gram', 300), ('unit', 4), (None, 3)])
+
+    def test_adding_recipe_should_not_query_per_ingredient(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        recipes = Recipe.objects.all()
+        small = min(recipes, key=lambda recipe: recipe.ingredients.count())
+        large = max(recipes, key=lambda recipe: recipe.ingredients.count())
+        self.assertLess(small.ingredients.count(), large.ingredients.count())
+
+        self.client.post(cart_recipe(place.id, small.id), format='json')
+        Cart.objects.all().delete()
+        with CaptureQueriesContext(connection) as small_queries:
+            self.client.post(cart_recipe(place.id, small.id, only_missing=True), format='json')
+        with CaptureQueriesContext(connection) as large_queries:
+            self.client.post(cart_recipe(place.id, large.id, only_missing=True), format='json')
+
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    def test_adding_recipes_should_aggregate_and_subtract_the_inventory(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        recipe = Recipe.objects.first()
+        ingredient = recipe.ingredient_set.filter(quantity__isnull=False).order_by('pk').first()
+        InventoryItem.objects.create(place=place, product=ingredient.product, quantity=1, unit=ingredient.unit)
+
+        res = self.client.post(
+            f'{RECIPES_URL}?place={place.id}',
+            data={'recipes': [{'recipe': recipe.id, 'multiplier': 2}, {'recipe': recipe.id}]},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), recipe.ingredients.count())
+        self.assertEqual(place.cart.count(), recipe.ingredients.count())
+        self.assertEqual(place.cart.get(product=ingredient.product).quantity, ingredient.quantity * 3 - 1)
+
+    def test_adding_recipes_should_not_query_per_recipe(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list('id', flat=True))
+
+        self.client.post(f'{RECIPES_URL}?place={place.id}', data={'recipes': [{'recipe': recipe_ids[0]}]},
+                         format='json')
+        Cart.objects.all().delete()
+        with CaptureQueriesContext(connection) as one_recipe_queries:
+            self.client.post(f'{RECIPES_URL}?place={place.id}', data={'recipes': [{'recipe': recipe_ids[0]}]},
+                             format='json')
+        Cart.objects.all().delete()
+        with CaptureQueriesContext(connection) as many_recipes_queries:
+            res = self.client.post(f'{RECIPES_URL}?place={place.id}',
+                                   data={'recipes': [{'recipe': recipe_id} for recipe_id in recipe_ids[:10]]},
+                                   format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(one_recipe_queries), len(many_recipes_queries))
+
+    def test_adding_recipes_with_wrong_recipe_should_not_create_them(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        recipe = Recipe.objects.first()
+
+        res = self.client.post(RECIPES_URL, data={'recipes': [{'recipe': recipe.id}, {'recipe': 2321321}]},
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(u_1.profile.places.count(), 0)
+
+    def test_adding_recipes_with_wrong_multiplier_should_fail(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        recipe = Recipe.objects.first()
+
+        res = self.client.post(RECIPES_URL, data={'recipes': [{'recipe': recipe.id, 'multiplier': 0}]},
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_adding_recipes_with_amounts_that_cannot_be_converted_should_add_them_apart(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        place = self.sample_place(u_1)
+        leche = Product.objects.get(name='Leche')
+        InventoryItem.objects.create(place=place, product=leche, quantity=1, unit=Unit.objects.get(name='unit'))
+        recipes = [self.sample_recipe(('Leche', 2, 'unit')), self.sample_recipe(('Leche', 100, 'gram'))]
+
+        res = self.client.post(
+            f'{RECIPES_URL}?place={place.id}',
+            data={'recipes': [{'recipe': recipe.id, 'multiplier': 2} for recipe in recipes]},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(place.cart.values_list('unit__name', 'quantity')), [('gram', 200), ('unit', 3)])
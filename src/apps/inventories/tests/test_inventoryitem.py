@@ -1,11 +1,25 @@
+import threading
+import time
+from decimal import Decimal
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from common.testing import local_caches
+from apps.inventories.models import InventoryItem, Place, PlaceMember
+from apps.inventories.utils import add_to_place, get_place_or_default, get_request_place, _default_place_key
+from apps.products.models import Product, Unit
+
 
 ITEM_URL = reverse('inventoryitems-list')
 ITEMS_URL = reverse('inventoryitems-add-items')
+DEFAULT_PLACE_URL = reverse('default-place')
 
 users = {
     'user_1': {
@@ -153,3 +167,223 @@ class InventoryItemTests(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIsNotNone(res.data)
         self.assertEqual(u_1.profile.places.count(), 0)
+
+    def test_adding_multiple_items_merges_them_into_existing_ones(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        self.client.post(ITEM_URL, data={'product': 'Leche', 'quantity': 1, 'unit': 'liter'}, format='json')
+
+        res = self.client.post(
+            ITEMS_URL,
+            data={
+                "items": [
+                    {
+                        'product': 'Leche',
+                        'quantity': 500,
+                        'unit': 'milliliter'
+                    },
+                    {
+                        'product': 'Leche Descremada',
+                        'quantity': 1,
+                        'unit': 'liter'
+                    },
+                    {
+                        'product': 'Leche',
+                        'quantity': 0.5,
+                        'unit': 'liter'
+                    },
+                ]
+            },
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(u_1.profile.places.count(), 1)
+        items = u_1.profile.places.first().inventory.order_by('product_id')
+        self.assertEqual([(item.product.id, item.quantity, item.unit.short_name) for item in items],
+                         [(1, 2, 'L'), (2, 1, 'L')])
+
+    def test_adding_multiple_items_takes_the_same_queries_for_any_number_of_items(self):
+        u_1 = sample_user_1()
+        self.client.force_authenticate(user=u_1)
+        self.client.post(ITEM_URL, data={'product': 'Leche', 'quantity': 1, 'unit': 'liter'}, format='json')
+
+        def add_items(n):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(
+                    ITEMS_URL,
+                    data={'items': [{'product': product, 'quantity': 1, 'unit': 'liter'}
+                                    for product in ['Leche', 'Leche Descremada'] * n]},
+                    format='json'
+                )
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        # so that both of them only update items
+        add_items(1)
+        self.assertEqual(add_items(1), add_items(100))
+
+
+class AddToPlaceTests(TestCase):
+    fixtures = ['unit']
+
+    def setUp(self):
+        self.place = Place.objects.create()
+        self.leche = Product.objects.create(name='Leche', density=1032)
+        self.liter = Unit.objects.get(name='liter')
+        add_to_place(InventoryItem, self.place, self.leche, 1, self.liter)
+
+    @local_caches
+    def test_amount_is_added_to_the_existing_item_in_one_statement(self):
+        add_to_place(InventoryItem, self.place, self.leche, 500, Unit.objects.get(name='milliliter'))
+        gram = Unit.objects.get(name='gram')
+
+        with self.assertNumQueries(1):
+            item = add_to_place(InventoryItem, self.place, self.leche, 516, gram)
+
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual(item.unit, self.liter)
+        self.assertEqual(self.place.inventory.get(), item)
+
+    def test_amounts_without_quantity_leave_the_item_as_it_was(self):
+        item = add_to_place(InventoryItem, self.place, self.leche, None, None)
+
+        self.assertEqual((item.quantity, item.unit), (1, self.liter))
+
+    def test_amounts_that_cannot_be_converted_are_kept_in_another_item(self):
+        unit = Unit.objects.get(name='unit')
+
+        item = add_to_place(InventoryItem, self.place, self.leche, 1, unit)
+        same_item = add_to_place(InventoryItem, self.place, self.leche, 2, unit)
+
+        self.assertEqual(same_item.id, item.id)
+        self.assertEqual(same_item.quantity, 3)
+        self.assertEqual(self.place.inventory.count(), 2)
+        self.assertEqual(self.place.inventory.get(unit=self.liter).quantity, 1)
+
+    def test_amounts_are_added_to_items_without_unit_only_without_unit(self):
+        InventoryItem.objects.create(place=self.place, product=self.leche, quantity=3, unit=None)
+
+        add_to_place(InventoryItem, self.place, self.leche, 2, None)
+        add_to_place(InventoryItem, self.place, self.leche, 500, Unit.objects.get(name='milliliter'))
+
+        self.assertEqual(self.place.inventory.get(unit=None).quantity, 5)
+        self.assertEqual(self.place.inventory.get(unit=self.liter).quantity, Decimal('1.5'))
+
+    def test_amounts_are_added_to_items_without_quantity(self):
+        sal = Product.objects.create(name='Sal')
+        InventoryItem.objects.create(place=self.place, product=sal, quantity=None, unit=None)
+        gram = Unit.objects.get(name='gram')
+
+        item = add_to_place(InventoryItem, self.place, sal, 100, gram)
+
+        self.assertEqual((item.quantity, item.unit_id), (100, gram.id))
+        self.assertEqual(self.place.inventory.get(product=sal), item)
+
+
+class ConcurrentAddToPlaceTests(TransactionTestCase):
+    fixtures = ['unit']
+
+    def setUp(self):
+        self.place = Place.objects.create()
+        self.leche = Product.objects.create(name='Leche', density=1032)
+
+    def _add_while_another_add_is_uncommitted(self, first_unit, second_unit):
+        added, release = threading.Event(), threading.Event()
+
+        def first_add():
+            try:
+                with transaction.atomic():
+                    add_to_place(InventoryItem, self.place, self.leche, 1, first_unit)
+                    added.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        def second_add():
+            try:
+                add_to_place(InventoryItem, self.place, self.leche, 1, second_unit)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first_add), threading.Thread(target=second_add)]
+        threads[0].start()
+        self.assertTrue(added.wait(5))
+        threads[1].start()
+        # gives the second add the time to insert an item of its own, if it's not kept waiting
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+    def test_concurrent_first_adds_without_unit_make_one_item(self):
+        self._add_while_another_add_is_uncommitted(None, None)
+
+        self.assertEqual(self.place.inventory.get().quantity, 2)
+
+    def test_concurrent_first_adds_in_convertible_units_make_one_item(self):
+        self._add_while_another_add_is_uncommitted(Unit.objects.get(name='kilogram'), Unit.objects.get(name='gram'))
+
+        self.assertEqual(self.place.inventory.get().quantity, Decimal('1.001'))
+
+
+class PlaceOrDefaultTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = sample_user_1()
+        self.profile = self.user.profile
+        self.place = Place.objects.create(name='Casa')
+        self.place.members.set([self.profile])
+
+    @local_caches
+    def test_default_place_is_fetched_in_one_query_once_known(self):
+        self.assertEqual(get_place_or_default(self.profile), self.place)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_place_or_default(self.profile), self.place)
+
+    def test_stale_default_place_is_not_used(self):
+        other_place = Place.objects.create(name='Ajena')
+        cache.set(_default_place_key(self.profile.id), other_place.id)
+
+        self.assertEqual(get_place_or_default(self.profile), self.place)
+        self.assertEqual(cache.get(_default_place_key(self.profile.id)), self.place.id)
+
+    def test_stale_default_place_of_profiles_without_places_is_not_used(self):
+        other_place = Place.objects.create(name='Ajena')
+        self.place.members.remove(self.profile)
+        cache.set(_default_place_key(self.profile.id), other_place.id)
+
+        self.assertIsNone(get_place_or_default(self.profile))
+
+    def test_default_place_changes_are_seen(self):
+        other_place = Place.objects.create(name='Trabajo')
+        other_place.members.set([self.profile])
+        self.assertEqual(get_place_or_default(self.profile), self.place)
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.post(f'{DEFAULT_PLACE_URL}?place_id={other_place.id}')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_place_or_default(self.profile), other_place)
+
+    def test_membership_changes_are_seen(self):
+        self.assertEqual(get_place_or_default(self.profile), self.place)
+        self.place.members.remove(self.profile)
+        self.assertIsNone(get_place_or_default(self.profile))
+
+        other_place = Place.objects.create(name='Trabajo')
+        PlaceMember.objects.create(place=other_place, member=self.profile, is_the_default_one=True)
+        self.assertEqual(get_place_or_default(self.profile), other_place)
+
+        other_place.delete()
+        self.assertIsNone(get_place_or_default(self.profile))
+
+    def test_place_is_resolved_once_per_request(self):
+        request = self.client.get('/').wsgi_request
+        request.user = self.user
+
+        self.assertEqual(get_request_place(request, self.place.id), self.place)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_request_place(request, self.place.id), self.place)
@@ -1,24 +1,389 @@
-from common.utils import get_object_or_none
+from decimal import Decimal, ROUND_UP
 
-from apps.inventories.models import PlaceMember
+from django.core.cache import cache as default_cache
+from django.db import connection, transaction
+
+from apps.inventories.models import Place, PlaceMember
+from apps.inventories.signals import inventory_items_upserted
+from apps.recipes.models import Ingredient
+from apps.products.utils import get_conversion_table, to_decimal
+
+
+# Default place pointers are also dropped when they change, this only bounds how long a stale one can live
+DEFAULT_PLACE_TIMEOUT = 60 * 60
+
+
+def _default_place_key(profile_id):
+    return f'default_place:{profile_id}'
+
+
+def get_default_place_id(profile_id):
+    """Id of the default place of the profile with profile_id (None if it has no places), cached per profile.
+
+    Only invalidated in the process that saw the change (unless the default cache is shared), so it may be
+    stale: the membership must still be checked when it's used.
+    """
+    key = _default_place_key(profile_id)
+    place_id = default_cache.get(key)
+    if place_id is None:
+        place_id = PlaceMember.objects.filter(
+            member_id=profile_id,
+            is_the_default_one=True
+        ).values_list('place_id', flat=True).first()
+        if place_id is not None:
+            # profiles without places aren't cached, as they'd get a new one if they stayed so
+            default_cache.set(key, place_id, DEFAULT_PLACE_TIMEOUT)
+    return place_id
+
+
+def invalidate_default_place(*profile_ids):
+    keys = [_default_place_key(profile_id) for profile_id in profile_ids]
+    default_cache.delete_many(keys)
+    # again once committed, in case a concurrent request cached the old pointer meanwhile
+    transaction.on_commit(lambda: default_cache.delete_many(keys))
 
 
 def get_place_or_default(profile, place_id=None):
     """
-    Uses get() to return a place by its id.
+    Returns a place by its id.
     If profile doesn't have this place, it will return Profile's default place.
 
     profile must be a Profile.
     place_id is optional.
     """
-    place_member = get_object_or_none(
-        PlaceMember,
-        member_id=profile.id,
-        place_id=place_id
-    ) or get_object_or_none(
-        PlaceMember,
-        member_id=profile.id,
-        is_the_default_one=True
-    )
-
-    return place_member.place if place_member else None
+    place = Place.objects.filter(id=place_id, members=profile.id).first() if place_id else None
+    if place is None:
+        default_place_id = get_default_place_id(profile.id)
+        if default_place_id:
+            place = Place.objects.filter(id=default_place_id, members=profile.id).first()
+            if place is None:
+                # stale pointer, e.g. from before the profile left the place in another process
+                invalidate_default_place(profile.id)
+                return get_place_or_default(profile)
+    return place
+
+
+def get_request_place(request, place_id=None):
+    """get_place_or_default for request's user, resolved once per request (for each place_id).
+
+    Only found places are kept, so a place created during the request is found afterwards.
+    """
+    places = getattr(request, '_places', None)
+    if places is None:
+        places = request._places = dict()
+    place = places.get(place_id)
+    if place is None:
+        place = get_place_or_default(request.user.profile, place_id)
+        if place is not None:
+            places[place_id] = place
+    return place
+
+
+def _item_table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _product_lock_key(model, place, product_id):
+    return f'{model._meta.db_table}:{place.id}:{product_id}'
+
+
+def _lock_products(model, place, product_ids):
+    """Locks, until the end of the transaction, adding to place's items of model of each of product_ids.
+
+    Row locks can't keep two concurrent first adds of a product from both inserting an item (e.g. in grams
+    and in kilograms), so adds take this advisory lock first, in the same order everywhere.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT pg_advisory_xact_lock(hashtext(key))
+            FROM (SELECT key FROM unnest(%s::text[]) AS key ORDER BY hashtext(key)) AS keys
+        ''', [[_product_lock_key(model, place, product_id) for product_id in set(product_ids)]])
+
+
+def _items_upserted(model, place, product_ids):
+    # raw SQL sends no post_save
+    inventory_items_upserted.send(sender=model, place_id=place.id, product_ids=set(product_ids))
+
+
+def add_to_place(model, place, product, quantity, unit):
+    """Adds an amount of product to place's InventoryItem or Cart (model) of that product, in one statement.
+
+    The amount is converted and added in SQL to the item of the product in the same unit, or else in one
+    it can be converted to, or else in one without quantity. If there's none, a new item is created, so
+    amounts that can't be converted to each other are kept in different items.
+    Adds of the product to place are serialized with the lock of _lock_products (taken in the same round trip,
+    and held until the end of the transaction), so concurrent adds are never lost nor make two items that
+    could be one.
+    """
+    table = _item_table(model)
+    params = {'place': place.id, 'product': product.id, 'quantity': quantity, 'unit': unit.id if unit else None,
+              'lock': _product_lock_key(model, place, product.id)}
+    if quantity is None:
+        # nothing to add, only makes sure there's an item
+        condition, update = 'TRUE', 'quantity = item.quantity'
+    else:
+        if unit is None:
+            convertible, factor = 'item.unit_id IS NULL', '1'
+        else:
+            factors = get_conversion_table(unit).exact_factors_from(unit, product)
+            params.update({f'unit_{i}': unit_id for i, unit_id in enumerate(factors)})
+            params.update({f'factor_{i}': factor for i, factor in enumerate(factors.values())})
+            convertible = f'item.unit_id IN ({", ".join(f"%(unit_{i})s" for i in range(len(factors)))})'
+            cases = ' '.join(f'WHEN %(unit_{i})s THEN %(factor_{i})s' for i in range(len(factors)))
+            factor = f'CASE item.unit_id {cases} END'
+        condition = f'{convertible} OR item.quantity IS NULL'
+        update = f'''quantity = CASE WHEN item.quantity IS NULL THEN %(quantity)s
+                                    ELSE item.quantity + %(quantity)s * {factor} END,
+                    unit_id = CASE WHEN item.quantity IS NULL THEN %(unit)s ELSE item.unit_id END'''
+
+    # the item without unit is only unique by its partial index
+    conflict = '(place_id, product_id) WHERE unit_id IS NULL' if unit is None else '(place_id, product_id, unit_id)'
+
+    with connection.cursor() as cursor:
+        # without a transaction, both statements still run in one (as they're sent together), so the lock is
+        # held until the item is written; the second one sees the items of whoever held it before
+        cursor.execute(f'''
+            SELECT pg_advisory_xact_lock(hashtext(%(lock)s));
+            WITH target AS (
+                SELECT item.id FROM {table} AS item
+                WHERE item.place_id = %(place)s AND item.product_id = %(product)s AND ({condition})
+                ORDER BY item.unit_id IS NOT DISTINCT FROM %(unit)s DESC, item.quantity IS NULL, item.id
+                LIMIT 1
+                FOR UPDATE
+            ), updated AS (
+                UPDATE {table} AS item SET {update}
+                FROM target WHERE item.id = target.id
+                RETURNING item.id, item.quantity, item.unit_id
+            ), inserted AS (
+                INSERT INTO {table} AS item (place_id, product_id, quantity, unit_id)
+                SELECT %(place)s, %(product)s, %(quantity)s::numeric, %(unit)s::integer
+                WHERE NOT EXISTS (SELECT FROM updated)
+                ON CONFLICT {conflict} DO UPDATE
+                SET quantity = COALESCE(item.quantity + EXCLUDED.quantity, item.quantity, EXCLUDED.quantity)
+                RETURNING item.id, item.quantity, item.unit_id
+            )
+            SELECT * FROM updated UNION ALL SELECT * FROM inserted
+        ''', params)
+        row = cursor.fetchone()
+
+    item = model.from_db(connection.alias, ['id', 'quantity', 'unit_id', 'place_id', 'product_id'],
+                         [*row, place.id, product.id])
+    item.place, item.product = place, product
+    _items_upserted(model, place, [product.id])
+    return item
+
+
+def insert_new_items(model, place, items):
+    """Inserts unsaved items (of place, each of a different product or unit) in one statement, and returns them.
+
+    Items of a product and unit that place got an item of meanwhile (e.g. in a concurrent request that
+    didn't take the lock of _lock_products) are added to it instead, with add_to_place.
+    """
+    if not items:
+        return []
+
+    table = _item_table(model)
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(items))
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {table} (place_id, product_id, quantity, unit_id) VALUES {values}
+            ON CONFLICT DO NOTHING
+            RETURNING id, product_id, unit_id
+        ''', [value for item in items for value in (place.id, item.product_id, item.quantity, item.unit_id)])
+        ids = dict(((product_id, unit_id), item_id) for item_id, product_id, unit_id in cursor.fetchall())
+
+    inserted = []
+    for item in items:
+        if (item.product_id, item.unit_id) in ids:
+            item.id = ids[item.product_id, item.unit_id]
+            item._state.adding = False
+            inserted.append(item)
+        else:
+            inserted.append(add_to_place(model, place, item.product, item.quantity, item.unit))
+    _items_upserted(model, place, [item.product_id for item in items])
+    return inserted
+
+
+def _item_to_add_to(items, product, unit, table):
+    """Of product's items, the one an amount in unit is added to, as in add_to_place, and the factor to its unit.
+
+    The factor is None for items without quantity, which take the amount's; the item is None if there's none.
+    """
+    candidates = []
+    for position, item in enumerate(items):
+        if item.quantity is None:
+            candidates.append((2, position, item, None))
+        elif item.unit_id == (unit.id if unit else None):
+            candidates.append((0, position, item, Decimal(1)))
+        elif item.unit is not None and unit is not None:
+            factor = table.exact_factor(unit, item.unit, product)
+            if factor is not None:
+                candidates.append((1, position, item, factor))
+    _, _, item, factor = min(candidates, key=lambda candidate: candidate[:2], default=(None, None, None, None))
+    return item, factor
+
+
+@transaction.atomic
+def add_amounts_to_place(model, place, amounts):
+    """Adds many amounts, as (product, quantity, unit), to place's items of model (InventoryItem or Cart) at once.
+
+    Amounts are merged as add_to_place does, with each other and with the place's items (adds of their products
+    are locked meanwhile, so that no concurrent add is lost or makes another item), so amounts that can't be
+    converted go to different items. Then they're written with one bulk update and one bulk insert
+    (see insert_new_items).
+    """
+    _lock_products(model, place, [product.id for product, _, _ in amounts])
+    items = dict()                       # product_id -> its items, existing and new
+    for item in (model.objects
+                 .filter(place=place, product_id__in={product.id for product, _, _ in amounts})
+                 .select_related('product', 'unit')
+                 .select_for_update(of=('self',))
+                 .order_by('id')):
+        items.setdefault(item.product_id, []).append(item)
+    table = get_conversion_table(*{unit for _, _, unit in amounts if unit is not None},
+                                 *{item.unit for product_items in items.values() for item in product_items
+                                   if item.unit is not None})
+
+    new_items, updated_items = [], dict()
+    for product, quantity, unit in amounts:
+        product_items = items.setdefault(product.id, [])
+        if quantity is None:
+            if not product_items:
+                # nothing to add, only makes sure there's an item
+                new_items.append(model(place=place, product=product, quantity=None, unit=unit))
+                product_items.append(new_items[-1])
+            continue
+
+        item, factor = _item_to_add_to(product_items, product, unit, table)
+        if item is None:
+            new_items.append(model(place=place, product=product, quantity=quantity, unit=unit))
+            product_items.append(new_items[-1])
+            continue
+        if factor is None:
+            item.quantity, item.unit = quantity, unit
+        else:
+            item.quantity = to_decimal(item.quantity) + to_decimal(quantity) * factor
+        if item.pk:
+            updated_items[item.pk] = item
+
+    if updated_items:
+        model.objects.bulk_update(updated_items.values(), ['quantity', 'unit'])
+        _items_upserted(model, place, [item.product_id for item in updated_items.values()])
+
+    return [*updated_items.values(), *insert_new_items(model, place, new_items)]
+
+
+@transaction.atomic
+def take_from_place(place, amounts):
+    """Subtracts amounts, as (product, quantity, unit), from place's inventory, e.g. when a recipe is cooked.
+
+    Each amount is taken from the item of its product add_to_place would add it to: in the same unit, or else
+    in one it can be converted to. Items left without quantity are deleted. Amounts without quantity, or that
+    no item can be converted to, leave the inventory as it was.
+    """
+    items = dict()                       # product_id -> its items
+    for item in (place.inventory
+                 .filter(product_id__in={product.id for product, _, _ in amounts})
+                 .select_related('product', 'unit')
+                 .select_for_update(of=('self',))
+                 .order_by('id')):
+        items.setdefault(item.product_id, []).append(item)
+    table = get_conversion_table(*{unit for _, _, unit in amounts if unit is not None},
+                                 *{item.unit for product_items in items.values() for item in product_items
+                                   if item.unit is not None})
+
+    for product, quantity, unit in amounts:
+        product_items = items.get(product.id, [])
+        item, factor = _item_to_add_to(product_items, product, unit, table)
+        if quantity is None or factor is None:
+            # nothing to take, or nothing to take it from
+            continue
+        item.quantity = to_decimal(item.quantity) - to_decimal(quantity) * factor
+        if item.quantity <= 0:
+            item.delete()
+            product_items.remove(item)
+        else:
+            item.save()
+
+
+# Smallest quantity stored (Amount.quantity has 3 decimal places)
+QUANTITY_STEP = Decimal('0.001')
+
+
+def get_recipes_amounts(recipes):
+    """The ingredients of many recipes, as (recipe_id, multiplier), as amounts: (product, quantity, unit).
+
+    Quantities are multiplied (rounded up to QUANTITY_STEP); all the ingredients are fetched in one query.
+    """
+    ingredients = dict()
+    for ingredient in (Ingredient.objects
+                       .filter(recipe_id__in={recipe_id for recipe_id, _ in recipes})
+                       .select_related('product', 'unit')
+                       .order_by('pk')):
+        ingredients.setdefault(ingredient.recipe_id, []).append(ingredient)
+
+    return [(ingredient.product,
+             None if ingredient.quantity is None
+             else (to_decimal(ingredient.quantity) * multiplier).quantize(QUANTITY_STEP, rounding=ROUND_UP),
+             ingredient.unit)
+            for recipe_id, multiplier in recipes for ingredient in ingredients.get(recipe_id, [])]
+
+
+def _exact_factor(table, from_unit, to_unit, product):
+    """table.exact_factor for units that may be None, which can only be converted to None."""
+    if from_unit is None or to_unit is None:
+        return Decimal(1) if from_unit is to_unit else None
+    return table.exact_factor(from_unit, to_unit, product)
+
+
+def get_shortfall(place, amounts):
+    """The part of amounts, as (product, quantity, unit), that place's inventory doesn't cover.
+
+    Amounts of the same product are added up in the unit of the first one they can be converted to, with
+    the exact factors of the conversion table, so a product needed in units that can't be converted to each
+    other gives one amount per unit. From each of them, the inventory items of the product that can be
+    converted to it are subtracted, so if there's none it's missing whole. Non-quantified amounts are
+    missing only if the product isn't there.
+    """
+    inventory = dict()                   # product_id -> its items
+    if place:
+        for item in (place.inventory
+                     .filter(product_id__in={product.id for product, _, _ in amounts})
+                     .select_related('unit')
+                     .order_by('id')):
+            inventory.setdefault(item.product_id, []).append(item)
+    table = get_conversion_table(*{unit for _, _, unit in amounts if unit is not None},
+                                 *{item.unit for items in inventory.values() for item in items
+                                   if item.unit is not None})
+
+    needed = dict()                      # product_id -> [[product, quantity, unit], ...], one per unit
+    not_quantified = dict()              # product_id -> its first amount without quantity
+    for product, quantity, unit in amounts:
+        if quantity is None:
+            not_quantified.setdefault(product.id, (product, quantity, unit))
+            continue
+        product_needed = needed.setdefault(product.id, [])
+        for amount in product_needed:
+            factor = _exact_factor(table, unit, amount[2], product)
+            if factor is not None:
+                amount[1] += to_decimal(quantity) * factor
+                break
+        else:
+            product_needed.append([product, to_decimal(quantity), unit])
+
+    shortfall = [amount for product_id, amount in not_quantified.items() if product_id not in inventory]
+    for product_id, product_needed in needed.items():
+        items = [item for item in inventory.get(product_id, []) if item.quantity is not None]
+        for product, quantity, unit in product_needed:
+            covering = []
+            for item in list(items):
+                factor = _exact_factor(table, item.unit, unit, product)
+                if factor is not None:
+                    # each item is subtracted only once
+                    items.remove(item)
+                    covering.append(to_decimal(item.quantity) * factor)
+            # rounded up, so that what's bought is enough
+            quantity = (quantity - sum(covering)).quantize(QUANTITY_STEP, rounding=ROUND_UP)
+            if quantity > 0:
+                shortfall.append((product, quantity, unit))
+    return shortfall
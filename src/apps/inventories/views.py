@@ -10,20 +10,27 @@ from django.shortcuts import get_object_or_404
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from apps.inventories.utils import get_place_or_default
+from apps.inventories.utils import (get_request_place,
+                                    invalidate_default_place,
+                                    get_recipes_amounts,
+                                    get_shortfall,
+                                    add_amounts_to_place)
 from apps.inventories.models import (Place,
                                      InventoryItem,
                                      PlaceMember,
                                      Purchase,
                                      Cart,
-                                     BarCode
+                                     BarCode,
+                                     DEFAULT_PLACE_NAME,
                                      )
 from apps.inventories.serializers import (PlaceSerializer,
                                           InventoryItemSerializer,
                                           PurchaseSerializer,
                                           CartSerializer,
+                                          ShoppingListRecipeSerializer,
                                           BarCodeSerializer)
-from apps.recipes.models import (Recipe, Ingredient)
+from apps.products.models import Product
+from apps.recipes.models import Recipe
 from common.utils import qr_image_from_string
 
 
@@ -164,7 +171,7 @@ class InventoryItemViewSet(viewsets.GenericViewSet,
     search_fields = ['product__name']
 
     def get_queryset(self):
-        place = get_place_or_default(self.request.user.profile, self.request.query_params.get('place'))
+        place = get_request_place(self.request, self.request.query_params.get('place'))
         return self.filter_queryset(InventoryItem.objects.filter(place=place).order_by('product__name'))
 
     @swagger_auto_schema(
@@ -181,7 +188,7 @@ class InventoryItemViewSet(viewsets.GenericViewSet,
         ]
     )
     def create(self, request, *args, **kwargs):
-        place = get_place_or_default(request.user.profile, request.query_params.get('place'))
+        place = get_request_place(request, request.query_params.get('place'))
 
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -231,27 +238,31 @@ class InventoryItemViewSet(viewsets.GenericViewSet,
         if 'items' not in request.data:
             return Response({'message': 'Should provide items key!'}, status=status.HTTP_400_BAD_REQUEST)
 
-        for item in request.data.get('items'):
-            # TODO: mejorar para que no tenga que pedir el place siempre
-            place = get_place_or_default(request.user.profile, request.query_params.get('place'))
-
-            serializer = self.get_serializer(data=item)
-            if serializer.is_valid():
-                if place:
-                    # place_id is correct for this user or has default one
-                    serializer.save(place=place)
-                else:
-                    # user does not have a place yet
-                    serializer.save()
-            else:
-                savepoint_rollback(sid)
-                return Response(
-                    {
-                        'msg': "Cannot add Item!",
-                        'errors': serializer.errors
-                    },
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        items = request.data.get('items')
+        place = get_request_place(request, request.query_params.get('place'))
+
+        # all the products in one query, instead of one per item
+        product_names = {item.get('product') for item in items if isinstance(item, dict)} \
+            if isinstance(items, list) else set()
+        products = {product.name: product for product in Product.objects.filter(
+            name__in=[name for name in product_names if isinstance(name, str)])}
+
+        serializer = self.get_serializer_class()(data=items, many=True,
+                                                 context={**self.get_serializer_context(), 'products': products})
+        if not serializer.is_valid():
+            savepoint_rollback(sid)
+            errors = serializer.errors
+            return Response(
+                {
+                    'msg': "Cannot add Item!",
+                    # the first item that couldn't be added, as when they were added one by one
+                    'errors': next(filter(None, errors), {}) if isinstance(errors, list) else errors
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # place_id is correct for this user or has default one, if it's None one is created
+        serializer.save(place=place)
         savepoint_commit(sid)
         return Response({'message': 'All the items were created!'}, status=status.HTTP_201_CREATED)
 
@@ -284,6 +295,7 @@ def default_place(request):
             Q(member_id=request.user.profile) &
             Q(place_id=place_id)
         ).update(is_the_default_one=True)
+        invalidate_default_place(request.user.profile.id)
         return Response({'message': 'Your place has changed!'}, status=status.HTTP_200_OK)
     return Response({'message': 'place_id must be provided!'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -353,7 +365,7 @@ class CartViewSet(viewsets.GenericViewSet,
     search_fields = ['product__name', 'place__name']
 
     def get_queryset(self):
-        place = get_place_or_default(self.request.user.profile, self.request.query_params.get('place'))
+        place = get_request_place(self.request, self.request.query_params.get('place'))
         return self.filter_queryset(Cart.objects.filter(place=place).order_by('product__name'))
 
     def destroy(self, *_args, **kwargs):
@@ -380,7 +392,7 @@ class CartViewSet(viewsets.GenericViewSet,
         ]
     )
     def create(self, request, *args, **kwargs):
-        place = get_place_or_default(request.user.profile, request.query_params.get('place'))
+        place = get_request_place(request, request.query_params.get('place'))
 
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -424,57 +436,107 @@ class CartViewSet(viewsets.GenericViewSet,
                 type=openapi.TYPE_BOOLEAN,
                 required=False
             ),
+            openapi.Parameter(
+                'only_missing_quantity',
+                in_=openapi.IN_QUERY,
+                description='Parameter indicating whether only the quantities missing from the inventory need to be '
+                            'added to the cart. Takes precedence over only_missing.',
+                type=openapi.TYPE_BOOLEAN,
+                required=False
+            ),
         ]
     )
     @action(detail=False, methods=['POST'])
     @atomic
     def add_recipe(self, request):
-        sid = savepoint()
-        only_missing = request.query_params.get('only_missing')
+        only_missing = request.query_params.get('only_missing') in ('True', 'true')
+        only_missing_quantity = request.query_params.get('only_missing_quantity') in ('True', 'true')
         recipe_id = request.query_params.get('recipe')
         if not recipe_id:
             return Response({'message': 'Must provide the recipe!'}, status=status.HTTP_400_BAD_REQUEST)
 
         recipe = get_object_or_404(Recipe.objects.all(), id=recipe_id)
-        ingredients = Ingredient.objects.filter(recipe=recipe)
-        place = get_place_or_default(self.request.user.profile, self.request.query_params.get('place'))
-
-        for ingredient in ingredients:
-            # TODO: mejorar para que no tenga que pedir el place siempre
-            place = get_place_or_default(request.user.profile, request.query_params.get('place'))
-
-            if (
-                    (only_missing == 'True' or only_missing == 'true') and
-                    place and
-                    place.inventory.filter(product__id=ingredient.product.id).exists()
-            ):
-                continue
-
-            serializer = self.get_serializer(data={
-                'quantity': ingredient.quantity,
-                'unit': ingredient.unit,
-                'product': ingredient.product
-            })
-            if serializer.is_valid():
-                if place:
-                    # place_id is correct for this user or has default one
-                    serializer.save(place=place)
-                else:
-                    # user does not have a place yet
-                    serializer.save()
-            else:
-                savepoint_rollback(sid)
-                return Response(
-                    {
-                        'msg': "Cannot add item to cart!",
-                        'errors': serializer.errors
-                    },
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-        savepoint_commit(sid)
+        amounts = [(ingredient.product, ingredient.quantity, ingredient.unit)
+                   for ingredient in recipe.ingredient_set.select_related('product', 'unit')]
+        place = get_request_place(request, request.query_params.get('place'))
+
+        if only_missing_quantity:
+            amounts = get_shortfall(place, amounts)
+        elif only_missing and place:
+            in_inventory = set(place.inventory.filter(product_id__in={product.id for product, _, _ in amounts})
+                               .values_list('product_id', flat=True))
+            amounts = [amount for amount in amounts if amount[0].id not in in_inventory]
+
+        self._add_to_cart(place, amounts)
         return Response({'message': 'All the items were created!'}, status=status.HTTP_201_CREATED)
 
+    @swagger_auto_schema(
+        method='post',
+        operation_summary='Add the shopping list of many recipes to the cart in that place.',
+        operation_description='Adds up the ingredients of all the recipes (each multiplied by its multiplier) '
+                              'per product, subtracts what the inventory of the place already has, and adds '
+                              'the rest to its cart. Returns the cart items that were added to.',
+        manual_parameters=[
+            openapi.Parameter(
+                'place',
+                in_=openapi.IN_QUERY,
+                description='Place. If wrong or null, default one is going to be used.',
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+        ],
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['recipes'],
+            properties={
+                'recipes': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    required=['recipe'],
+                    properties={
+                        'recipe': openapi.Schema(type=openapi.TYPE_INTEGER, description='Recipe.'),
+                        'multiplier': openapi.Schema(type=openapi.TYPE_NUMBER,
+                                                     description='Times the recipe is cooked. 1 by default.'),
+                    }
+                ))
+            }
+        ),
+        responses={201: CartSerializer(many=True)}
+    )
+    @action(detail=False, methods=['POST'])
+    @atomic
+    def add_recipes(self, request):
+        if 'recipes' not in request.data:
+            return Response({'message': 'Should provide recipes key!'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ShoppingListRecipeSerializer(data=request.data.get('recipes'), many=True)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    'msg': "Cannot add recipes to cart!",
+                    'errors': serializer.errors
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        recipes = [(recipe['recipe'], recipe['multiplier']) for recipe in serializer.validated_data]
+        recipe_ids = {recipe_id for recipe_id, _ in recipes}
+        missing = recipe_ids - set(Recipe.objects.filter(id__in=recipe_ids).values_list('id', flat=True))
+        if missing:
+            return Response({'message': f'Recipes {sorted(missing)} not found!'}, status=status.HTTP_404_NOT_FOUND)
+
+        place = get_request_place(request, request.query_params.get('place'))
+        items = self._add_to_cart(place, get_shortfall(place, get_recipes_amounts(recipes)))
+        return Response(self.get_serializer(items, many=True).data, status=status.HTTP_201_CREATED)
+
+    def _add_to_cart(self, place, amounts):
+        """Adds amounts, as (product, quantity, unit), to place's cart at once, creating a place if it's None."""
+        if not amounts:
+            return []
+        if not place:
+            # user does not have a place yet
+            place = PlaceSerializer.create(self.get_serializer(), {'name': DEFAULT_PLACE_NAME})
+        return add_amounts_to_place(Cart, place, amounts)
+
     @swagger_auto_schema(
         operation_summary="Delete all cart items for a place.",
         manual_parameters=[
@@ -489,7 +551,7 @@ class CartViewSet(viewsets.GenericViewSet,
     )
     @action(detail=False, methods=['DELETE'])
     def delete_all_items(self, request):
-        place = get_place_or_default(request.user.profile, request.query_params.get('place'))
+        place = get_request_place(request, request.query_params.get('place'))
 
         Cart.objects.filter(place=place).delete()
 
@@ -530,7 +592,7 @@ class BarCodeViewSet(mixins.CreateModelMixin,
     )
     @action(detail=True, methods=['POST'])
     def add_item(self, request, pk=None):
-        place = get_place_or_default(request.user.profile, request.query_params.get('place'))
+        place = get_request_place(request, request.query_params.get('place'))
 
         item = get_object_or_404(BarCode.objects.all(), id=pk)
 
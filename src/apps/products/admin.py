@@ -1,5 +1,7 @@
+from django import forms
 from django.contrib import admin
 
+from apps.products.dimensionality import Dimensionality, dimensionalities_mask
 from apps.products.models import Unit, Product
 
 
@@ -9,10 +11,37 @@ class UnitAdmin(admin.ModelAdmin):
     ordering = ('pk',)
 
 
+class ProductAdminForm(forms.ModelForm):
+    # stored as a bitmask, edited as the dimensionalities in it
+    available_dimensionalities = forms.MultipleChoiceField(
+        choices=[(dimensionality.value, dimensionality.value) for dimensionality in Dimensionality],
+        widget=forms.CheckboxSelectMultiple,
+    )
+
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial['available_dimensionalities'] = [dimensionality.value
+                                                      for dimensionality in self.instance.dimensionalities]
+
+    def clean_available_dimensionalities(self):
+        values = self.cleaned_data['available_dimensionalities']
+        return dimensionalities_mask(Dimensionality(value) for value in values)
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
+    form = ProductAdminForm
+    list_display = ('name', 'dimensionalities_str')
     ordering = ('name',)
     readonly_fields = ('recipes',)
 
     def recipes(self, obj):
         return '\n'.join([str(recipe) for recipe in obj.recipe_set.all().distinct()])
+
+    def dimensionalities_str(self, obj):
+        return ', '.join([dimensionality.value for dimensionality in obj.dimensionalities])
+    dimensionalities_str.short_description = "Dimensionalities"
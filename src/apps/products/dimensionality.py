@@ -5,3 +5,30 @@ class Dimensionality(models.TextChoices):
     UNIT = '[unit]'
     VOLUME = '[volume]', '[length] ** 3'
     MASS = '[mass]'
+
+
+# Bit of each dimensionality in Product.available_dimensionalities
+DIMENSIONALITY_BITS = {
+    Dimensionality.UNIT: 1,
+    Dimensionality.MASS: 2,
+    Dimensionality.VOLUME: 4,
+}
+ALL_DIMENSIONALITIES = sum(DIMENSIONALITY_BITS.values())
+
+
+def dimensionalities_mask(dimensionalities):
+    """Bitmask of the given dimensionalities, KeyError if any of them is unknown."""
+    mask = 0
+    for dimensionality in dimensionalities:
+        mask |= DIMENSIONALITY_BITS[dimensionality]
+    return mask
+
+
+def dimensionalities_in(mask):
+    """Dimensionalities in the bitmask, in declaration order."""
+    return [dimensionality for dimensionality, bit in DIMENSIONALITY_BITS.items() if mask & bit]
+
+
+def masks_including(mask):
+    """Every bitmask with all the bits of mask; there are few, so filtering with them can use the index."""
+    return [other for other in range(ALL_DIMENSIONALITIES + 1) if other & mask == mask]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+# Bits of apps.products.dimensionality.DIMENSIONALITY_BITS, by the names that were stored comma-separated
+DIMENSIONALITY_BITS = {'[unit]': 1, '[mass]': 2, '[volume]': 4, '[length] ** 3': 4}
+
+
+def dimensionalities_to_mask(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.only('id', 'available_dimensionalities'))
+    for product in products:
+        product.dimensionalities_mask = 0
+        for dimensionality in product.available_dimensionalities.split(','):
+            product.dimensionalities_mask |= DIMENSIONALITY_BITS.get(dimensionality.strip(), 0)
+    Product.objects.bulk_update(products, ['dimensionalities_mask'], batch_size=1000)
+
+
+def mask_to_dimensionalities(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.only('id', 'dimensionalities_mask'))
+    for product in products:
+        product.available_dimensionalities = ','.join(
+            dimensionality for dimensionality, bit in list(DIMENSIONALITY_BITS.items())[:3]
+            if product.dimensionalities_mask & bit)
+    Product.objects.bulk_update(products, ['available_dimensionalities'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_auto_20201008_2213'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='dimensionalities_mask',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.RunPython(dimensionalities_to_mask, mask_to_dimensionalities),
+    ]
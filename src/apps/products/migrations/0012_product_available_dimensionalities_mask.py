@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_dimensionalities_mask'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='product',
+            name='available_dimensionalities',
+        ),
+        migrations.RenameField(
+            model_name='product',
+            old_name='dimensionalities_mask',
+            new_name='available_dimensionalities',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='available_dimensionalities',
+            field=models.PositiveSmallIntegerField(db_index=True, default=1),
+        ),
+    ]
@@ -1,9 +1,15 @@
 from django.db import models
 
-from apps.products.dimensionality import Dimensionality
+from apps.products.dimensionality import (Dimensionality,
+                                          DIMENSIONALITY_BITS,
+                                          dimensionalities_in,
+                                          dimensionalities_mask,
+                                          masks_including)
 from apps.products.utils import (sub_quantities_with_units,
                                  add_quantities_with_units,
-                                 convert_to_correct_unit)
+                                 convert_to_correct_unit,
+                                 convert_quantity_exactly,
+                                 to_decimal)
 
 
 class Unit(models.Model):
@@ -35,6 +41,11 @@ class Amount(models.Model):
 
         Returns True if this amount is no longer usable.
         """
+        other_quantity = convert_quantity_exactly(self, other)
+        if other_quantity is not None:
+            self.quantity = to_decimal(self.quantity) - other_quantity
+            return self.quantity <= 0
+
         obj, other = convert_to_correct_unit(self, other)
 
         quantity_result = sub_quantities_with_units(
@@ -47,6 +58,11 @@ class Amount(models.Model):
     def __add__(self, other):
         """Add own quantity with other's.
         """
+        other_quantity = convert_quantity_exactly(self, other)
+        if other_quantity is not None:
+            self.quantity = to_decimal(self.quantity) + other_quantity
+            return
+
         obj, other = convert_to_correct_unit(self, other)
 
         quantity_result = add_quantities_with_units(
@@ -73,21 +89,33 @@ class Amount(models.Model):
         return f'{self.quantity:.2f}'.rstrip('0').rstrip('.') if self.quantity else ''
 
 
+class ProductQuerySet(models.QuerySet):
+    def measurable_in(self, *dimensionalities):
+        """Products available in all the given dimensionalities."""
+        return self.filter(available_dimensionalities__in=masks_including(dimensionalities_mask(dimensionalities)))
+
+
 class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     name = models.CharField(max_length=300, unique=True)
-    available_dimensionalities = models.CharField(
-        max_length=300,
-        default=Dimensionality.UNIT
-    )  # split by comma
+    available_dimensionalities = models.PositiveSmallIntegerField(
+        default=DIMENSIONALITY_BITS[Dimensionality.UNIT],
+        db_index=True
+    )  # bitmask, see apps.products.dimensionality
     density = models.DecimalField(max_digits=12, decimal_places=5, null=True, blank=True)  # kg / m ** 3
     avg_unit_weight = models.DecimalField(max_digits=12, decimal_places=5, null=True, blank=True)  # kg
     avg_unit_volume = models.DecimalField(max_digits=12, decimal_places=5, null=True, blank=True)  # L
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    @property
+    def dimensionalities(self):
+        return dimensionalities_in(self.available_dimensionalities)
+
 
 class ProductWithAmount(Amount):
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
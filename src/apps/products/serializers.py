@@ -1,8 +1,11 @@
 from decimal import Decimal
+from functools import partial
 
 from rest_framework import serializers
 
 from apps.products.models import Unit, Product
+from common.cache import get_reference_data
+from common.fields import ReferenceSlugRelatedField
 
 
 class UnitSerializer(serializers.ModelSerializer):
@@ -13,8 +16,7 @@ class UnitSerializer(serializers.ModelSerializer):
 
 
 class AmountSerializer(serializers.Serializer):
-    unit = serializers.SlugRelatedField(
-        slug_field='name',
+    unit = ReferenceSlugRelatedField(
         queryset=Unit.objects.all(),
         allow_null=True
     )
@@ -28,11 +30,16 @@ class AmountSerializer(serializers.Serializer):
         """Convert `quantity` to rounded value."""
         ret = super().to_representation(instance)
         if (ret['quantity']):
-            s = str(round(Decimal(ret['quantity']), 2))
-            ret['quantity'] = s.rstrip('0').rstrip('.') if '.' in s else s
+            ret['quantity'] = format_quantity(ret['quantity'])
         return ret
 
 
+def format_quantity(quantity, places=2):
+    """quantity rounded to places, without trailing zeros."""
+    s = str(round(Decimal(quantity), places))
+    return s.rstrip('0').rstrip('.') if '.' in s else s
+
+
 class ProductSerializer(serializers.ModelSerializer):
     available_units = serializers.SerializerMethodField()
 
@@ -41,9 +48,13 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'available_units']
 
     def get_available_units(self, obj):
-        dimensionalities = obj.available_dimensionalities.split(',')
-        units = UnitSerializer(Unit.objects.filter(dimensionality__in=dimensionalities), many=True)
-        return units.data
+        # serialized once per combination of dimensionalities, until units change
+        key = ('available_units', obj.available_dimensionalities)
+        return get_reference_data(Unit).derived(key, partial(serialize_units, obj.dimensionalities))
+
+
+def serialize_units(dimensionalities, units):
+    return UnitSerializer([unit for unit in units.all if unit.dimensionality in dimensionalities], many=True).data
 
 
 class ProductMinimalSerializer(serializers.ModelSerializer):
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.products.models import Unit
+from apps.products.utils import invalidate_conversion_table
+from common.cache import invalidate_reference_data
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def invalidate_unit_conversions(**_kwargs):
+    # other processes rebuild theirs when they come across a unit they don't know
+    invalidate_conversion_table()
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def invalidate_units(**_kwargs):
+    invalidate_reference_data(Unit)
@@ -37,3 +37,22 @@ class AmountTests(TestCase):
         self.assertIn('cup', am6.__str__())
         self.assertIn('cups', am7.__str__())
         self.assertIn('cup', am8.__str__())
+
+    def test_adding_and_substracting_is_exact(self):
+        amount = Amount(unit=self.liter_unit, quantity=Decimal('1.000'))
+        milliliter = Amount(unit=Unit.objects.get(short_name='mL'), quantity=Decimal('0.1'))
+
+        for _ in range(1000):
+            _ = amount + milliliter
+        self.assertEqual(amount.quantity, Decimal('1.1'))
+
+        for _ in range(1000):
+            _ = amount - milliliter
+        self.assertEqual(amount.quantity, Decimal('1'))
+
+    def test_cups_are_converted_with_their_exact_ratio(self):
+        amount = Amount(unit=self.liter_unit, quantity=Decimal('0'))
+
+        _ = amount + Amount(unit=self.cup_unit, quantity=Decimal('4'))
+
+        self.assertEqual(amount.quantity, Decimal('0.946352946'))
@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from common.testing import local_caches
+from apps.products.models import Product
+
+
+class ConvertAmountsTests(APITestCase):
+    fixtures = ['unit']
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username='test', email='test@test.com')
+        self.client.force_authenticate(user=self.user)
+        Product.objects.create(name='Leche', density=1032)
+        Product.objects.create(name='Manzana', avg_unit_weight=0.25)
+
+    def convert(self, amounts):
+        return self.client.post(reverse('convert-amounts'), amounts, format='json')
+
+    def test_amounts_are_converted_in_order(self):
+        resp = self.convert([
+            {'quantity': 1.5, 'from_unit': 'liter', 'to_unit': 'milliliter'},
+            {'product': 'Leche', 'quantity': '1', 'from_unit': 'liter', 'to_unit': 'gram'},
+            {'product': 'Manzana', 'quantity': 500, 'from_unit': 'gram', 'to_unit': 'unit'},
+            {'quantity': 1, 'from_unit': 'cup', 'to_unit': 'milliliter'},
+        ])
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data, [
+            {'quantity': '1500', 'unit': 'milliliter'},
+            {'quantity': '1032', 'unit': 'gram'},
+            {'quantity': '2', 'unit': 'unit'},
+            {'quantity': '236.588', 'unit': 'milliliter'},
+        ])
+
+    def test_amounts_that_cannot_be_converted_have_an_error(self):
+        resp = self.convert([
+            {'quantity': 1, 'from_unit': 'liter', 'to_unit': 'gram'},
+            {'product': 'Manzana', 'quantity': 1, 'from_unit': 'liter', 'to_unit': 'gram'},
+            {'product': 'Pera', 'quantity': 1, 'from_unit': 'gram', 'to_unit': 'unit'},
+            {'quantity': 1, 'from_unit': 'furlong', 'to_unit': 'gram'},
+        ])
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(all(result['quantity'] is None and result['error'] for result in resp.data))
+
+    @local_caches
+    def test_many_amounts_take_constant_queries(self):
+        amounts = [{'product': 'Leche', 'quantity': i, 'from_unit': 'milliliter', 'to_unit': 'kilogram'}
+                   for i in range(1000)]
+
+        self.convert(amounts[:1])
+
+        # units and conversion factors are already in memory, so just the products
+        with self.assertNumQueries(1):
+            resp = self.convert(amounts)
+
+        self.assertEqual(len(resp.data), 1000)
+        self.assertEqual(resp.data[500]['quantity'], '0.516')
+
+    def test_malformed_amounts_are_rejected(self):
+        for amounts in [{'quantity': 1}, [{'quantity': 'a lot', 'from_unit': 'liter', 'to_unit': 'liter'}],
+                        [{'quantity': 1, 'from_unit': 'liter'}]]:
+            self.assertEqual(self.convert(amounts).status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,5 +1,7 @@
 from django.test import TestCase
-from apps.products.utils import convert_to_correct_unit
+from pint.errors import DimensionalityError
+
+from apps.products.utils import convert_to_correct_unit, _convert_with_pint, get_conversion_table
 
 from apps.products.models import Amount, Product, Unit
 from apps.inventories.models import InventoryItem, Place
@@ -127,3 +129,45 @@ class ConverterTests(TestCase):
 
         self.assertEqual(round(other.magnitude), 1000)
         self.assertEqual(round((obj - other).magnitude), 0)
+
+    def test_conversion_table_gives_same_results_as_pint(self):
+        for product in (self.leche, self.leche_descremada, self.manzana):
+            for obj_unit in Unit.objects.all():
+                item = InventoryItem(place=self.place, product=product, quantity=3.0, unit=obj_unit)
+                for other_unit in Unit.objects.all():
+                    if obj_unit.name == 'unit' and other_unit.name not in ('unit', 'kilogram', 'liter'):
+                        # pint path ignored scale of other units here, see test below
+                        continue
+                    amount = Amount(unit=other_unit, quantity=2.5)
+                    try:
+                        expected_obj, expected_other = _convert_with_pint(item, amount)
+                    except DimensionalityError:
+                        with self.assertRaises(DimensionalityError):
+                            convert_to_correct_unit(item, amount)
+                        continue
+
+                    obj, other = convert_to_correct_unit(item, amount)
+
+                    self.assertEqual(obj, expected_obj)
+                    self.assertEqual(other.units, expected_other.units)
+                    self.assertAlmostEqual(float(other.magnitude), float(expected_other.magnitude), places=9,
+                                           msg=f'{product} {other_unit} -> {obj_unit}')
+
+    def test_convert_non_base_unit_to_unit(self):
+        """ When converting 504g to unit with avg_unit_weight=0.252kg, should return 2"""
+
+        item = InventoryItem(place=self.place, product=self.manzana, quantity=1, unit=Unit.objects.get(name='unit'))
+        amount = Amount(unit=Unit.objects.get(short_name='g'), quantity=504)
+
+        _, other = convert_to_correct_unit(item, amount)
+
+        self.assertAlmostEqual(other.magnitude, 2)
+
+    def test_conversion_table_is_rebuilt_when_units_change(self):
+        liter = Unit.objects.get(short_name='L')
+        table = get_conversion_table(liter)
+        self.assertIs(get_conversion_table(liter), table)
+
+        cup = Unit.objects.create(name='cup_2', short_name='cup_2')
+        cup.name = 'cup'
+        self.assertIsNot(get_conversion_table(liter, cup), table)
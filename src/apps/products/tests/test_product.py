@@ -1,6 +1,11 @@
+from django.core.cache import cache
 from django.test import TestCase
 
-from apps.products.models import Product
+from common.testing import local_caches
+from apps.products.admin import ProductAdminForm
+from apps.products.dimensionality import Dimensionality, dimensionalities_mask
+from apps.products.models import Product, Unit
+from apps.products.serializers import ProductSerializer
 
 
 class ProductTests(TestCase):
@@ -13,3 +18,64 @@ class ProductTests(TestCase):
         self.assertEqual(self.pr1.__str__(), "Harina 0000")
         self.assertEqual(self.pr2.__str__(), "Choclo en grano")
         self.assertEqual(self.pr3.__str__(), "Porotos rojos")
+
+
+MASS_OR_VOLUME = dimensionalities_mask([Dimensionality.MASS, Dimensionality.VOLUME])
+
+
+class ProductSerializerTests(TestCase):
+    fixtures = ['unit']
+
+    def setUp(self):
+        cache.clear()
+        self.products = [Product.objects.create(name=f'Product {i}', available_dimensionalities=MASS_OR_VOLUME)
+                         for i in range(10)]
+
+    @local_caches
+    def test_available_units_do_not_query_per_product(self):
+        # just the units, once
+        with self.assertNumQueries(1):
+            data = ProductSerializer(self.products, many=True).data
+
+        units = {unit['name'] for unit in data[0]['available_units']}
+        self.assertIn('gram', units)
+        self.assertIn('liter', units)
+        self.assertNotIn('unit', units)
+        self.assertTrue(all(product['available_units'] == data[0]['available_units'] for product in data))
+
+    def test_available_units_follow_unit_changes(self):
+        ProductSerializer(self.products[0]).data
+        Unit.objects.create(name='stone', short_name='st', dimensionality='[mass]')
+
+        units = {unit['name'] for unit in ProductSerializer(self.products[0]).data['available_units']}
+        self.assertIn('stone', units)
+
+
+class ProductDimensionalitiesTests(TestCase):
+    def setUp(self):
+        self.leche = Product.objects.create(name='Leche', available_dimensionalities=MASS_OR_VOLUME)
+        self.manzana = Product.objects.create(
+            name='Manzana',
+            available_dimensionalities=dimensionalities_mask([Dimensionality.UNIT, Dimensionality.MASS]))
+
+    def test_dimensionalities_come_from_mask(self):
+        self.assertEqual(self.leche.dimensionalities, [Dimensionality.MASS, Dimensionality.VOLUME])
+        self.assertEqual(Product(name='Huevo').dimensionalities, [Dimensionality.UNIT])
+
+    def test_products_are_filtered_by_dimensionalities(self):
+        self.assertEqual(list(Product.objects.measurable_in(Dimensionality.MASS).order_by('id')),
+                         [self.leche, self.manzana])
+        self.assertEqual(list(Product.objects.measurable_in(Dimensionality.VOLUME)), [self.leche])
+        self.assertEqual(list(Product.objects.measurable_in(Dimensionality.UNIT, Dimensionality.VOLUME)), [])
+
+    def test_admin_edits_dimensionalities_instead_of_mask(self):
+        form = ProductAdminForm(instance=self.manzana)
+        self.assertEqual(form.initial['available_dimensionalities'], [Dimensionality.UNIT, Dimensionality.MASS])
+
+        form = ProductAdminForm({'name': 'Manzana', 'available_dimensionalities': [Dimensionality.VOLUME]},
+                                instance=self.manzana)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+
+        self.manzana.refresh_from_db()
+        self.assertEqual(self.manzana.dimensionalities, [Dimensionality.VOLUME])
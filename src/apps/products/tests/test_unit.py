@@ -1,6 +1,9 @@
+import os
+import tempfile
+
 from django.test import TestCase
 from pint import errors
-from common.utils import Q_
+from common.utils import Q_, get_unit_registry, _build_unit_registry
 
 from apps.products.models import Unit
 from apps.products.utils import add_quantities_with_units, sub_quantities_with_units
@@ -29,6 +32,18 @@ class UnitTests(TestCase):
 
 
 class UnitUtilsTests(TestCase):
+    def test_unit_registry_is_shared_by_quantities(self):
+        self.assertIs(get_unit_registry(), get_unit_registry())
+        self.assertEqual(Q_(1, 'liter') + Q_(1, 'liter'), Q_(2, 'liter'))
+
+    def test_unit_registry_definitions_are_cached_on_disk(self):
+        with tempfile.TemporaryDirectory() as cache_folder:
+            _build_unit_registry(cache_folder)
+            self.assertTrue(os.listdir(cache_folder))
+
+            ureg = _build_unit_registry(cache_folder)
+            self.assertEqual(str(ureg.Quantity(1, 'unit').dimensionality), '[unit]')
+
     def test_add_quantities_cup_and_liter(self):
         result = add_quantities_with_units(Q_(1, 'liter'), Q_(1, 'cup'))
         self.assertEqual(round(result, 2), 1.24)
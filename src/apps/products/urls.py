@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import SimpleRouter
 
-from apps.products.views import UnitViewSet, ProductViewSet
+from apps.products.views import UnitViewSet, ProductViewSet, convert_amounts
 
 
 router = SimpleRouter()
@@ -12,4 +12,5 @@ router.register(r'products', ProductViewSet)                    # products/
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('convert_amounts', convert_amounts, name='convert-amounts'),
 ]
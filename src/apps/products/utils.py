@@ -1,11 +1,189 @@
-from common.utils import Q_
+import threading
+from decimal import Decimal
+
+from django.apps import apps
+from pint.errors import UndefinedUnitError
+
+from common.utils import Q_, get_unit_registry
 
 from apps.products.dimensionality import Dimensionality
 
 
+# Unit every dimensionality is normalized to by the compiled (pint-free) conversions
+BASE_UNITS = {
+    Dimensionality.UNIT: 'unit',
+    Dimensionality.MASS: 'kilogram',
+    Dimensionality.VOLUME: 'liter',
+}
+
+_PINT_DIMENSIONALITIES = {
+    Dimensionality.UNIT.value: Dimensionality.UNIT,
+    Dimensionality.MASS.value: Dimensionality.MASS,
+    Dimensionality.VOLUME.label: Dimensionality.VOLUME,
+}
+
+# unit name -> (dimensionality, factor to base unit)
+_unit_factors = {}
+# unit name -> parsed pint unit
+_pint_units = {}
+
+
+def get_pint_unit(unit_name):
+    try:
+        return _pint_units[unit_name]
+    except KeyError:
+        unit = _pint_units[unit_name] = get_unit_registry().Unit(unit_name)
+        return unit
+
+
+class UnitConversionTable:
+    """Factors between every pair of units of the same dimensionality, so converting is one multiplication.
+
+    Built from all Units at once; pint is only used (once per unit) to get each one's factor to its base unit.
+    """
+
+    def __init__(self):
+        Unit = apps.get_model('products', 'Unit')
+
+        self.units = dict()              # unit id -> (name, dimensionality, factor to base unit)
+        for unit_id, name in Unit.objects.values_list('id', 'name'):
+            try:
+                self.units[unit_id] = (name, *get_unit_factor(name))
+            except UndefinedUnitError:
+                # left to pint, which will complain when it's used
+                self.units[unit_id] = (name, None, None)
+
+        # factors to base unit as exact decimals (pint's are floats, but from definitions with few digits)
+        self.exact_base_factors = {unit_id: to_decimal(factor)
+                                   for unit_id, (_, _, factor) in self.units.items() if factor is not None}
+
+        self.factors = dict()            # (from unit id, to unit id) -> factor
+        for from_id, (_, from_dimensionality, from_factor) in self.units.items():
+            for to_id, (_, to_dimensionality, to_factor) in self.units.items():
+                if from_dimensionality is not None and from_dimensionality == to_dimensionality:
+                    self.factors[from_id, to_id] = from_factor / to_factor
+
+    def knows(self, unit):
+        """Whether unit is in the table as it is now (i.e. not created or renamed since it was built)."""
+        known = self.units.get(unit.id)
+        return known is not None and known[0] == unit.name
+
+    def factor(self, from_unit, to_unit, product=None):
+        """Factor taking a quantity of product in from_unit to to_unit, None if it can't be converted.
+
+        Between dimensionalities, uses the same product data as convert_to_correct_unit (see get_product_factor).
+        """
+        factor = self.factors.get((from_unit.id, to_unit.id))
+        if factor is not None or product is None:
+            return factor
+
+        _, from_dimensionality, from_factor = self.units[from_unit.id]
+        _, to_dimensionality, to_factor = self.units[to_unit.id]
+        if from_dimensionality is None or to_dimensionality is None:
+            return None
+        product_factor = get_product_factor(product, from_dimensionality, to_dimensionality)
+        return from_factor * product_factor / to_factor if product_factor is not None else None
+
+    def exact_factor(self, from_unit, to_unit, product=None):
+        """As factor, but a Decimal built from the units' exact ratios and product's decimal data."""
+        return self._exact_factor(from_unit.id, to_unit.id, product)
+
+    def exact_factors_from(self, from_unit, product=None):
+        """exact_factor from from_unit to each unit it can be converted to (for product), by unit id."""
+        factors = {from_unit.id: Decimal(1)}
+        for to_id in self.exact_base_factors:
+            factor = self._exact_factor(from_unit.id, to_id, product)
+            if factor is not None:
+                factors[to_id] = factor
+        return factors
+
+    def _exact_factor(self, from_id, to_id, product):
+        if from_id == to_id:
+            return Decimal(1)
+        if from_id not in self.exact_base_factors or to_id not in self.exact_base_factors:
+            return None
+
+        _, from_dimensionality, _ = self.units[from_id]
+        _, to_dimensionality, _ = self.units[to_id]
+        if from_dimensionality == to_dimensionality:
+            product_factor = Decimal(1)
+        elif product is None:
+            return None
+        else:
+            product_factor = get_product_factor(product, from_dimensionality, to_dimensionality, to_decimal)
+            if product_factor is None:
+                return None
+        return self.exact_base_factors[from_id] * product_factor / self.exact_base_factors[to_id]
+
+
+_conversion_table = None
+_conversion_table_lock = threading.Lock()
+
+
+def get_conversion_table(*units):
+    """This process' UnitConversionTable, rebuilt if any of units isn't in it as it is now."""
+    global _conversion_table
+
+    # unsaved units will never be in it
+    units = [unit for unit in units if unit.id is not None]
+    table = _conversion_table
+    if table is None or not all(table.knows(unit) for unit in units):
+        with _conversion_table_lock:
+            table = _conversion_table
+            if table is None or not all(table.knows(unit) for unit in units):
+                table = _conversion_table = UnitConversionTable()
+    return table
+
+
+def invalidate_conversion_table():
+    global _conversion_table
+    _conversion_table = None
+
+
 def convert_to_correct_unit(obj, other):
     """Receive ProductWithAmount and Amount/ProductWithAmount"""
 
+    obj_unit = get_pint_unit(obj.unit.name)
+    table = get_conversion_table(obj.unit, other.unit)
+    if table.knows(obj.unit) and table.knows(other.unit):
+        factor = table.factor(other.unit, obj.unit)
+        if factor is None:
+            # product is only looked at (and maybe fetched) for conversions between dimensionalities
+            factor = table.factor(other.unit, obj.unit, getattr(obj, 'product', None))
+        if factor is not None:
+            if factor == 1:
+                quantity = other.quantity
+            elif isinstance(obj.quantity, Decimal):
+                # so that both can be added or subtracted
+                quantity = Decimal(repr(float(other.quantity) * factor))
+            else:
+                quantity = float(other.quantity) * factor
+            return Q_(obj.quantity, obj_unit), Q_(quantity, obj_unit)
+
+    return _convert_with_pint(obj, other)
+
+
+def convert_quantity_exactly(obj, other):
+    """other's quantity in obj's unit as a Decimal, without going through floats.
+
+    Returns None if either unit is unknown to the conversion table or they can't be converted,
+    in which case convert_to_correct_unit (pint) has to be used.
+    """
+    if obj.unit is None or other.unit is None or obj.quantity is None or other.quantity is None:
+        return None
+
+    table = get_conversion_table(obj.unit, other.unit)
+    if not (table.knows(obj.unit) and table.knows(other.unit)):
+        return None
+    factor = table.exact_factor(other.unit, obj.unit)
+    if factor is None:
+        factor = table.exact_factor(other.unit, obj.unit, getattr(obj, 'product', None))
+    return to_decimal(other.quantity) * factor if factor is not None else None
+
+
+def _convert_with_pint(obj, other):
+    """convert_to_correct_unit for the units not in the conversion table, raises pint's errors if not convertible."""
+
     obj_amount = Q_(obj.quantity, obj.unit.name)
     other_amount = Q_(other.quantity, other.unit.name)
 
@@ -56,3 +234,56 @@ def add_quantities_with_units(obj, other):
     """Returns the result obj.quantity + other.quantity in the same unit as obj.unit."""
     result = obj + other
     return result.magnitude
+
+
+def get_unit_factor(unit_name):
+    """Returns (dimensionality, factor) such that quantity * factor is in the base unit of dimensionality.
+
+    Uses pint only the first time a unit is seen; both are None if the unit's dimensionality is not supported.
+    """
+    try:
+        return _unit_factors[unit_name]
+    except KeyError:
+        pass
+
+    quantity = Q_(1, unit_name)
+    dimensionality = _PINT_DIMENSIONALITIES.get(str(quantity.dimensionality))
+    factor = float(quantity.to(BASE_UNITS[dimensionality]).magnitude) if dimensionality else None
+
+    _unit_factors[unit_name] = (dimensionality, factor)
+    return dimensionality, factor
+
+
+def to_decimal(number):
+    """Decimal with the digits number is written with, so 0.1 is Decimal('0.1') and not its binary expansion."""
+    return number if isinstance(number, Decimal) else Decimal(format(number, '.15g'))
+
+
+def get_product_factor(product, from_dimensionality, to_dimensionality, number=float):
+    """Returns factor to take a base unit quantity of product between dimensionalities.
+
+    Follows the same rules as convert_to_correct_unit: density for mass <-> volume,
+    avg_unit_weight for unit <-> mass and avg_unit_volume for unit <-> volume.
+    Returns None if product lacks the data needed for the conversion.
+    The factor is a float, unless another number type (e.g. to_decimal) is given.
+    """
+    if from_dimensionality == to_dimensionality:
+        return number(1)
+
+    dimensionalities = {from_dimensionality, to_dimensionality}
+    if dimensionalities == {Dimensionality.MASS, Dimensionality.VOLUME}:
+        # kg / (m ** 3) to kg / L
+        ratio = number(product.density) / 1000 if product.density else None
+        ratio_into = Dimensionality.MASS
+    elif dimensionalities == {Dimensionality.UNIT, Dimensionality.MASS}:
+        ratio = number(product.avg_unit_weight) if product.avg_unit_weight else None
+        ratio_into = Dimensionality.MASS
+    elif dimensionalities == {Dimensionality.UNIT, Dimensionality.VOLUME}:
+        ratio = number(product.avg_unit_volume) if product.avg_unit_volume else None
+        ratio_into = Dimensionality.VOLUME
+    else:
+        return None
+
+    if ratio is None:
+        return None
+    return ratio if to_dimensionality == ratio_into else 1 / ratio
@@ -1,10 +1,23 @@
-from rest_framework import viewsets, permissions
+from decimal import Decimal, InvalidOperation
+
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
 from django.utils.decorators import method_decorator
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
+from common.cache import get_reference_data
 from common.permissions import ReadOnly
 from apps.products.models import Unit, Product
-from apps.products.serializers import UnitSerializer, ProductSerializer
+from apps.products.serializers import UnitSerializer, ProductSerializer, format_quantity
+from apps.products.utils import get_conversion_table
+
+
+# Most amounts converted in a single request
+MAX_CONVERSIONS = 5000
+# Same limit as Amount.quantity (max_digits=12, decimal_places=3)
+MAX_QUANTITY = Decimal('1e9')
 
 
 @method_decorator(name='list', decorator=swagger_auto_schema(
@@ -79,3 +92,101 @@ class ProductViewSet(viewsets.ModelViewSet):
     lookup_field = 'pk'
     permission_classes = [permissions.IsAdminUser | ReadOnly]
     search_fields = ['name']
+
+
+def parse_conversion(conversion):
+    """(product name or None, quantity, from unit name, to unit name) of conversion, ValueError if malformed."""
+    if not isinstance(conversion, dict):
+        raise ValueError('must be an object')
+    product, from_unit, to_unit = conversion.get('product'), conversion.get('from_unit'), conversion.get('to_unit')
+    if not isinstance(from_unit, str) or not isinstance(to_unit, str):
+        raise ValueError('from_unit and to_unit must be unit names')
+    if product is not None and not isinstance(product, str):
+        raise ValueError('product must be a product name')
+    try:
+        quantity = Decimal(str(conversion.get('quantity')))
+    except InvalidOperation:
+        raise ValueError('quantity must be a number')
+    if not quantity.is_finite() or abs(quantity) >= MAX_QUANTITY:
+        raise ValueError('quantity must be a number')
+    return product, quantity, from_unit, to_unit
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_summary='Convert amounts',
+    operation_description=f'''
+        Converts each amount to to_unit, and returns them in the same order.
+        Conversions between mass, volume and units use the product's density, average unit weight
+        or average unit volume, so the product (by name) is only needed for those.
+        Amounts that can't be converted have null quantity and an error.
+        At most {MAX_CONVERSIONS} amounts per request.
+    ''',
+    request_body=openapi.Schema(
+        type=openapi.TYPE_ARRAY,
+        items=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'product': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the product'),
+                'quantity': openapi.Schema(type=openapi.TYPE_NUMBER),
+                'from_unit': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the unit of quantity'),
+                'to_unit': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the unit to convert to'),
+            },
+            required=['quantity', 'from_unit', 'to_unit'],
+        ),
+    ),
+)
+@api_view(['POST'])
+def convert_amounts(request):
+    if not isinstance(request.data, list):
+        return Response({'message': 'a list of amounts must be provided'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(request.data) > MAX_CONVERSIONS:
+        return Response({'message': f'at most {MAX_CONVERSIONS} amounts can be converted at once'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    conversions = []
+    for position, conversion in enumerate(request.data):
+        try:
+            conversions.append(parse_conversion(conversion))
+        except ValueError as e:
+            return Response({'message': f'amount {position}: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    units = get_reference_data(Unit).by_name
+    product_names = {product for product, _, _, _ in conversions if product is not None}
+    products = {product.name: product for product in Product.objects.filter(name__in=product_names).only(
+        'id', 'name', 'density', 'avg_unit_weight', 'avg_unit_volume')} if product_names else {}
+    table = get_conversion_table(*{units[name] for _, _, from_unit, to_unit in conversions
+                                   for name in (from_unit, to_unit) if name in units})
+
+    factors = dict()                     # (product name, from unit name, to unit name) -> factor or error
+    results = []
+    for product_name, quantity, from_unit, to_unit in conversions:
+        key = (product_name, from_unit, to_unit)
+        if key not in factors:
+            factors[key] = get_conversion_factor(table, units, products, *key)
+        factor = factors[key]
+        if isinstance(factor, Decimal):
+            results.append({'quantity': format_quantity(quantity * factor, 3), 'unit': to_unit})
+        else:
+            results.append({'quantity': None, 'unit': to_unit, 'error': factor})
+
+    return Response(results, status=status.HTTP_200_OK)
+
+
+def get_conversion_factor(table, units, products, product_name, from_unit_name, to_unit_name):
+    """Exact factor from one unit to the other for product, or the reason why there isn't one."""
+    for name in (from_unit_name, to_unit_name):
+        if name not in units:
+            return f'unknown unit {name}'
+    product = None
+    if product_name is not None:
+        product = products.get(product_name)
+        if product is None:
+            return f'unknown product {product_name}'
+
+    factor = table.exact_factor(units[from_unit_name], units[to_unit_name], product)
+    if factor is None:
+        if product is None:
+            return f'cannot convert {from_unit_name} to {to_unit_name} without a product'
+        return f'cannot convert {from_unit_name} of {product_name} to {to_unit_name}'
+    return factor
@@ -10,6 +10,8 @@ from apps.profiles.models import (Profile,
                                   FriendshipStatus,
                                   )
 from apps.products.models import Product
+from common.cache import get_reference_data
+from common.fields import ReferenceSlugRelatedField
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -33,8 +35,7 @@ class ProfileMinimalSerializer(serializers.ModelSerializer):
 
 
 class ProfileSerializer(serializers.ModelSerializer):
-    profiletypes = serializers.SlugRelatedField(
-        slug_field='name',
+    profiletypes = ReferenceSlugRelatedField(
         many=True,
         queryset=ProfileType.objects.all()
     )
@@ -136,7 +137,7 @@ class FriendshipRequestSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         current_profile = Profile.objects.get(user=self.context['request'].user)
         requested_profile = validated_data['profile_requested_id']
-        requested_status = FriendshipStatus.objects.get(name='REQUESTED')
+        requested_status = get_reference_data(FriendshipStatus).by_name['REQUESTED']
 
         friendship_request, created = FriendshipRequest.objects.get_or_create(
             profile_requested=requested_profile,
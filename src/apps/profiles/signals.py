@@ -1,11 +1,20 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
-from apps.profiles.models import Profile
+from apps.profiles.models import Profile, ProfileType, FriendshipStatus
+from common.cache import invalidate_reference_data
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_profile(instance, created, **_kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=ProfileType)
+@receiver(post_delete, sender=ProfileType)
+@receiver(post_save, sender=FriendshipStatus)
+@receiver(post_delete, sender=FriendshipStatus)
+def invalidate_reference_tables(sender, **_kwargs):
+    invalidate_reference_data(sender)
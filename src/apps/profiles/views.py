@@ -2,6 +2,7 @@ from rest_framework import viewsets, status, mixins, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
 from django.utils.decorators import method_decorator
@@ -29,6 +30,14 @@ from apps.recipes.serializers import (InteractionSerializer)
 
 from apps.profiles.permissions import (UpdateOwnProfile,
                                        IsOwnProfile)
+from common.cache import get_reference_data
+
+
+def get_friendship_status(name):
+    try:
+        return get_reference_data(FriendshipStatus).by_name[name]
+    except KeyError:
+        raise Http404
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -173,8 +182,8 @@ class FriendshipRequestViewSet(viewsets.GenericViewSet,
     @action(detail=True, methods=['POST'])
     def accept(self, request, pk=None):
         friendship_request = get_object_or_404(FriendshipRequest.objects.all(), id=pk)
-        status_requested = get_object_or_404(FriendshipStatus, name='REQUESTED')
-        status_accepted = get_object_or_404(FriendshipStatus, name='ACCEPTED')
+        status_requested = get_friendship_status('REQUESTED')
+        status_accepted = get_friendship_status('ACCEPTED')
 
         if (friendship_request.status == status_requested and
                 friendship_request.profile_requested.user.id == request.user.id):
@@ -193,8 +202,8 @@ class FriendshipRequestViewSet(viewsets.GenericViewSet,
     @action(detail=True, methods=['POST'])
     def reject(self, request, pk=None):
         friendship_request = get_object_or_404(FriendshipRequest.objects.all(), id=pk)
-        status_requested = get_object_or_404(FriendshipStatus, name='REQUESTED')
-        status_rejected = get_object_or_404(FriendshipStatus, name='REJECTED')
+        status_requested = get_friendship_status('REQUESTED')
+        status_rejected = get_friendship_status('REJECTED')
 
         if friendship_request.status == status_requested:
             friendship_request.status = status_rejected
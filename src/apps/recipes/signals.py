@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.recipes.models import DishCategory, DishLabel
+from common.cache import invalidate_reference_data
+
+
+@receiver(post_save, sender=DishCategory)
+@receiver(post_delete, sender=DishCategory)
+@receiver(post_save, sender=DishLabel)
+@receiver(post_delete, sender=DishLabel)
+def invalidate_reference_tables(sender, **_kwargs):
+    invalidate_reference_data(sender)
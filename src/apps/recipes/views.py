@@ -167,18 +167,27 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # we override this method and add ratings in context for serializer
         serializer_class = self.get_serializer_class()
         kwargs['context'] = self.get_serializer_context()
+        kwargs['context']['ratings'] = self.get_ratings(args[0] if args else None)
+
+        return serializer_class(*args, **kwargs)
+
+    def get_ratings(self, instance):
+        """Ratings of current user for just the recipe(s) about to be serialized."""
+        if instance is None:
+            return {}
 
         try:
-            ratings_for_user = RemyRSService.get_recommendations_for_user(
-                profile_id=self.request.user.profile.id,
-                n='all',
-            )
-            kwargs['context']['ratings'] = {r['recipe_id']: r for r in ratings_for_user}
+            profile_id = self.request.user.profile.id
         except AttributeError:
             # this catches the case that there's no profile (i.e. not logged in)
-            pass
-
-        return serializer_class(*args, **kwargs)
+            return {}
+
+        recipes = [instance] if isinstance(instance, Recipe) else instance
+        ratings_for_user = RemyRSService.get_predicted_rating_for_interaction(
+            profile_id=profile_id,
+            recipe_id=[recipe.id for recipe in recipes],
+        )
+        return {r['recipe_id']: r for r in ratings_for_user}
 
 
 @swagger_auto_schema(
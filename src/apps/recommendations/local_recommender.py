@@ -0,0 +1,203 @@
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from apps.recipes.models import Interaction
+
+
+# Rating assumed for a recipe that was cooked but never rated
+COOKED_RATING = 7.0
+MIN_RATING = 1.0
+MAX_RATING = 10.0
+
+
+def _effective_ratings(interactions):
+    """(profile_id, recipe_id, rating, rated) for each interaction that says something about the recipe."""
+    for profile_id, recipe_id, rating, cooked_at in interactions:
+        if rating is not None:
+            yield profile_id, recipe_id, float(rating), True
+        elif cooked_at:
+            yield profile_id, recipe_id, COOKED_RATING, False
+
+
+class LocalRecommender:
+    """Item-item neighbourhood recommender over the Interaction table, for when the RS can't be used.
+
+    Each recipe's baseline is the global mean plus its bias, shrunk towards zero for recipes with
+    few ratings (so it's also a popularity ranking for users with no interactions). Predictions add
+    the user's deviations from the baselines of the recipe's most similar neighbours, weighted by a
+    shrunk cosine similarity of those deviations.
+
+    The neighbourhoods are stored CSR-like: recipe i's neighbours are
+    neighbors[indptr[i]:indptr[i + 1]], with their similarities at the same positions.
+    """
+
+    def __init__(self, recipe_ids, baselines, indptr, neighbors, similarities, mean):
+        self.recipe_ids = recipe_ids
+        self.baselines = baselines
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self.mean = float(mean)
+        self.positions = {recipe_id: position for position, recipe_id in enumerate(recipe_ids.tolist())}
+        # row of each stored neighbour, to aggregate per recipe with bincount
+        self.rows = np.repeat(np.arange(len(recipe_ids)), np.diff(indptr))
+
+    @classmethod
+    def build(cls, n_neighbors=30, shrinkage=10.0):
+        interactions = Interaction.objects.values_list('profile_id', 'recipe_id', 'rating', 'cooked_at')
+        ratings = list(_effective_ratings(interactions))
+        if not ratings:
+            empty = np.array([], dtype=np.int64)
+            return cls(empty, np.array([], dtype=np.float32), np.zeros(1, dtype=np.int64),
+                       empty.astype(np.int32), np.array([], dtype=np.float32), (MIN_RATING + MAX_RATING) / 2)
+
+        profile_ids, recipe_ids, values, _ = (np.array(column) for column in zip(*ratings))
+        recipe_ids, items = np.unique(recipe_ids, return_inverse=True)
+        _, users = np.unique(profile_ids, return_inverse=True)
+        values = values.astype(float)
+
+        mean = values.mean()
+        counts = np.bincount(items, minlength=len(recipe_ids))
+        biases = np.bincount(items, weights=values - mean, minlength=len(recipe_ids)) / (counts + shrinkage)
+        baselines = mean + biases
+        residuals = values - baselines[items]
+
+        # co-rated pairs of recipes, user by user
+        order = np.argsort(users, kind='stable')
+        users, items, residuals = users[order], items[order], residuals[order]
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+        ends = np.r_[starts[1:], len(users)]
+        left, right, products = [], [], []
+        for start, end in zip(starts, ends):
+            user_items, user_residuals = items[start:end], residuals[start:end]
+            i, j = np.meshgrid(np.arange(end - start), np.arange(end - start), indexing='ij')
+            off_diagonal = i != j
+            left.append(user_items[i[off_diagonal]])
+            right.append(user_items[j[off_diagonal]])
+            products.append(user_residuals[i[off_diagonal]] * user_residuals[j[off_diagonal]])
+        left, right, products = np.concatenate(left), np.concatenate(right), np.concatenate(products)
+
+        n_items = len(recipe_ids)
+        pairs, inverse = np.unique(left.astype(np.int64) * n_items + right, return_inverse=True)
+        co_counts = np.bincount(inverse)
+        dot = np.bincount(inverse, weights=products)
+        norms = np.sqrt(np.bincount(items, weights=residuals ** 2, minlength=n_items))
+        pair_left, pair_right = np.divmod(pairs, n_items)
+        denominator = norms[pair_left] * norms[pair_right]
+        similarities = np.divide(dot, denominator, out=np.zeros_like(dot), where=denominator > 0)
+        similarities *= co_counts / (co_counts + shrinkage)
+
+        # keep the n_neighbors most similar (by absolute value) of each recipe
+        keep = similarities != 0
+        pair_left, pair_right, similarities = pair_left[keep], pair_right[keep], similarities[keep]
+        order = np.lexsort((-np.abs(similarities), pair_left))
+        pair_left, pair_right, similarities = pair_left[order], pair_right[order], similarities[order]
+        first = np.searchsorted(pair_left, np.arange(n_items))
+        rank = np.arange(len(pair_left)) - first[pair_left]
+        keep = rank < n_neighbors
+        pair_left, pair_right, similarities = pair_left[keep], pair_right[keep], similarities[keep]
+        indptr = np.r_[0, np.cumsum(np.bincount(pair_left, minlength=n_items))]
+
+        return cls(recipe_ids.astype(np.int64), baselines.astype(np.float32), indptr.astype(np.int64),
+                   pair_right.astype(np.int32), similarities.astype(np.float32), mean)
+
+    def save(self, path):
+        # np.savez_compressed appends .npz to names without it, so write through a file object
+        with open(path, 'wb') as snapshot:
+            np.savez_compressed(snapshot, recipe_ids=self.recipe_ids, baselines=self.baselines, indptr=self.indptr,
+                                neighbors=self.neighbors, similarities=self.similarities, mean=self.mean)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as snapshot:
+            return cls(snapshot['recipe_ids'], snapshot['baselines'], snapshot['indptr'],
+                       snapshot['neighbors'], snapshot['similarities'], snapshot['mean'])
+
+    def _predict(self, profile_id):
+        """Predicted ratings of profile for all recipes, and the real ratings it gave (recipe_id -> rating)."""
+        interactions = Interaction.objects.filter(profile_id=profile_id).values_list(
+            'profile_id', 'recipe_id', 'rating', 'cooked_at')
+        deviations = np.zeros(len(self.recipe_ids))
+        known = np.zeros(len(self.recipe_ids))
+        real = dict()
+        for _, recipe_id, rating, rated in _effective_ratings(interactions):
+            if rated:
+                real[recipe_id] = rating
+            position = self.positions.get(recipe_id)
+            if position is not None:
+                deviations[position] = rating - self.baselines[position]
+                known[position] = 1
+
+        weights = self.similarities * known[self.neighbors]
+        numerator = np.bincount(self.rows, weights=weights * deviations[self.neighbors],
+                                minlength=len(self.recipe_ids))
+        denominator = np.bincount(self.rows, weights=np.abs(weights), minlength=len(self.recipe_ids))
+        adjustment = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+        return np.clip(self.baselines + adjustment, MIN_RATING, MAX_RATING), real
+
+    def _to_predictions(self, predicted, real, n):
+        predicted = predicted.copy()
+        for recipe_id, rating in real.items():
+            if recipe_id in self.positions:
+                predicted[self.positions[recipe_id]] = rating
+        order = np.argsort(-predicted, kind='stable')
+        if n:
+            order = order[:n]
+        predictions = []
+        for position in order.tolist():
+            recipe_id = int(self.recipe_ids[position])
+            is_real = recipe_id in real
+            predictions.append({
+                'recipe_id': recipe_id,
+                'rating': real[recipe_id] if is_real else round(float(predicted[position]), 2),
+                'real': is_real,
+            })
+        return predictions
+
+    def get_recommendations_for_user(self, profile_id, n=10):
+        predicted, real = self._predict(profile_id)
+        return self._to_predictions(predicted, real, n)
+
+    def get_recommendations_for_group(self, profile_ids, n=10):
+        # average of what each member would rate each recipe
+        predicted = np.mean([self._predict(profile_id)[0] for profile_id in profile_ids], axis=0)
+        return self._to_predictions(predicted, {}, n)
+
+    def get_predicted_ratings(self, profile_id, recipe_ids):
+        predicted, real = self._predict(profile_id)
+        predictions = []
+        for recipe_id in recipe_ids:
+            position = self.positions.get(recipe_id)
+            if recipe_id in real:
+                predictions.append({'recipe_id': recipe_id, 'rating': real[recipe_id], 'real': True})
+            else:
+                rating = float(predicted[position]) if position is not None else self.mean
+                predictions.append({'recipe_id': recipe_id, 'rating': round(rating, 2), 'real': False})
+        return predictions
+
+
+_local_recommender = (None, None)
+_local_recommender_lock = threading.Lock()
+
+
+def get_local_recommender():
+    """This process' LocalRecommender, reloaded when its snapshot changes; None if there's no snapshot."""
+    global _local_recommender
+
+    path = settings.LOCAL_RECOMMENDER_SNAPSHOT
+    try:
+        snapshot = (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        return None
+
+    loaded, recommender = _local_recommender
+    if loaded != snapshot:
+        with _local_recommender_lock:
+            loaded, recommender = _local_recommender
+            if loaded != snapshot:
+                recommender = LocalRecommender.load(path)
+                _local_recommender = (snapshot, recommender)
+    return recommender
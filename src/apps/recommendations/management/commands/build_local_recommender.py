@@ -0,0 +1,28 @@
+"""python manage.py build_local_recommender"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.recommendations.local_recommender import LocalRecommender
+
+
+class Command(BaseCommand):
+    help = 'build the snapshot of the local recommender from interactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, default=settings.LOCAL_RECOMMENDER_SNAPSHOT, help='Snapshot file')
+        parser.add_argument('--neighbors', type=int, default=30, help='Most similar recipes kept per recipe')
+        parser.add_argument('--shrinkage', type=float, default=10.0,
+                            help='Ratings needed for a bias or similarity to count at half its value')
+
+    def handle(self, *args, **options):
+        recommender = LocalRecommender.build(n_neighbors=options['neighbors'], shrinkage=options['shrinkage'])
+
+        # replaced at once, so that workers never load a half-written snapshot
+        tmp_path = f"{options['output']}.tmp"
+        recommender.save(tmp_path)
+        os.replace(tmp_path, options['output'])
+
+        self.stdout.write(f"done. {len(recommender.recipe_ids)} recipes, "
+                          f"{len(recommender.neighbors)} neighbours saved to {options['output']}.")
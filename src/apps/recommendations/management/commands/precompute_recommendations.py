@@ -0,0 +1,72 @@
+"""python manage.py precompute_recommendations"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from requests.exceptions import RequestException
+
+from apps.profiles.models import Profile
+from apps.recipes.models import Recipe
+from apps.recommendations.models import RecipeRecommendation
+from apps.recommendations.services import RemyRSService
+
+
+class Command(BaseCommand):
+    help = "store active profiles' recommendations from the RS, so that they are served without calling it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active-days', type=int, default=30,
+                            help='Only for profiles whose users logged in within these days, 0 for all')
+        parser.add_argument('-n', type=int, default=0, help='Recommendations stored per profile, 0 for all')
+        parser.add_argument('--workers', type=int, default=4, help='Calls made to the RS at the same time')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per insert')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.all()
+        if options['active_days']:
+            profiles = profiles.filter(user__last_login__gte=timezone.now() - timedelta(days=options['active_days']))
+        profile_ids = list(profiles.values_list('id', flat=True))
+
+        stored = failed = 0
+        # threads just wait on the RS; rows are written from this thread only
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(RemyRSService.get_fresh_recommendations_for_user, profile_id, options['n']): profile_id
+                for profile_id in profile_ids
+            }
+            for future in as_completed(futures):
+                profile_id = futures[future]
+                try:
+                    predictions = future.result()
+                except (RequestException, RemyRSService.RecSysException) as rs_error:
+                    # previous snapshot, if any, is kept
+                    self.stderr.write(f'profile {profile_id}: {rs_error!r}')
+                    failed += 1
+                    continue
+                store_recommendations(profile_id, predictions, options['batch_size'])
+                stored += 1
+
+        self.stdout.write(f'done. recommendations stored for {stored} profiles, {failed} failed.')
+
+
+def store_recommendations(profile_id, predictions, batch_size=1000):
+    """Replaces the stored recommendations of profile with predictions, in the RS' order."""
+    computed_at = timezone.now()
+    # the RS may know of recipes that were deleted since
+    existing = set(Recipe.objects.filter(id__in=[p['recipe_id'] for p in predictions]).values_list('id', flat=True))
+    predictions = [prediction for prediction in predictions if prediction['recipe_id'] in existing]
+    with transaction.atomic():
+        RecipeRecommendation.objects.filter(profile_id=profile_id).delete()
+        RecipeRecommendation.objects.bulk_create(
+            (RecipeRecommendation(
+                profile_id=profile_id,
+                recipe_id=prediction['recipe_id'],
+                rank=rank,
+                rating=prediction['rating'],
+                rating_is_real=prediction['real'],
+                computed_at=computed_at,
+            ) for rank, prediction in enumerate(predictions)),
+            batch_size=batch_size,
+        )
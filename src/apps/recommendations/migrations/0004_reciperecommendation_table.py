@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0017_profile_forbidden_products'),
+        ('recipes', '0029_recipe_duration'),
+        ('recommendations', '0003_auto_20210130_1407'),
+    ]
+
+    operations = [
+        # was unmanaged, so there's no table to drop; then created as a real one
+        migrations.DeleteModel(
+            name='RecipeRecommendation',
+        ),
+        migrations.CreateModel(
+            name='RecipeRecommendation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField()),
+                ('rating', models.DecimalField(decimal_places=3, max_digits=5)),
+                ('rating_is_real', models.BooleanField()),
+                ('computed_at', models.DateTimeField()),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='profiles.profile')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reciperecommendation',
+            constraint=models.UniqueConstraint(fields=('profile', 'rank'), name='unique_recommendation_rank'),
+        ),
+    ]
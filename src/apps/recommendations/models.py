@@ -1,19 +1,26 @@
 from django.db import models
 
 from apps.recipes.models import Recipe
+from apps.profiles.models import Profile
 
 
 class RecipeRecommendation(models.Model):
+    """A recipe in a profile's precomputed ranking (see `manage.py precompute_recommendations`).
+
+    Also built unsaved, without profile, for the predictions the RS gives at request time.
+    """
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='recommendations')
     recipe = models.ForeignKey(Recipe, blank=False, null=False, on_delete=models.CASCADE)
+    # position in the profile's ranking, starting at 0
+    rank = models.PositiveIntegerField()
     rating = models.DecimalField(max_digits=5, decimal_places=3, blank=False, null=False)
     rating_is_real = models.BooleanField()
+    computed_at = models.DateTimeField()
 
     class Meta:
-        managed = False
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'rank'], name='unique_recommendation_rank')
+        ]
 
     def __str__(self):
         return f'For recipe {self.recipe} rating {self.rating} ({"real" if self.rating_is_real else "generated"})'
-
-    def save(self, *args, **kwargs):
-        # Never saving this model, just using it as a class with Django powers
-        pass
@@ -12,4 +12,4 @@ class RecipeRecommendationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RecipeRecommendation
-        exclude = ['id']
+        exclude = ['id', 'profile', 'rank', 'computed_at']
@@ -1,21 +1,404 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 
 from decouple import config
+from django.core.cache import caches
+from django.db import connections
 from rest_framework import status
 
+from common.cache import get_generation, bump_generation
+from apps.recommendations.local_recommender import get_local_recommender
+
 
 REMY_RS_BASE_URL = config('REMY_RS_BASE_URL')
+# 'remote' to ask the RS, 'local' to only use the snapshot built by `manage.py build_local_recommender`
+REMY_RS_BACKEND = config('REMY_RS_BACKEND', 'remote')
+# seconds to wait for the connection to be made and for the response to arrive
+REMY_RS_CONNECT_TIMEOUT = config('REMY_RS_CONNECT_TIMEOUT', 3.05, cast=float)
+REMY_RS_READ_TIMEOUT = config('REMY_RS_READ_TIMEOUT', 10, cast=float)
+# retries (with exponential backoff) for failed connections and 502/503/504s; only for idempotent methods
+REMY_RS_MAX_RETRIES = config('REMY_RS_MAX_RETRIES', 2, cast=int)
+REMY_RS_RETRY_BACKOFF = config('REMY_RS_RETRY_BACKOFF', 0.3, cast=float)
+REMY_RS_POOL_CONNECTIONS = config('REMY_RS_POOL_CONNECTIONS', 4, cast=int)
+REMY_RS_POOL_MAXSIZE = config('REMY_RS_POOL_MAXSIZE', 10, cast=int)
+# consecutive failed calls that open the circuit, and seconds it stays open before letting a probe call through
+REMY_RS_CIRCUIT_FAILURES = config('REMY_RS_CIRCUIT_FAILURES', 5, cast=int)
+REMY_RS_CIRCUIT_RESET_TIMEOUT = config('REMY_RS_CIRCUIT_RESET_TIMEOUT', 30, cast=float)
+# how group recommendations are made: 'rs' asks the RS for the group, while 'average', 'least_misery' and
+# 'most_pleasure' aggregate each member's (cached) predictions here, fetched with up to REMY_RS_GROUP_WORKERS threads
+REMY_RS_GROUP_AGGREGATION = config('REMY_RS_GROUP_AGGREGATION', 'rs')
+REMY_RS_GROUP_WORKERS = config('REMY_RS_GROUP_WORKERS', 8, cast=int)
+# whether concurrent fetches of a user's predictions from different workers also wait on a single one,
+# through a lock in the recommendations cache, and how often waiting workers look for its result (seconds);
+# gunicorn's default sync workers serve one request at a time, so without it nothing is ever deduplicated
+REMY_RS_SHARED_SINGLE_FLIGHT = config('REMY_RS_SHARED_SINGLE_FLIGHT', True, cast=bool)
+REMY_RS_SINGLE_FLIGHT_POLL = config('REMY_RS_SINGLE_FLIGHT_POLL', 0.05, cast=float)
+# how long the last good predictions of a profile or group are kept to be served while the RS is failing
+REMY_RS_LAST_GOOD_TTL = config('REMY_RS_LAST_GOOD_TTL', 7 * 24 * 60 * 60, cast=int)
+
+# kept in the recommendations cache while the RS rejects requests for the predicted ratings of some recipes
+BATCHED_RATINGS_REJECTED_KEY = 'rs:recipes:rejected'
+
+
+class RSStats:
+    """Per-endpoint call counters and latencies of this worker's calls to the RS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, endpoint, latency, failed):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                'calls': 0,
+                'failures': 0,
+                'total_latency': 0.0,
+                'max_latency': 0.0,
+            })
+            stats['calls'] += 1
+            stats['failures'] += int(failed)
+            stats['total_latency'] += latency
+            stats['max_latency'] = max(stats['max_latency'], latency)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {**stats, 'avg_latency': stats['total_latency'] / stats['calls']}
+                for endpoint, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+rs_stats = RSStats()
+
+
+class CircuitBreaker:
+    """Stops calling the RS after too many consecutive failures.
+
+    Once open, calls fail right away until reset_timeout has passed; then a single probe call is let
+    through (half-open), which closes the circuit if it succeeds or opens it again if it fails.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        """Whether a call can be made now; in half-open state, only the first caller gets to probe."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # a probe that never reported back doesn't keep the circuit half-open forever
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.reset()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures}
+
+
+rs_circuit = CircuitBreaker(REMY_RS_CIRCUIT_FAILURES, REMY_RS_CIRCUIT_RESET_TIMEOUT)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key: the first one runs, the rest wait and get its result.
+
+    Calls are shared only while in flight, nothing is kept afterwards. Only calls from threads of the same
+    process are coalesced (e.g. with gunicorn's gthread workers); across processes that's done by
+    RemyRSService._shared_single_flight.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+rs_single_flight = SingleFlight()
+
+
+class StalePredictions(list):
+    """Last good predictions, served because the RS could not be asked for fresh ones."""
+    stale = True
+
+
+GROUP_AGGREGATIONS = {
+    'average': np.nanmean,
+    'least_misery': np.nanmin,
+    'most_pleasure': np.nanmax,
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_group_executor = None
+_group_executor_pid = None
+_group_executor_lock = threading.Lock()
+
+
+def get_group_executor():
+    """Thread pool for fetching group members' predictions, shared by all calls made from this worker process."""
+    global _group_executor, _group_executor_pid
+
+    if _group_executor is None or _group_executor_pid != os.getpid():
+        with _group_executor_lock:
+            if _group_executor is None or _group_executor_pid != os.getpid():
+                _group_executor = ThreadPoolExecutor(max_workers=REMY_RS_GROUP_WORKERS,
+                                                     thread_name_prefix='rs-group')
+                _group_executor_pid = os.getpid()
+    return _group_executor
+
+
+def get_session():
+    """Keep-alive session with pooled connections, shared by all calls made from this worker process."""
+    global _session, _session_pid
+
+    # a session inherited from a parent process (e.g. gunicorn's --preload) must not be reused
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                retries = Retry(
+                    total=REMY_RS_MAX_RETRIES,
+                    backoff_factor=REMY_RS_RETRY_BACKOFF,
+                    status_forcelist=(status.HTTP_502_BAD_GATEWAY,
+                                      status.HTTP_503_SERVICE_UNAVAILABLE,
+                                      status.HTTP_504_GATEWAY_TIMEOUT),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    max_retries=retries,
+                    pool_connections=REMY_RS_POOL_CONNECTIONS,
+                    pool_maxsize=REMY_RS_POOL_MAXSIZE,
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
 
 
 class RemyRSService:
     class RecSysException(RuntimeError):
         pass
 
+    class CircuitOpenException(RecSysException):
+        pass
+
+    @staticmethod
+    def _get(endpoint, url, **kwargs):
+        """GET to the RS through the shared session, recording latency and failures for endpoint.
+
+        Raises CircuitOpenException without calling the RS while the circuit is open.
+        """
+        if not rs_circuit.allow():
+            raise RemyRSService.CircuitOpenException(f'Not calling RS for {endpoint}, circuit is open')
+
+        start = time.monotonic()
+        try:
+            rs_response = get_session().get(
+                url,
+                timeout=(REMY_RS_CONNECT_TIMEOUT, REMY_RS_READ_TIMEOUT),
+                **kwargs,
+            )
+        except RequestException:
+            rs_stats.record(endpoint, time.monotonic() - start, failed=True)
+            rs_circuit.record_failure()
+            raise
+        rs_stats.record(endpoint, time.monotonic() - start, failed=rs_response.status_code != status.HTTP_200_OK)
+        # 4xx are the caller's problem, the RS itself is fine
+        if rs_response.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+            rs_circuit.record_failure()
+        else:
+            rs_circuit.record_success()
+        return rs_response
+
+    @staticmethod
+    def stats():
+        return {**rs_stats.snapshot(), 'circuit': rs_circuit.snapshot()}
+
+    @staticmethod
+    def _last_good_key(kind, ids, n):
+        return f'rs:last_good:{kind}:{ids}:{n}'
+
+    @staticmethod
+    def _local(get_local_predictions, required=False):
+        """Predictions from the local recommender, None (or RecSysException if required) if it has no snapshot."""
+        recommender = get_local_recommender()
+        if recommender is None:
+            if required:
+                raise RemyRSService.RecSysException('Local recommender has no snapshot')
+            return None
+        return get_local_predictions(recommender)
+
+    @staticmethod
+    def _with_fallbacks(kind, ids, n, get_predictions, get_local_predictions):
+        """Predictions from get_predictions, remembered as the last good ones for kind and ids.
+
+        If the RS fails, the last good predictions (for n, or else for all of them) or else the local
+        recommender's are returned as StalePredictions; the error is raised only if there are none.
+        The local recommender also answers when the RS has no predictions (e.g. for new users), and
+        it's the only one asked when REMY_RS_BACKEND is 'local'.
+        """
+        if REMY_RS_BACKEND == 'local':
+            return RemyRSService._local(get_local_predictions, required=True)
+
+        cache = caches['recommendations_last_good']
+        try:
+            predictions = get_predictions()
+        except (RequestException, RemyRSService.RecSysException):
+            keys = [RemyRSService._last_good_key(kind, ids, n), RemyRSService._last_good_key(kind, ids, 0)]
+            last_good = cache.get_many(keys)
+            for key in keys:
+                if key in last_good:
+                    return StalePredictions(last_good[key][:n] if n else last_good[key])
+            predictions = RemyRSService._local(get_local_predictions)
+            if predictions is not None:
+                return StalePredictions(predictions)
+            raise
+
+        if not predictions:
+            predictions = RemyRSService._local(get_local_predictions) or predictions
+        cache.set(RemyRSService._last_good_key(kind, ids, n), predictions, REMY_RS_LAST_GOOD_TTL)
+        return predictions
+
+    @staticmethod
+    def _user_cache_key(profile_id, n):
+        generation = get_generation(caches['recommendations'], f'rs:user:{profile_id}')
+        return f'rs:user:{profile_id}:{generation}:{n}'
+
+    @staticmethod
+    def invalidate_user(profile_id):
+        """Drop all cached predictions for profile, e.g. after it rated or cooked something."""
+        bump_generation(caches['recommendations'], f'rs:user:{profile_id}')
+
     @staticmethod
     def get_recommendations_for_user(profile_id, n=10):
+        """Predictions for profile, served from cache while fresh (see RECOMMENDATIONS_CACHE_TTL)."""
         if n == 'all':
             n = 0
-        rs_response = requests.get(
+        cache_key = RemyRSService._user_cache_key(profile_id, n)
+        predictions = caches['recommendations'].get(cache_key)
+        if predictions is not None:
+            return predictions
+
+        def fetch():
+            def get_predictions():
+                return RemyRSService._get_recommendations_for_user(profile_id, n)
+
+            def get_local_predictions(recommender):
+                return recommender.get_recommendations_for_user(profile_id, n)
+
+            predictions = RemyRSService._with_fallbacks('user', profile_id, n, get_predictions, get_local_predictions)
+            if not isinstance(predictions, StalePredictions):
+                caches['recommendations'].set(cache_key, predictions)
+            return predictions
+
+        # requests for the same profile arriving together (e.g. when the app opens) make a single RS call
+        if REMY_RS_SHARED_SINGLE_FLIGHT:
+            return rs_single_flight.do(cache_key, lambda: RemyRSService._shared_single_flight(cache_key, fetch))
+        return rs_single_flight.do(cache_key, fetch)
+
+    @staticmethod
+    def _shared_single_flight(cache_key, fetch):
+        """Calls fetch, which caches its result at cache_key, unless another worker is already doing so.
+
+        In that case waits for its result to be cached, and only calls fetch itself if the other one
+        finished (or its lock expired) without caching any.
+        """
+        cache = caches['recommendations']
+        lock_key = f'{cache_key}:lock'
+        lock_timeout = REMY_RS_CONNECT_TIMEOUT + REMY_RS_READ_TIMEOUT
+        if cache.add(lock_key, os.getpid(), lock_timeout):
+            try:
+                return fetch()
+            finally:
+                cache.delete(lock_key)
+
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(REMY_RS_SINGLE_FLIGHT_POLL)
+            predictions = cache.get(cache_key)
+            if predictions is not None:
+                return predictions
+            if cache.get(lock_key) is None:
+                break
+        return fetch()
+
+    @staticmethod
+    def get_fresh_recommendations_for_user(profile_id, n=10):
+        """Predictions for profile straight from the RS, without caches or fallbacks."""
+        return RemyRSService._get_recommendations_for_user(profile_id, 0 if n == 'all' else n)
+
+    @staticmethod
+    def _get_recommendations_for_user(profile_id, n):
+        rs_response = RemyRSService._get(
+            'user',
             f'{REMY_RS_BASE_URL}/recommendations/user/{profile_id}',
             params={'n': n},
         )
@@ -27,10 +410,76 @@ class RemyRSService:
         return rs_response.json()['predictions']
 
     @staticmethod
-    def get_recommendations_for_group(profile_ids, n=10):
+    def get_recommendations_for_group(profile_ids, n=10, aggregation=None):
+        """Predictions for the group, see REMY_RS_GROUP_AGGREGATION for the possible aggregations."""
         if n == 'all':
             n = 0
-        rs_response = requests.get(
+        aggregation = aggregation or REMY_RS_GROUP_AGGREGATION
+        if aggregation != 'rs':
+            return RemyRSService._aggregate_members_recommendations(profile_ids, n, aggregation)
+
+        def get_predictions():
+            return RemyRSService._get_recommendations_for_group(profile_ids, n)
+
+        def get_local_predictions(recommender):
+            return recommender.get_recommendations_for_group(profile_ids, n)
+
+        group = ','.join(str(profile_id) for profile_id in sorted(profile_ids))
+        return rs_single_flight.do(
+            f'rs:group:{group}:{n}',
+            lambda: RemyRSService._with_fallbacks('group', group, n, get_predictions, get_local_predictions))
+
+    @staticmethod
+    def _member_recommendations(profile_id):
+        """get_recommendations_for_user for all recipes, from a thread of the group executor."""
+        try:
+            return RemyRSService.get_recommendations_for_user(profile_id, 0)
+        finally:
+            # the executor's threads aren't request threads, so Django never closes their connections
+            connections.close_all()
+
+    @staticmethod
+    def _aggregate_members_recommendations(profile_ids, n, aggregation):
+        """Each member's predictions for all recipes, fetched concurrently, aggregated into the group's.
+
+        A recipe's group rating comes from the members with a prediction for it; it's only real if
+        all members rated it.
+        """
+        aggregate = GROUP_AGGREGATIONS[aggregation]
+        profile_ids = list(profile_ids)
+        members_predictions = list(get_group_executor().map(RemyRSService._member_recommendations, profile_ids))
+
+        columns = dict()                 # recipe_id -> column
+        for predictions in members_predictions:
+            for prediction in predictions:
+                columns.setdefault(prediction['recipe_id'], len(columns))
+        ratings = np.full((len(profile_ids), len(columns)), np.nan)
+        real = np.zeros((len(profile_ids), len(columns)), dtype=bool)
+        for row, predictions in enumerate(members_predictions):
+            for prediction in predictions:
+                ratings[row, columns[prediction['recipe_id']]] = prediction['rating']
+                real[row, columns[prediction['recipe_id']]] = prediction['real']
+
+        group_ratings = aggregate(ratings, axis=0) if columns else np.array([])
+        group_real = real.all(axis=0)
+        recipe_ids = list(columns)
+        order = np.argsort(-group_ratings, kind='stable')
+        if n:
+            order = order[:n]
+        predictions = [{
+            'recipe_id': recipe_ids[column],
+            'rating': float(group_ratings[column]),
+            'real': bool(group_real[column]),
+        } for column in order.tolist()]
+
+        if any(isinstance(member_predictions, StalePredictions) for member_predictions in members_predictions):
+            return StalePredictions(predictions)
+        return predictions
+
+    @staticmethod
+    def _get_recommendations_for_group(profile_ids, n):
+        rs_response = RemyRSService._get(
+            'group',
             f'{REMY_RS_BASE_URL}/recommendations/group/',
             params={'n': n, 'user_id': profile_ids},
         )
@@ -43,7 +492,17 @@ class RemyRSService:
 
     @staticmethod
     def get_predicted_rating_for_interaction(profile_id, recipe_id):
-        rs_response = requests.get(
+        """Real or predicted rating of profile for recipe.
+
+        recipe_id can also be a list of ids, in which case a list of predictions for just those
+        recipes is returned (in no particular order) and the RS is asked only for the ones not
+        already cached.
+        """
+        if isinstance(recipe_id, (list, tuple, set)):
+            return RemyRSService._get_predicted_ratings(profile_id, recipe_id)
+
+        rs_response = RemyRSService._get(
+            'interaction',
             f'{REMY_RS_BASE_URL}/recommendations/user/{profile_id}/recipe/{recipe_id}',
         )
         if rs_response.status_code != status.HTTP_200_OK:
@@ -52,3 +511,62 @@ class RemyRSService:
                 f' from RS: {rs_response.status_code}, {rs_response.json()}'
             )
         return rs_response.json()['prediction']
+
+    @staticmethod
+    def _get_predicted_ratings(profile_id, recipe_ids):
+        def get_local_predictions(recommender):
+            return recommender.get_predicted_ratings(profile_id, recipe_ids)
+
+        if REMY_RS_BACKEND == 'local':
+            return RemyRSService._local(get_local_predictions, required=True)
+
+        try:
+            return RemyRSService._get_cached_predicted_ratings(profile_id, recipe_ids)
+        except (RequestException, RemyRSService.RecSysException):
+            predictions = RemyRSService._local(get_local_predictions)
+            if predictions is None:
+                raise
+            return predictions
+
+    @staticmethod
+    def _get_cached_predicted_ratings(profile_id, recipe_ids):
+        cache = caches['recommendations']
+        recipe_ids = set(recipe_ids)
+
+        all_predictions = cache.get(RemyRSService._user_cache_key(profile_id, 0))
+        if all_predictions is not None:
+            return [p for p in all_predictions if p['recipe_id'] in recipe_ids]
+
+        generation = get_generation(cache, f'rs:user:{profile_id}')
+        cache_keys = {recipe_id: f'rs:user:{profile_id}:{generation}:recipe:{recipe_id}' for recipe_id in recipe_ids}
+        cached = cache.get_many(cache_keys.values())
+        predictions = [cached[key] for key in cache_keys.values() if key in cached]
+        missing = sorted(recipe_id for recipe_id, key in cache_keys.items() if key not in cached)
+        if not missing:
+            return predictions
+
+        if cache.get(BATCHED_RATINGS_REJECTED_KEY):
+            return RemyRSService._filter_all_predictions(profile_id, recipe_ids)
+        rs_response = RemyRSService._get(
+            'interactions',
+            f'{REMY_RS_BASE_URL}/recommendations/user/{profile_id}/recipes',
+            params={'recipe_id': missing},
+        )
+        if status.is_client_error(rs_response.status_code):
+            # an RS without this endpoint (or that doesn't take these ids) still has the full list, which is
+            # asked for instead until the cache entry of the rejection expires
+            cache.set(BATCHED_RATINGS_REJECTED_KEY, True)
+            return RemyRSService._filter_all_predictions(profile_id, recipe_ids)
+        if rs_response.status_code != status.HTTP_200_OK:
+            raise RemyRSService.RecSysException(
+                f'Failed to get predicted ratings for {profile_id}:{missing}'
+                f' from RS: {rs_response.status_code}, {rs_response.content}'
+            )
+        fetched = rs_response.json()['predictions']
+        cache.set_many({cache_keys[p['recipe_id']]: p for p in fetched if p['recipe_id'] in cache_keys})
+        return predictions + fetched
+
+    @staticmethod
+    def _filter_all_predictions(profile_id, recipe_ids):
+        all_predictions = RemyRSService.get_recommendations_for_user(profile_id, n='all')
+        return [p for p in all_predictions if p['recipe_id'] in recipe_ids]
@@ -0,0 +1,86 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from apps.inventories.models import InventoryItem
+from apps.inventories.signals import inventory_items_upserted
+from apps.products.models import Product
+from apps.recipes.models import Interaction, Ingredient, Recipe, Dish, DishCategory
+from apps.recommendations.models import RecipeRecommendation
+from apps.recommendations.services import RemyRSService
+from apps.recommendations.utils import (
+    RestrictionIndex, refresh_cookable_recipes, invalidate_cookable_recipes, invalidate_place_inventory,
+)
+
+
+@receiver(post_save, sender=Interaction)
+@receiver(post_delete, sender=Interaction)
+def invalidate_predictions(instance, **_kwargs):
+    RemyRSService.invalidate_user(instance.profile_id)
+
+
+@receiver(post_save, sender=Interaction)
+def update_stored_rating(instance, **_kwargs):
+    # stored rankings are only recomputed nightly, but a rating the user gave must show right away
+    if instance.rating is not None:
+        RecipeRecommendation.objects.filter(profile_id=instance.profile_id, recipe_id=instance.recipe_id).update(
+            rating=instance.rating, rating_is_real=True)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=DishCategory)
+@receiver(post_delete, sender=DishCategory)
+# deleting a dish sets its recipes' dish to NULL and deletes its categories in bulk, which send no signals
+@receiver(post_save, sender=Dish)
+@receiver(post_delete, sender=Dish)
+def invalidate_restriction_index(**_kwargs):
+    RestrictionIndex.invalidate()
+
+
+@receiver(m2m_changed, sender=Dish.categories.through)
+def invalidate_restriction_index_on_categories(action, **_kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        RestrictionIndex.invalidate()
+
+
+@receiver(post_init, sender=InventoryItem)
+def remember_inventory_item_product(instance, **_kwargs):
+    # so that if an item's product is changed, recipes with the old one are re-evaluated too
+    instance._loaded_product_id = instance.product_id
+
+
+@receiver(post_save, sender=InventoryItem)
+@receiver(post_delete, sender=InventoryItem)
+def refresh_place_cookable_recipes(instance, raw=False, **_kwargs):
+    if raw:
+        # loaded from fixtures, without a place being looked at
+        invalidate_cookable_recipes()
+        return
+
+    product_ids = {instance.product_id, getattr(instance, '_loaded_product_id', instance.product_id)}
+    instance._loaded_product_id = instance.product_id
+    refresh_cookable_recipes_on_commit(instance.place_id, product_ids)
+
+
+@receiver(inventory_items_upserted, sender=InventoryItem)
+def refresh_place_cookable_recipes_on_upsert(place_id, product_ids, **_kwargs):
+    refresh_cookable_recipes_on_commit(place_id, product_ids)
+
+
+def refresh_cookable_recipes_on_commit(place_id, product_ids):
+    invalidate_place_inventory(place_id)
+    # after commit, so that items of a rolled back request are never seen
+    transaction.on_commit(partial(refresh_cookable_recipes, place_id, product_ids))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Product)
+def invalidate_all_cookable_recipes(**_kwargs):
+    invalidate_cookable_recipes()
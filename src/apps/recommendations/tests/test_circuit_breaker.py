@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.recommendations.services import CircuitBreaker
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.time_patcher = mock.patch('apps.recommendations.services.time.monotonic', lambda: self.now)
+        self.time_patcher.start()
+        self.circuit = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    def tearDown(self):
+        self.time_patcher.stop()
+
+    def test_opens_after_consecutive_failures(self):
+        self.circuit.record_failure()
+        self.circuit.record_success()
+        self.circuit.record_failure()
+        self.assertTrue(self.circuit.allow())
+
+        self.circuit.record_failure()
+        self.assertEqual(self.circuit.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.circuit.allow())
+
+    def test_lets_a_single_probe_through_after_reset_timeout(self):
+        self.circuit.record_failure()
+        self.circuit.record_failure()
+
+        self.now += 30
+        self.assertTrue(self.circuit.allow())
+        self.assertEqual(self.circuit.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.circuit.allow())
+
+        self.circuit.record_success()
+        self.assertEqual(self.circuit.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.circuit.allow())
+
+    def test_failed_probe_opens_circuit_again(self):
+        self.circuit.record_failure()
+        self.circuit.record_failure()
+        self.now += 30
+        self.circuit.allow()
+
+        self.circuit.record_failure()
+        self.assertEqual(self.circuit.state, CircuitBreaker.OPEN)
+        self.now += 29
+        self.assertFalse(self.circuit.allow())
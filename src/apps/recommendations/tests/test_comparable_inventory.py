@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from common.testing import local_caches
+from apps.inventories.models import InventoryItem, Place, PlaceMember
+from apps.products.models import Product, Unit
+from apps.profiles.models import Event
+from apps.recipes.models import Recipe, Ingredient
+from apps.recommendations.utils import ComparableInventory, get_event_place_ids, get_pantry
+
+
+class ComparableInventoryTests(TestCase):
+    fixtures = ['unit']
+
+    def setUp(self):
+        self.place = Place.objects.create()
+        self.leche = Product.objects.create(name='Leche', density=1032)
+        self.manzana = Product.objects.create(name='Manzana', avg_unit_weight=0.25)
+
+        # a place has one item per product and unit, so the leche can be in two items
+        InventoryItem.objects.create(place=self.place, product=self.leche,
+                                     quantity=1, unit=Unit.objects.get(short_name='L'))
+        InventoryItem.objects.create(place=self.place, product=self.leche,
+                                     quantity=500, unit=Unit.objects.get(short_name='mL'))
+        InventoryItem.objects.create(place=self.place, product=self.manzana,
+                                     quantity=4, unit=Unit.objects.get(name='unit'))
+
+        self.inv = ComparableInventory(InventoryItem.objects.filter(place=self.place)
+                                       .prefetch_related('product', 'unit'))
+
+    def _recipe(self, *ingredients):
+        recipe = Recipe.objects.create(title='Test recipe')
+        for product, quantity, unit in ingredients:
+            Ingredient.objects.create(recipe=recipe, product=product, quantity=quantity,
+                                      unit=Unit.objects.get(name=unit) if unit else None)
+        return recipe
+
+    def test_items_of_same_product_are_merged_in_base_unit(self):
+        self.assertAlmostEqual(self.inv.get(self.leche.id), 1.5)
+        self.assertAlmostEqual(self.inv.get(self.manzana.id), 4)
+
+    def test_can_make_converting_between_dimensionalities(self):
+        # 1.5 L of leche weigh 1.548 kg, 4 manzanas weigh 1 kg
+        self.assertTrue(self.inv.can_make(self._recipe((self.leche, 1500, 'gram'), (self.manzana, 1, 'kilogram'))))
+        self.assertFalse(self.inv.can_make(self._recipe((self.leche, 1600, 'gram'))))
+        self.assertFalse(self.inv.can_make(self._recipe((self.manzana, 1100, 'gram'))))
+
+    def test_can_make_sums_repeated_ingredients(self):
+        self.assertTrue(self.inv.can_make(self._recipe((self.leche, 1, 'liter'), (self.leche, 500, 'milliliter'))))
+        self.assertFalse(self.inv.can_make(self._recipe((self.leche, 1, 'liter'), (self.leche, 501, 'milliliter'))))
+
+    def test_cannot_make_without_conversion_data_or_product(self):
+        harina = Product.objects.create(name='Harina')
+        self.assertFalse(self.inv.can_make(self._recipe((self.leche, 1, 'unit'))))
+        self.assertFalse(self.inv.can_make(self._recipe((harina, None, None))))
+
+    def test_can_make_does_not_consume_inventory(self):
+        recipe = self._recipe((self.manzana, 3, 'unit'), (self.leche, None, None))
+        self.assertTrue(self.inv.can_make(recipe))
+        self.assertTrue(self.inv.can_make(recipe))
+        self.assertAlmostEqual(self.inv.get(self.manzana.id), 4)
+
+    def test_can_make_many_returns_mask_and_shortfall_in_order(self):
+        harina = Product.objects.create(name='Harina')
+        enough = self._recipe((self.leche, 1, 'liter'), (self.manzana, 2, 'unit'))
+        not_enough = self._recipe((self.leche, 1, 'liter'), (self.leche, 1, 'liter'), (self.manzana, 1, 'unit'))
+        missing = self._recipe((harina, 1, 'kilogram'))
+
+        can_make, shortfall = self.inv.can_make_many([not_enough.id, enough.id, missing.id])
+
+        self.assertEqual(list(can_make), [False, True, False])
+        self.assertEqual(list(shortfall[0].keys()), [self.leche.id])
+        self.assertAlmostEqual(shortfall[0][self.leche.id], 0.5)
+        self.assertEqual(shortfall[1], {})
+        self.assertEqual(shortfall[2], {harina.id: float('inf')})
+
+    def test_for_places_sums_all_places_in_one_query(self):
+        other_place = Place.objects.create()
+        InventoryItem.objects.create(place=other_place, product=self.leche,
+                                     quantity=250, unit=Unit.objects.get(short_name='mL'))
+        InventoryItem.objects.create(place=other_place, product=self.manzana,
+                                     quantity=500, unit=Unit.objects.get(name='gram'))
+
+        with self.assertNumQueries(1):
+            inv = ComparableInventory.for_places([self.place.id, other_place.id])
+
+        self.assertAlmostEqual(inv.get(self.leche.id), 1.75)
+        # 4 manzanas weigh 1 kg; grams come before units, so manzana is kept in kilograms
+        self.assertAlmostEqual(inv.get(self.manzana.id), 1.5)
+        self.assertTrue(inv.can_make(self._recipe((self.manzana, 1.5, 'kilogram'))))
+
+
+class EventPantryTests(TestCase):
+    fixtures = ['unit']
+
+    def setUp(self):
+        cache.clear()
+        self.leche = Product.objects.create(name='Leche')
+        self.liter = Unit.objects.get(name='liter')
+        self.host, self.host_place = self._profile_with_place('host')
+        self.guest, self.guest_place = self._profile_with_place('guest')
+        self.event = Event.objects.create(host=self.host,
+                                          starting_datetime=timezone.now(),
+                                          finishing_datetime=timezone.now() + timedelta(hours=2))
+        self.event.attendees.set([self.host, self.guest])
+
+    def _profile_with_place(self, username):
+        profile = get_user_model().objects.create(username=username, email=f'{username}@test.com').profile
+        place = Place.objects.create()
+        PlaceMember.objects.create(place=place, member=profile, is_the_default_one=True)
+        InventoryItem.objects.create(place=place, product=self.leche, quantity=1, unit=self.liter)
+        return profile, place
+
+    def test_event_places_are_its_place_and_guests_default_places(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_event_place_ids(self.event), {self.host_place.id, self.guest_place.id})
+
+        self.event.only_host_inventory = True
+        self.assertEqual(get_event_place_ids(self.event), {self.host_place.id})
+
+    @local_caches
+    def test_pantry_is_cached_until_an_inventory_changes(self):
+        place_ids = get_event_place_ids(self.event)
+        self.assertAlmostEqual(get_pantry(place_ids).get(self.leche.id), 2)
+
+        with self.assertNumQueries(0):
+            self.assertAlmostEqual(get_pantry(place_ids).get(self.leche.id), 2)
+
+        item = self.guest_place.inventory.get()
+        item.quantity = 2
+        item.save()
+        self.assertAlmostEqual(get_pantry(place_ids).get(self.leche.id), 3)
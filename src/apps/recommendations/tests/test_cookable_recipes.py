@@ -0,0 +1,109 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from common.testing import local_caches
+from apps.inventories.models import InventoryItem, Place
+from apps.inventories.serializers import InventoryItemSerializer
+from apps.products.models import Product, Unit
+from apps.recipes.models import Recipe, Ingredient
+from apps.recommendations import utils
+from apps.recommendations.utils import get_cookable_recipe_ids
+
+
+# not a TestCase, as the cookable recipes are refreshed when the transaction commits
+class CookableRecipesTests(TransactionTestCase):
+    fixtures = ['unit']
+
+    def setUp(self):
+        cache.clear()
+        self.place = Place.objects.create()
+        self.leche = Product.objects.create(name='Leche', density=1032)
+        self.harina = Product.objects.create(name='Harina')
+        self.liter = Unit.objects.get(name='liter')
+
+        self.item = InventoryItem.objects.create(place=self.place, product=self.leche, quantity=1, unit=self.liter)
+
+        self.little_leche = self._recipe((self.leche, 500, 'milliliter'))
+        self.lots_of_leche = self._recipe((self.leche, 2, 'liter'))
+        self.harina_recipe = self._recipe((self.harina, None, None))
+
+    def _recipe(self, *ingredients):
+        recipe = Recipe.objects.create(title='Test recipe')
+        for product, quantity, unit in ingredients:
+            Ingredient.objects.create(recipe=recipe, product=product, quantity=quantity,
+                                      unit=Unit.objects.get(name=unit) if unit else None)
+        return recipe
+
+    def test_cookable_recipes_are_computed_for_place(self):
+        self.assertEqual(get_cookable_recipe_ids(self.place.id), {self.little_leche.id})
+        self.assertEqual(get_cookable_recipe_ids(Place.objects.create().id), set())
+
+    def test_cookable_recipes_follow_inventory_changes(self):
+        get_cookable_recipe_ids(self.place.id)
+
+        self.item.quantity = 2
+        self.item.save()
+        self.assertEqual(get_cookable_recipe_ids(self.place.id), {self.little_leche.id, self.lots_of_leche.id})
+
+        self.item.delete()
+        self.assertEqual(get_cookable_recipe_ids(self.place.id), set())
+
+    def test_concurrent_refreshes_lose_no_change(self):
+        get_cookable_recipe_ids(self.place.id)
+        place_inventory = utils._place_inventory
+        interleaved = []
+
+        def place_inventory_with_a_concurrent_change(place_id):
+            inventory = place_inventory(place_id)
+            if not interleaved:
+                interleaved.append(place_id)
+                # another change, refreshed while this refresh is still running
+                InventoryItem.objects.create(place=self.place, product=self.harina, quantity=1,
+                                             unit=Unit.objects.get(name='kilogram'))
+            return inventory
+
+        with patch.object(utils, '_place_inventory', place_inventory_with_a_concurrent_change):
+            self.item.quantity = 2
+            self.item.save()
+
+        self.assertEqual(get_cookable_recipe_ids(self.place.id),
+                         {self.little_leche.id, self.lots_of_leche.id, self.harina_recipe.id})
+
+    def test_cookable_recipes_follow_items_added_in_bulk(self):
+        get_cookable_recipe_ids(self.place.id)
+
+        items = [{'product': 'Leche', 'quantity': 1, 'unit': 'liter'},
+                 {'product': 'Harina', 'quantity': 1, 'unit': 'kilogram'}]
+        serializer = InventoryItemSerializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(place=self.place)
+
+        self.assertEqual(get_cookable_recipe_ids(self.place.id),
+                         {self.little_leche.id, self.lots_of_leche.id, self.harina_recipe.id})
+
+    def test_changing_item_product_reevaluates_recipes_of_both_products(self):
+        get_cookable_recipe_ids(self.place.id)
+
+        self.item.product = self.harina
+        self.item.save()
+
+        self.assertEqual(get_cookable_recipe_ids(self.place.id), {self.harina_recipe.id})
+
+    @local_caches
+    def test_refresh_only_looks_at_recipes_with_changed_product(self):
+        get_cookable_recipe_ids(self.place.id)
+
+        # item update, recipes using leche, the place's inventory and just those recipes' ingredients
+        with self.assertNumQueries(4):
+            self.item.quantity = 2
+            self.item.save()
+
+    def test_changing_ingredients_recomputes_all(self):
+        get_cookable_recipe_ids(self.place.id)
+
+        Ingredient.objects.create(recipe=self.harina_recipe, product=self.leche, quantity=1, unit=self.liter)
+        Ingredient.objects.filter(recipe=self.harina_recipe, product=self.harina).delete()
+
+        self.assertEqual(get_cookable_recipe_ids(self.place.id), {self.little_leche.id, self.harina_recipe.id})
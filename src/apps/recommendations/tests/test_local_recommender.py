@@ -0,0 +1,83 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from requests.exceptions import ConnectionError
+
+from apps.recipes.models import Interaction, Recipe
+from apps.recommendations.local_recommender import LocalRecommender, get_local_recommender
+from apps.recommendations.services import RemyRSService, StalePredictions, rs_circuit
+
+
+def sample_profile(username):
+    return get_user_model().objects.create(username=username, email=f'{username}@test.com').profile
+
+
+class LocalRecommenderTests(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d = (Recipe.objects.create(title=title) for title in 'abcd')
+        self.u_1, self.u_2, self.u_3, self.u_new = (sample_profile(f'user{i}') for i in range(4))
+
+        # a and b are liked together, c by those who don't like a
+        self._rate(self.u_1, self.a, 9)
+        self._rate(self.u_1, self.b, 9)
+        self._rate(self.u_2, self.a, 9)
+        self._rate(self.u_2, self.b, 8)
+        self._rate(self.u_2, self.c, 2)
+        self._rate(self.u_3, self.a, 2)
+        self._rate(self.u_3, self.c, 9)
+        # cooked but not rated counts as liked
+        Interaction.objects.create(profile=self.u_3, recipe=self.d, cooked_at=[timezone.now()])
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.snapshot = os.path.join(tmp_dir.name, 'local_recommender.npz')
+
+    @staticmethod
+    def _rate(profile, recipe, rating):
+        Interaction.objects.create(profile=profile, recipe=recipe, rating=rating)
+
+    def test_predictions_follow_similar_recipes(self):
+        recommender = LocalRecommender.build()
+        self._rate(self.u_new, self.a, 10)
+
+        predictions = recommender.get_recommendations_for_user(self.u_new.id, n=0)
+
+        self.assertEqual(predictions[0], {'recipe_id': self.a.id, 'rating': 10.0, 'real': True})
+        ranking = [p['recipe_id'] for p in predictions]
+        self.assertLess(ranking.index(self.b.id), ranking.index(self.c.id))
+        self.assertEqual(len(recommender.get_recommendations_for_user(self.u_new.id, n=2)), 2)
+
+    def test_users_without_interactions_get_shrunk_popularity(self):
+        recommender = LocalRecommender.build()
+
+        predictions = recommender.get_recommendations_for_user(self.u_new.id, n=0)
+
+        self.assertEqual([p['recipe_id'] for p in predictions], [self.b.id, self.d.id, self.a.id, self.c.id])
+        self.assertFalse(any(p['real'] for p in predictions))
+
+    def test_command_writes_snapshot_that_is_loaded_by_workers(self):
+        with override_settings(LOCAL_RECOMMENDER_SNAPSHOT=self.snapshot):
+            self.assertIsNone(get_local_recommender())
+            call_command('build_local_recommender', stdout=open(os.devnull, 'w'))
+            recommender = get_local_recommender()
+
+        built = LocalRecommender.build()
+        self.assertEqual(recommender.recipe_ids.tolist(), built.recipe_ids.tolist())
+        self.assertEqual(recommender.get_predicted_ratings(self.u_1.id, [self.c.id, 12345]),
+                         built.get_predicted_ratings(self.u_1.id, [self.c.id, 12345]))
+
+    @mock.patch('apps.recommendations.services.requests.Session.get', side_effect=ConnectionError)
+    def test_service_falls_back_to_local_recommender(self, _mock_get):
+        rs_circuit.reset()
+        LocalRecommender.build().save(self.snapshot)
+
+        with override_settings(LOCAL_RECOMMENDER_SNAPSHOT=self.snapshot):
+            predictions = RemyRSService.get_recommendations_for_group([self.u_1.id, self.u_2.id], n=3)
+
+        self.assertIsInstance(predictions, StalePredictions)
+        self.assertEqual(len(predictions), 3)
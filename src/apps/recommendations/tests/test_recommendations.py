@@ -1,12 +1,20 @@
 from unittest import mock
 
 from django.contrib.auth import get_user_model
+from requests.exceptions import ConnectionError
+from django.core.cache import caches
+from django.core.management import call_command
+from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from apps.profiles.models import Profile
 from apps.inventories.models import Place
+from apps.recommendations.models import RecipeRecommendation
 from common.utils import query_reverse
+from apps.recommendations.services import (
+    REMY_RS_CONNECT_TIMEOUT, REMY_RS_READ_TIMEOUT, RemyRSService, rs_stats, rs_circuit,
+)
 from .mock_rs_responses import mock_rs_responses
 
 
@@ -33,8 +41,12 @@ class RecommendationTest(APITestCase):
 
     def setUp(self):
         self.u_1 = sample_user_1()
-        self.mock_get_patcher = mock.patch('apps.recommendations.services.requests.get')
+        self.mock_get_patcher = mock.patch('apps.recommendations.services.requests.Session.get')
         self.mock_get = self.mock_get_patcher.start()
+        rs_stats.reset()
+        rs_circuit.reset()
+        caches['recommendations'].clear()
+        caches['recommendations_last_good'].clear()
 
     def tearDown(self):
         Place.objects.all().delete()
@@ -92,3 +104,220 @@ class RecommendationTest(APITestCase):
         self.assertEqual(recommendations[0].get('recipe').get('id'), 1)
         self.assertEqual(float(recommendations[0].get('rating')), 3.4)
         self.assertEqual(recommendations[0].get('rating_is_real'), True)
+
+    def test_rs_calls_have_timeouts_and_are_counted(self):
+        self._set_mock_rs_response(response=mock_rs_responses[1])
+        self.client.force_authenticate(user=self.u_1)
+
+        self.client.get(recommend_recipes_url())
+        caches['recommendations'].clear()
+        caches['recommendations_last_good'].clear()
+        self._set_mock_rs_response(response={}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        resp = self.client.get(recommend_recipes_url())
+
+        self.assertEqual(resp.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(self.mock_get.call_args[1]['timeout'], (REMY_RS_CONNECT_TIMEOUT, REMY_RS_READ_TIMEOUT))
+        self.assertEqual(rs_stats.snapshot()['user']['calls'], 2)
+        self.assertEqual(rs_stats.snapshot()['user']['failures'], 1)
+
+    def test_rs_stats_are_only_for_admins(self):
+        self.client.force_authenticate(user=self.u_1)
+        resp = self.client.get(reverse('recommendations-rs-stats'))
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.u_1.is_staff = True
+        self.u_1.save()
+        resp = self.client.get(reverse('recommendations-rs-stats'))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_predictions_are_cached_until_user_rates_a_recipe(self):
+        self._set_mock_rs_response(response=mock_rs_responses[1])
+        self.client.force_authenticate(user=self.u_1)
+
+        self.client.get(recommend_recipes_url())
+        resp = self.client.get(recommend_recipes_url())
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data.get('count'), 2)
+        self.assertEqual(self.mock_get.call_count, 1)
+
+        self.client.put(reverse('rate-recipe'), data={'recipe_id': 1, 'rating': 8}, format='json')
+        self._set_mock_rs_response(response=mock_rs_responses[2])
+        resp = self.client.get(recommend_recipes_url())
+        self.assertEqual(resp.data.get('count'), 3)
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_recipe_list_asks_rs_only_for_recipes_in_page(self):
+        self._set_mock_rs_response(response={'predictions': [{'recipe_id': 2, 'rating': 3.7, 'real': False}]})
+        self.client.force_authenticate(user=self.u_1)
+
+        resp = self.client.get(query_reverse('recipe-list', query_kwargs={'page': 1, 'page_size': 2}))
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.mock_get.call_args[1]['params'], {'recipe_id': [1, 2]})
+        ratings = {recipe['id']: recipe['rating'] for recipe in resp.data['results']}
+        self.assertEqual(ratings, {1: None, 2: {'score': 3.7, 'real': False}})
+
+        # already fetched, and full list of predictions (when cached) also works
+        self.client.get(reverse('recipe-detail', kwargs={'pk': 2}))
+        self._set_mock_rs_response(response=mock_rs_responses[1])
+        self.client.get(recommend_recipes_url())
+        resp = self.client.get(reverse('recipe-detail', kwargs={'pk': 1}))
+        self.assertEqual(resp.data['rating'], {'score': 3.4, 'real': True})
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_recipe_list_uses_all_predictions_if_rs_rejects_asking_for_some(self):
+        def get(url, **_kwargs):
+            if url.endswith('/recipes'):
+                return mock.Mock(status_code=status.HTTP_404_NOT_FOUND)
+            return mock.Mock(status_code=status.HTTP_200_OK, json=mock.Mock(return_value=mock_rs_responses[1]))
+        self.mock_get.side_effect = get
+        self.client.force_authenticate(user=self.u_1)
+
+        resp = self.client.get(reverse('recipe-detail', kwargs={'pk': 1}))
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['rating'], {'score': 3.4, 'real': True})
+        self.assertEqual(self.mock_get.call_count, 2)
+
+        # the rejection is remembered, so even without a cached full list that's what the RS is asked for
+        RemyRSService.invalidate_user(self.u_1.profile.id)
+        resp = self.client.get(reverse('recipe-detail', kwargs={'pk': 1}))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.mock_get.call_count, 3)
+        self.assertFalse(self.mock_get.call_args[0][0].endswith('/recipes'))
+
+    def _set_mock_rs_ranking(self, response):
+        """Mock RS that honors n, like the real one."""
+        def get(_url, params=None, **_kwargs):
+            n = params['n']
+            mock_response = mock.Mock(status_code=status.HTTP_200_OK)
+            mock_response.json.return_value = {
+                'predictions': response['predictions'][:n] if n else response['predictions']
+            }
+            return mock_response
+        self.mock_get.side_effect = get
+
+    def test_windowed_recommendations_follow_cursor(self):
+        self._set_mock_rs_ranking(response=mock_rs_responses[2])
+        self.client.force_authenticate(user=self.u_1)
+
+        resp = self.client.get(query_reverse('recommendations-recommend-recipes-me',
+                                             query_kwargs={'windowed': True, 'page_size': 1}))
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', resp.data)
+        self.assertEqual([r['recipe']['id'] for r in resp.data['results']], [1])
+        self.assertEqual(self.mock_get.call_args[1]['params'], {'n': 4})
+
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual([r['recipe']['id'] for r in resp.data['results']], [2])
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual([r['recipe']['id'] for r in resp.data['results']], [3])
+        self.assertIsNone(resp.data['next'])
+
+    @mock.patch('apps.recommendations.views.RECOMMENDATIONS_WINDOW_OVERFETCH', 1)
+    def test_windowed_recommendations_grow_window_when_filtered_out(self):
+        Place.objects.first().members.add(Profile.objects.get_or_create(user=self.u_1)[0])
+        self._set_mock_rs_ranking(response=mock_rs_responses[2])
+        self.client.force_authenticate(user=self.u_1)
+
+        resp = self.client.get(query_reverse('recommendations-recommend-recipes-me',
+                                             query_kwargs={'windowed': True, 'page_size': 1,
+                                                           'need_all_ingredients': True}))
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['recipe']['id'] for r in resp.data['results']], [1])
+        self.assertIsNone(resp.data['next'])
+        self.assertEqual([c[1]['params'] for c in self.mock_get.call_args_list], [{'n': 2}, {'n': 4}])
+
+    def test_last_good_predictions_are_served_as_stale_when_rs_fails(self):
+        self._set_mock_rs_response(response=mock_rs_responses[1])
+        self.client.force_authenticate(user=self.u_1)
+        self.client.get(recommend_recipes_url())
+
+        RemyRSService.invalidate_user(self.u_1.profile.id)
+        self._set_mock_rs_response(response={}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        resp = self.client.get(recommend_recipes_url())
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data.get('count'), 2)
+        self.assertEqual(resp['Warning'], '110 - "Response is Stale"')
+
+    def test_last_good_predictions_survive_evictions_of_the_recommendations_cache(self):
+        self._set_mock_rs_response(response=mock_rs_responses[1])
+        self.client.force_authenticate(user=self.u_1)
+        self.client.get(recommend_recipes_url())
+
+        caches['recommendations'].clear()
+        self._set_mock_rs_response(response={}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        resp = self.client.get(recommend_recipes_url())
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data.get('count'), 2)
+        self.assertEqual(resp['Warning'], '110 - "Response is Stale"')
+
+    @mock.patch.object(rs_circuit, 'failure_threshold', 2)
+    def test_rs_is_not_called_while_circuit_is_open(self):
+        self.mock_get.side_effect = ConnectionError
+        self.client.force_authenticate(user=self.u_1)
+
+        for _ in range(3):
+            resp = self.client.get(recommend_recipes_url())
+            self.assertEqual(resp.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        self.assertEqual(self.mock_get.call_count, 2)
+        self.assertEqual(RemyRSService.stats()['circuit']['state'], rs_circuit.OPEN)
+
+    def test_stored_recommendations_are_served_without_calling_rs(self):
+        Place.objects.first().members.add(Profile.objects.get_or_create(user=self.u_1)[0])
+        self._set_mock_rs_response(response=mock_rs_responses[1])
+        call_command('precompute_recommendations', active_days=0, stdout=mock.Mock())
+        self.assertEqual(self.mock_get.call_count, 1)
+        self.assertEqual(RecipeRecommendation.objects.filter(profile=self.u_1.profile).count(), 2)
+
+        self.mock_get.side_effect = ConnectionError
+        self.client.force_authenticate(user=self.u_1)
+        resp = self.client.get(recommend_recipes_url(need_all_ingredients=True))
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data.get('count'), 1)
+        self.assertEqual(resp.data.get('results')[0].get('recipe').get('id'), 1)
+        self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_stored_recommendations_get_ratings_given_after(self):
+        self._set_mock_rs_response(response=mock_rs_responses[1])
+        call_command('precompute_recommendations', active_days=0, stdout=mock.Mock())
+        self.client.force_authenticate(user=self.u_1)
+
+        self.client.put(reverse('rate-recipe'), data={'recipe_id': 2, 'rating': 8}, format='json')
+
+        stored = RecipeRecommendation.objects.get(profile=self.u_1.profile, recipe_id=2)
+        self.assertEqual(stored.rating, 8)
+        self.assertTrue(stored.rating_is_real)
+
+    def test_group_recommendations_aggregate_cached_member_predictions(self):
+        u_2 = get_user_model().objects.create(username='soyTest2', email='test2@test.com')
+        members_predictions = {
+            self.u_1.profile.id: [{'recipe_id': 1, 'rating': 8, 'real': True},
+                                  {'recipe_id': 2, 'rating': 4, 'real': False}],
+            u_2.profile.id: [{'recipe_id': 2, 'rating': 9, 'real': True},
+                             {'recipe_id': 1, 'rating': 6, 'real': False}],
+        }
+
+        def get(url, **_kwargs):
+            mock_response = mock.Mock(status_code=status.HTTP_200_OK)
+            mock_response.json.return_value = {'predictions': members_predictions[int(url.rsplit('/', 1)[1])]}
+            return mock_response
+        self.mock_get.side_effect = get
+        group = [self.u_1.profile.id, u_2.profile.id]
+
+        average = RemyRSService.get_recommendations_for_group(group, n='all', aggregation='average')
+        least_misery = RemyRSService.get_recommendations_for_group(group, n='all', aggregation='least_misery')
+        most_pleasure = RemyRSService.get_recommendations_for_group(group, n=1, aggregation='most_pleasure')
+
+        self.assertEqual(average, [{'recipe_id': 1, 'rating': 7.0, 'real': False},
+                                   {'recipe_id': 2, 'rating': 6.5, 'real': False}])
+        self.assertEqual([p['recipe_id'] for p in least_misery], [1, 2])
+        self.assertEqual(most_pleasure, [{'recipe_id': 2, 'rating': 9.0, 'real': False}])
+        # one call per member, then served from each one's cache
+        self.assertEqual(self.mock_get.call_count, 2)
@@ -0,0 +1,56 @@
+from django.test import TestCase
+
+from apps.products.models import Product
+from apps.recipes.models import Dish, DishCategory, Recipe, Ingredient
+from apps.recommendations.utils import get_restriction_index
+
+
+class RestrictionIndexTests(TestCase):
+
+    def setUp(self):
+        self.leche = Product.objects.create(name='Leche')
+        self.harina = Product.objects.create(name='Harina')
+        self.vegetariano = DishCategory.objects.create(name='Vegetariano')
+        self.celiaco = DishCategory.objects.create(name='Apto celíaco')
+
+        self.dish = Dish.objects.create(name='Panqueques')
+        self.dish.categories.add(self.vegetariano)
+        self.recipe = Recipe.objects.create(dish=self.dish)
+        Ingredient.objects.create(recipe=self.recipe, product=self.leche)
+        self.no_dish_recipe = Recipe.objects.create(title='Agua')
+
+    def _allows(self, recipe, forbidden_products, restrictions):
+        index = get_restriction_index()
+        return index.allows(recipe.id,
+                            index.products_mask(p.id for p in forbidden_products),
+                            index.categories_mask(restrictions))
+
+    def test_forbidden_products_exclude_recipe(self):
+        self.assertTrue(self._allows(self.recipe, [self.harina], set()))
+        self.assertFalse(self._allows(self.recipe, [self.harina, self.leche], set()))
+        self.assertTrue(self._allows(self.no_dish_recipe, [self.leche], set()))
+
+    def test_all_restrictions_must_be_dish_categories(self):
+        self.assertTrue(self._allows(self.recipe, [], {'vegetariano'}))
+        self.assertFalse(self._allows(self.recipe, [], {'vegetariano', 'apto celíaco'}))
+        self.assertFalse(self._allows(self.recipe, [], {'vegano'}))
+        self.assertFalse(self._allows(self.no_dish_recipe, [], {'vegetariano'}))
+
+    def test_index_is_updated_when_ingredients_or_categories_change(self):
+        self.assertFalse(self._allows(self.recipe, [self.harina], {'apto celíaco'}))
+
+        Ingredient.objects.create(recipe=self.recipe, product=self.harina)
+        self.assertFalse(self._allows(self.recipe, [self.harina], set()))
+
+        self.dish.categories.add(self.celiaco)
+        self.assertTrue(self._allows(self.recipe, [], {'vegetariano', 'apto celíaco'}))
+
+        self.recipe.dish = None
+        self.recipe.save()
+        self.assertFalse(self._allows(self.recipe, [], {'vegetariano'}))
+
+    def test_index_is_updated_when_dish_is_deleted(self):
+        self.assertTrue(self._allows(self.recipe, [], {'vegetariano'}))
+
+        self.dish.delete()
+        self.assertFalse(self._allows(self.recipe, [], {'vegetariano'}))
@@ -0,0 +1,105 @@
+import threading
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from common.testing import local_caches
+from apps.recommendations.services import RemyRSService, SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+        # released once by each caller that starts waiting on an in-flight call
+        self.waiting = threading.Semaphore(0)
+        waiting = self.waiting
+
+        class Done(threading.Event):
+            def wait(self, timeout=None):
+                waiting.release()
+                return super().wait(timeout)
+
+        class Call(SingleFlight._Call):
+            def __init__(self):
+                super().__init__()
+                self.done = Done()
+
+        self.single_flight._Call = Call
+
+    def _slow_call(self, result='result', error=None):
+        def call():
+            self.calls += 1
+            self.release.wait(5)
+            if error:
+                raise error
+            return result
+        return call
+
+    def _run_concurrently(self, function, n=5):
+        results = []
+
+        def run():
+            try:
+                results.append(self.single_flight.do('key', function))
+            except ValueError as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=run) for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        # let all but the first one be waiting on the in-flight call before it finishes
+        for _ in range(n - 1):
+            self.assertTrue(self.waiting.acquire(timeout=5))
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_calls_share_one_call(self):
+        results = self._run_concurrently(self._slow_call())
+
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_calls_share_errors(self):
+        error = ValueError('RS failed')
+        results = self._run_concurrently(self._slow_call(error=error))
+
+        self.assertEqual(results, [error] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_calls_are_not_shared_once_finished(self):
+        self.release.set()
+        self.single_flight.do('key', self._slow_call())
+        self.single_flight.do('key', self._slow_call())
+
+        self.assertEqual(self.calls, 2)
+
+
+@local_caches
+class SharedSingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        caches['recommendations'].clear()
+
+    @mock.patch('apps.recommendations.services.REMY_RS_SINGLE_FLIGHT_POLL', 0.01)
+    def test_waits_for_result_of_other_worker(self):
+        cache = caches['recommendations']
+        cache.add('rs:user:1:g:0:lock', 'other worker', 5)
+        threading.Timer(0.05, lambda: cache.set('rs:user:1:g:0', ['predictions'])).start()
+        fetch = mock.Mock()
+
+        self.assertEqual(RemyRSService._shared_single_flight('rs:user:1:g:0', fetch), ['predictions'])
+        fetch.assert_not_called()
+
+    @mock.patch('apps.recommendations.services.REMY_RS_SINGLE_FLIGHT_POLL', 0.01)
+    def test_fetches_if_other_worker_finished_without_result(self):
+        cache = caches['recommendations']
+        cache.add('rs:user:1:g:0:lock', 'other worker', 5)
+        threading.Timer(0.05, lambda: cache.delete('rs:user:1:g:0:lock')).start()
+        fetch = mock.Mock(return_value=['fetched'])
+
+        self.assertEqual(RemyRSService._shared_single_flight('rs:user:1:g:0', fetch), ['fetched'])
+        self.assertIsNone(cache.get('rs:user:1:g:0:lock'))
@@ -46,14 +46,14 @@ class ComparableInventoryTest(TestCase):
     def test_reset(self):
         ing = Ingredient.objects.filter(product_id=329)[0]
 
-        self.assertEqual(self.inv.get(329).quantity, 3)
+        self.assertEqual(self.inv.get(329), 3)
         self.inv.substract(ing)
-        self.assertEqual(self.inv.get(329).quantity, 2)
+        self.assertEqual(self.inv.get(329), 2)
         self.inv.substract(ing)
-        self.assertEqual(self.inv.get(329).quantity, 1)
+        self.assertEqual(self.inv.get(329), 1)
 
         self.inv.reset()
-        self.assertEqual(self.inv.get(329).quantity, 3)
+        self.assertEqual(self.inv.get(329), 3)
 
     def test_can_make_recipe(self):
         # Shouldn't be able to do this
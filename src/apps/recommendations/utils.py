@@ -1,107 +1,383 @@
-from copy import deepcopy
+import hashlib
+import threading
 
-from pint import errors as pint_errors
+import numpy as np
+from decouple import config
+from django.core.cache import cache
+from django.db.models import Sum
 
-from apps.products.utils import (convert_to_correct_unit,
-                                 sub_quantities_with_units,
-                                 add_quantities_with_units,
-                                 )
+from common.cache import get_generation, get_generations, bump_generation
+from apps.products.utils import BASE_UNITS, get_unit_factor, get_product_factor
+from apps.recipes.models import Ingredient, Recipe
+from apps.products.models import Product
+from apps.inventories.models import InventoryItem, PlaceMember
+
+
+# How long a place's set of cookable recipes is kept after it was computed or refreshed
+COOKABLE_RECIPES_TTL = config('COOKABLE_RECIPES_TTL', 6 * 60 * 60, cast=int)
+# How long an event's aggregated inventory is kept, it's also dropped when any of its inventories change
+EVENT_PANTRY_TTL = config('EVENT_PANTRY_TTL', 60 * 60, cast=int)
+
+
+# Relative slack when comparing float amounts, so exact matches are not lost to rounding
+TOLERANCE = 1e-9
 
 
 class NotEnoughError(RuntimeError):
     pass
 
 
-class ComparableAmount:
-    quantity = 0
-    unit = None
+class ComparableInventory:
+    """Inventory compiled to plain floats, so checking recipes against it needs no pint objects.
 
-    def __init__(self, quantity=0, unit=None, product=None):
-        self.quantity = quantity
-        self.unit = unit
-        self.product = product
+    Each product's total is kept in a flat array, in the base unit (see BASE_UNITS) of the
+    dimensionality of the first item seen for that product. Pint is only used, once per unit,
+    to build the conversion factors.
+    """
 
-    def __str__(self):
-        return f'{self.quantity} {self.unit}'
+    def __init__(self, inventory_items):
+        self.index = dict()              # product_id -> position in quantities
+        self.products = []               # Product at each position
+        self.dimensionalities = []       # Dimensionality each position is stored in
+        self._factors = dict()           # (product_id, unit name) -> factor into stored base unit
 
-    def substract(self, other):
-        """Decrease own quantity with other's."""
-        self_qu, other_qu = convert_to_correct_unit(self, other)
-        return sub_quantities_with_units(self_qu, other_qu)
+        quantities = []
+        for item in inventory_items:
+            self._add(quantities, item.product, item.unit.name if item.unit else None, item.quantity)
 
-    def __sub__(self, other):
-        self.quantity = self.substract(other)
-        return self.quantity
+        self.base_quantities = np.array(quantities, dtype=float)
+        self.quantities = self.base_quantities.copy()
 
-    def add(self, other):
-        """Incrase own quantity with other's."""
-        self_qu, other_qu = convert_to_correct_unit(self, other)
-        return add_quantities_with_units(self_qu, other_qu)
+    @classmethod
+    def for_places(cls, place_ids):
+        """Inventory of all places together, with quantities summed by the database per product and unit."""
+        rows = (InventoryItem.objects
+                .filter(place_id__in=place_ids)
+                .values('product_id', 'product__density', 'product__avg_unit_weight',
+                        'product__avg_unit_volume', 'unit__name')
+                .annotate(total=Sum('quantity'))
+                .order_by('product_id', 'unit__name'))
 
-    def __add__(self, other):
-        self.quantity = self.add(other)
-        return self.quantity
+        inventory = cls(())
+        quantities = []
+        products = dict()
+        for row in rows:
+            product = products.get(row['product_id'])
+            if product is None:
+                # just what's needed for conversions
+                product = products[row['product_id']] = Product(
+                    id=row['product_id'],
+                    density=row['product__density'],
+                    avg_unit_weight=row['product__avg_unit_weight'],
+                    avg_unit_volume=row['product__avg_unit_volume'],
+                )
+            inventory._add(quantities, product, row['unit__name'], row['total'])
 
+        inventory.base_quantities = np.array(quantities, dtype=float)
+        inventory.quantities = inventory.base_quantities.copy()
+        return inventory
 
-class ComparableInventory:
-    def __init__(self, inventory_items):
-        self.base_inventory = dict()
+    def _add(self, quantities, product, unit_name, quantity):
+        position = self.index.get(product.id)
+        if position is None:
+            position = len(self.products)
+            self.index[product.id] = position
+            self.products.append(product)
+            self.dimensionalities.append(get_unit_factor(unit_name)[0] if unit_name else None)
+            quantities.append(0.0)
 
-        # store each inventory item, adding to existing if already in it
-        for item in inventory_items:
-            current = self.base_inventory.get(item.product.id, None)
-            addition = ComparableAmount(quantity=item.quantity, unit=item.unit, product=item.product)
-            if current is None:
-                self.base_inventory[item.product.id] = addition
-            else:
-                _ = current + addition
-
-        # initialize inventory
-        self.inventory = deepcopy(self.base_inventory)
+        factor = self.factor(product.id, unit_name)
+        if quantity and factor is not None:
+            quantities[position] += float(quantity) * factor
 
     def destroy(self):
-        self.inventory = None
-        self.base_inventory = None
+        self.quantities = None
+        self.base_quantities = None
 
     def reset(self):
-        for product_id, amount in self.base_inventory.items():
-            self.inventory[product_id].quantity = amount.quantity
+        self.quantities = self.base_quantities.copy()
+
+    def factor(self, product_id, unit_name):
+        """Factor taking a quantity of product in unit to the unit it's stored in, None if not convertible."""
+        key = (product_id, unit_name)
+        try:
+            return self._factors[key]
+        except KeyError:
+            pass
+
+        factor = None
+        position = self.index.get(product_id)
+        if position is not None and unit_name is not None:
+            dimensionality, unit_factor = get_unit_factor(unit_name)
+            product_factor = (get_product_factor(self.products[position],
+                                                 dimensionality,
+                                                 self.dimensionalities[position])
+                              if dimensionality else None)
+            if product_factor is not None:
+                factor = unit_factor * product_factor
 
-    def get(self, product_id: int) -> ComparableAmount:
-        return self.inventory.get(product_id)
+        self._factors[key] = factor
+        return factor
+
+    def get(self, product_id: int) -> float:
+        """Remaining quantity of product, in the base unit it's stored in."""
+        position = self.index.get(product_id)
+        return float(self.quantities[position]) if position is not None else None
 
     def print_inventory(self, product_id=None):
-        if not self.inventory:
+        if self.quantities is None or not self.quantities.size:
             print('no inventory')
             return
-        for prod_id, amount in self.inventory.items():
+        for prod_id, position in self.index.items():
             if not product_id or prod_id == product_id:
-                print(f'For {prod_id}, amount is {amount}')
+                unit = BASE_UNITS.get(self.dimensionalities[position])
+                print(f'For {prod_id}, amount is {self.quantities[position]} {unit}')
 
     def substract(self, ingredient):
-        amount = ComparableAmount(quantity=ingredient.quantity, unit=ingredient.unit, product=ingredient.product)
-        current = self.inventory.get(ingredient.product_id, None)
-        if current is None:
+        factor = self.factor(ingredient.product_id, ingredient.unit.name if ingredient.unit else None)
+        if factor is None:
             raise NotEnoughError
-        remaining = current - amount
-        if remaining < 0:
+        position = self.index[ingredient.product_id]
+        self.quantities[position] -= float(ingredient.quantity) * factor
+        if self.quantities[position] < 0:
             raise NotEnoughError
 
     def __sub__(self, ingredient):
         return self.substract(ingredient)
 
     def can_make(self, recipe):
-        ingredients = recipe.ingredient_set.all()
+        """Whether recipe can be made with what's in inventory. Inventory is left untouched."""
+        return bool(self.can_make_many([recipe.id])[0][0])
 
-        try:
-            for ingr in ingredients:
-                if ingr.quantity:
-                    self.substract(ingr)
-                else:
-                    # if non-quantified, just check it's in inventory
-                    _ = self.inventory[ingr.product_id]
-        except (NotEnoughError, pint_errors.DimensionalityError, KeyError):
-            self.reset()
+    def can_make_many(self, recipe_ids):
+        """Checks all recipes against the inventory at once.
+
+        Builds a sparse recipe x product requirement matrix in the inventory's base units (one query
+        for all ingredients) and compares it with the inventory vector. A requirement is infinite when
+        the product isn't in the inventory or its unit can't be converted.
+
+        Returns a boolean array aligned with recipe_ids and, for each recipe, a dict of
+        {product_id: missing quantity in base unit}, empty if the recipe can be made.
+        """
+        recipe_ids = list(recipe_ids)
+        rows_by_recipe = {recipe_id: row for row, recipe_id in enumerate(dict.fromkeys(recipe_ids))}
+        columns = dict(self.index)       # product_id -> column; products not in inventory go after
+
+        rows, cols, amounts = [], [], []
+        ingredients = (Ingredient.objects
+                       .filter(recipe_id__in=rows_by_recipe.keys())
+                       .values_list('recipe_id', 'product_id', 'quantity', 'unit__name'))
+        for recipe_id, product_id, quantity, unit_name in ingredients:
+            column = columns.setdefault(product_id, len(columns))
+            if product_id not in self.index:
+                amount = np.inf
+            elif not quantity:
+                # if non-quantified, it's enough that it's in inventory
+                amount = 0.0
+            else:
+                factor = self.factor(product_id, unit_name)
+                amount = float(quantity) * factor if factor is not None else np.inf
+            rows.append(rows_by_recipe[recipe_id])
+            cols.append(column)
+            amounts.append(amount)
+
+        n_columns = max(len(columns), 1)
+        keys, inverse = np.unique(np.array(rows, dtype=np.int64) * n_columns + np.array(cols, dtype=np.int64),
+                                  return_inverse=True)
+        needed = np.zeros(len(keys))
+        np.add.at(needed, inverse, np.array(amounts, dtype=float))
+        needed_rows, needed_cols = np.divmod(keys, n_columns)
+
+        available = np.zeros(n_columns)
+        available[:len(self.quantities)] = self.quantities
+        shortfall = np.where(needed * (1 - TOLERANCE) <= available[needed_cols], 0.0,
+                             needed - available[needed_cols])
+
+        mask = np.ones(len(rows_by_recipe), dtype=bool)
+        missing = np.flatnonzero(shortfall)
+        mask[needed_rows[missing]] = False
+
+        product_ids = list(columns)
+        shortfalls = [dict() for _ in rows_by_recipe]
+        for entry in missing:
+            shortfalls[needed_rows[entry]][product_ids[needed_cols[entry]]] = float(shortfall[entry])
+
+        positions = [rows_by_recipe[recipe_id] for recipe_id in recipe_ids]
+        return mask[positions], [shortfalls[position] for position in positions]
+
+
+class RestrictionIndex:
+    """Per-recipe bitsets of ingredients' product ids and of dish categories.
+
+    Lets restrictions be checked with bitwise operations instead of walking each recipe's
+    ingredients and categories. Categories are matched by lowercased name, as profile types are.
+    """
+
+    GENERATION_KEY = 'recommendations:restriction_index'
+
+    def __init__(self):
+        self.recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        self.products = dict()           # recipe_id -> bitset with bit product_id set for each ingredient
+        for recipe_id, product_id in Ingredient.objects.values_list('recipe_id', 'product_id'):
+            self.products[recipe_id] = self.products.get(recipe_id, 0) | (1 << product_id)
+
+        self.category_bits = dict()      # lowercased category name -> bit
+        self.categories = dict()         # recipe_id -> mask of its dish's categories
+        recipe_categories = (Recipe.objects
+                             .filter(dish__categories__isnull=False)
+                             .values_list('id', 'dish__categories__name'))
+        for recipe_id, category_name in recipe_categories:
+            bit = self.category_bits.setdefault(category_name.lower(), len(self.category_bits))
+            self.categories[recipe_id] = self.categories.get(recipe_id, 0) | (1 << bit)
+
+    @staticmethod
+    def products_mask(product_ids):
+        mask = 0
+        for product_id in product_ids:
+            mask |= 1 << product_id
+        return mask
+
+    def categories_mask(self, category_names):
+        """Mask of the given (lowercased) category names, None if any of them is not a known category."""
+        mask = 0
+        for name in category_names:
+            if name not in self.category_bits:
+                return None
+            mask |= 1 << self.category_bits[name]
+        return mask
+
+    def allows(self, recipe_id, forbidden_products_mask, required_categories_mask):
+        """Whether recipe has no forbidden product and its dish is in all required categories."""
+        if required_categories_mask is None:
             return False
+        return (not self.products.get(recipe_id, 0) & forbidden_products_mask
+                and self.categories.get(recipe_id, 0) & required_categories_mask == required_categories_mask)
+
+    def allowed_recipe_ids(self, forbidden_products_mask, required_categories_mask):
+        """Ids of all the recipes that pass the restrictions, see allows."""
+        return [recipe_id for recipe_id in self.recipe_ids
+                if self.allows(recipe_id, forbidden_products_mask, required_categories_mask)]
+
+    @classmethod
+    def invalidate(cls):
+        bump_generation(cache, cls.GENERATION_KEY)
+
+
+_restriction_index = (None, None)
+_restriction_index_lock = threading.Lock()
+
+
+def get_restriction_index():
+    """This process' RestrictionIndex, rebuilt when it was invalidated (from any process sharing the cache)."""
+    global _restriction_index
+
+    generation = get_generation(cache, RestrictionIndex.GENERATION_KEY)
+    index_generation, index = _restriction_index
+    if index_generation != generation:
+        with _restriction_index_lock:
+            index_generation, index = _restriction_index
+            if index_generation != generation:
+                index = RestrictionIndex()
+                _restriction_index = (generation, index)
+    return index
+
+
+COOKABLE_RECIPES_GENERATION_KEY = 'recommendations:cookable'
+
+
+def _cookable_recipes_version_key(place_id):
+    return f'recommendations:cookable-version:{place_id}'
+
+
+def _cookable_recipes_key(place_id, version):
+    return f'recommendations:cookable:{place_id}:{get_generation(cache, COOKABLE_RECIPES_GENERATION_KEY)}:{version}'
+
+
+def _place_inventory(place_id):
+    return ComparableInventory(InventoryItem.objects.filter(place_id=place_id).select_related('product', 'unit'))
+
+
+def get_cookable_recipe_ids(place_id):
+    """Set of ids of the recipes that can be fully made with place's inventory.
+
+    Computed for all recipes on first use and then kept up to date by refresh_cookable_recipes.
+    """
+    key = _cookable_recipes_key(place_id, get_generation(cache, _cookable_recipes_version_key(place_id)))
+    cookable = cache.get(key)
+    if cookable is None:
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        can_make, _ = _place_inventory(place_id).can_make_many(recipe_ids)
+        cookable = {recipe_id for recipe_id, can_make_recipe in zip(recipe_ids, can_make) if can_make_recipe}
+        # if the inventory changed meanwhile, the version did too and this one is never read again
+        cache.set(key, cookable, COOKABLE_RECIPES_TTL)
+    return cookable
+
+
+def refresh_cookable_recipes(place_id, product_ids):
+    """Re-evaluates, for place, only the recipes that use any of the products whose inventory changed.
+
+    Each refresh stores a new version of the set, built from the previous one, instead of updating it:
+    if another refresh of the place runs meanwhile, the version that's left has no set and is computed
+    from scratch when needed, so no change is ever lost.
+    """
+    version_key = _cookable_recipes_version_key(place_id)
+    previous = cache.get(_cookable_recipes_key(place_id, get_generation(cache, version_key)))
+    key = _cookable_recipes_key(place_id, bump_generation(cache, version_key))
+    if previous is None:
+        # not materialized, will be computed from scratch when needed
+        return
+
+    recipe_ids = list(Ingredient.objects
+                      .filter(product_id__in=product_ids)
+                      .values_list('recipe_id', flat=True)
+                      .distinct())
+    can_make, _ = _place_inventory(place_id).can_make_many(recipe_ids)
+    cookable = set(previous)
+    for recipe_id, can_make_recipe in zip(recipe_ids, can_make):
+        if can_make_recipe:
+            cookable.add(recipe_id)
+        else:
+            cookable.discard(recipe_id)
+    cache.set(key, cookable, COOKABLE_RECIPES_TTL)
+
+
+def invalidate_cookable_recipes():
+    """Drops the cookable recipes of all places, e.g. when recipes or products change."""
+    bump_generation(cache, COOKABLE_RECIPES_GENERATION_KEY)
+
+
+def _place_inventory_generation_key(place_id):
+    return f'recommendations:inventory:{place_id}'
+
+
+def invalidate_place_inventory(place_id):
+    bump_generation(cache, _place_inventory_generation_key(place_id))
+
+
+def get_event_place_ids(event):
+    """Ids of the places whose inventories are shared in event: its place and, unless only the host's
+    inventory is used, the default place of each attendee other than the host."""
+    place_ids = {event.place_id}
+    if not event.only_host_inventory:
+        place_ids.update(PlaceMember.objects
+                         .filter(member__events=event, is_the_default_one=True)
+                         .exclude(member_id=event.host_id)
+                         .values_list('place_id', flat=True))
+    return place_ids
+
+
+def get_pantry(place_ids):
+    """ComparableInventory of all the places together, cached until any of their inventories change."""
+    place_ids = sorted(place_ids)
+    generations = get_generations(cache, [COOKABLE_RECIPES_GENERATION_KEY] +
+                                  [_place_inventory_generation_key(place_id) for place_id in place_ids])
+    # the first generation is also bumped when products (and so conversions) change
+    digest = hashlib.sha1(' '.join(f'{place_id}:{generation}' for place_id, generation
+                                   in zip([None] + place_ids, generations)).encode()).hexdigest()
+    key = f'recommendations:pantry:{digest}'
 
-        return True
+    pantry = cache.get(key)
+    if pantry is None:
+        pantry = ComparableInventory.for_places(place_ids)
+        cache.set(key, pantry, EVENT_PANTRY_TTL)
+    return pantry
@@ -1,21 +1,37 @@
+from datetime import timedelta
 from distutils.util import strtobool
+from math import ceil
 
+from decouple import config
 from requests.exceptions import RequestException
 from django.shortcuts import get_object_or_404
 from django.db.models import prefetch_related_objects
-from rest_framework import viewsets, status
+from django.utils import timezone
+from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from apps.inventories.utils import get_place_or_default
-from apps.inventories.models import InventoryItem
-from apps.profiles.models import Event
+from apps.inventories.utils import get_request_place
+from apps.profiles.models import Event, Profile, ProfileType
 from apps.recommendations.models import RecipeRecommendation
 from apps.recommendations.serializers import RecipeRecommendationSerializer
-from apps.recommendations.services import RemyRSService
-from apps.recommendations.utils import ComparableInventory
+from apps.recommendations.services import GROUP_AGGREGATIONS, RemyRSService, StalePredictions
+from apps.recommendations.utils import (
+    ComparableInventory, get_restriction_index, get_cookable_recipe_ids, get_event_place_ids, get_pantry,
+)
+
+
+# Windowed mode: how many predictions to ask for per wanted result at first, and the window size
+# past which all predictions are fetched at once
+RECOMMENDATIONS_WINDOW_OVERFETCH = config('RECOMMENDATIONS_WINDOW_OVERFETCH', 2, cast=int)
+RECOMMENDATIONS_WINDOW_MAX = config('RECOMMENDATIONS_WINDOW_MAX', 1000, cast=int)
+# Fraction of predictions assumed to pass the filters when none has passed yet
+MIN_PASS_RATE = 0.05
+# Seconds a profile's precomputed recommendations are served for, after that the RS is asked
+RECOMMENDATIONS_SNAPSHOT_MAX_AGE = config('RECOMMENDATIONS_SNAPSHOT_MAX_AGE', 2 * 24 * 60 * 60, cast=int)
 
 
 class RecommendationViewSet(viewsets.GenericViewSet):
@@ -23,80 +39,172 @@ class RecommendationViewSet(viewsets.GenericViewSet):
     search_fields = ['recipe__title', 'recipe__description']
 
     # TODO: probably needs to call self.filter_queryset() to actually search
-    def get_queryset(self, profile_ids=None):
+    def get_queryset(self, profile_ids=None, n='all'):
         # TODO: actually returns a list, fix wording?
         if not profile_ids:
             recommendations = RemyRSService.get_recommendations_for_user(
                 profile_id=self.request.user.profile.id,
-                n='all',
+                n=n,
             )
         else:
             recommendations = RemyRSService.get_recommendations_for_group(
                 profile_ids=profile_ids,
-                n='all',
+                n=n,
+                aggregation=self.request.query_params.get('aggregation'),
             )
 
-        recommendations = [
-            RecipeRecommendation(
+        self.stale = isinstance(recommendations, StalePredictions)
+        return self.to_recommendations(recommendations)
+
+    @staticmethod
+    def to_recommendations(predictions, start=0):
+        """Unsaved RecipeRecommendations for predictions; each keeps its position in the RS ranking as rank."""
+        recommendations = []
+        for rank, r in enumerate(predictions, start=start):
+            recommendation = RecipeRecommendation(
                 recipe_id=r['recipe_id'],
                 rating=r['rating'],
                 rating_is_real=r['real']
             )
-            for r in recommendations
-        ]
+            recommendation.rank = rank
+            recommendations.append(recommendation)
         return recommendations
 
+    def get_window(self, profile_ids, cursor, page_size, postprocess):
+        """Gets the page of postprocessed recommendations that starts at rank cursor of the RS ranking.
+
+        Asks the RS for just enough top predictions to fill the page, assuming at first that half of
+        them pass the filters; if fewer pass, asks again for a bigger window sized with the observed
+        pass rate, only postprocessing predictions not seen before.
+
+        Returns the page and the cursor for the next one (None if there are no more).
+        """
+        passed = []
+        examined = cursor
+        n = cursor + (page_size + 1) * RECOMMENDATIONS_WINDOW_OVERFETCH
+        while True:
+            fetch_all = n > RECOMMENDATIONS_WINDOW_MAX
+            n_to_fetch = 'all' if fetch_all else n
+            predictions = (RemyRSService.get_recommendations_for_user(self.request.user.profile.id, n_to_fetch)
+                           if not profile_ids
+                           else RemyRSService.get_recommendations_for_group(
+                               profile_ids, n_to_fetch, self.request.query_params.get('aggregation')))
+            self.stale = isinstance(predictions, StalePredictions)
+            passed += postprocess(self.to_recommendations(predictions[examined:], start=examined))
+            examined = max(examined, len(predictions))
+            exhausted = fetch_all or len(predictions) < n
+
+            if len(passed) > page_size or exhausted:
+                break
+            pass_rate = max(len(passed) / max(examined - cursor, 1), MIN_PASS_RATE)
+            n = cursor + max(2 * (n - cursor), ceil((page_size + 1) / pass_rate))
+
+        page = passed[:page_size]
+        if len(passed) > page_size:
+            return page, page[-1].rank + 1
+        return page, (None if exhausted else examined)
+
+    def _send_window(self, profile_ids, postprocess):
+        try:
+            cursor = max(int(self.request.query_params.get('cursor', 0)), 0)
+        except ValueError:
+            return Response({"error": "cursor must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = self.paginator.get_page_size(self.request) or self.paginator.page_size
+
+        try:
+            page, next_cursor = self.get_window(profile_ids, cursor, page_size, postprocess)
+        except (RequestException, RemyRSService.RecSysException) as rs_error:
+            return Response({"error": repr(rs_error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        serializer = self.get_serializer(page, many=True)
+        return Response({
+            'next': (replace_query_param(self.request.build_absolute_uri(), 'cursor', next_cursor)
+                     if next_cursor is not None else None),
+            'results': serializer.data,
+        })
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'stale', False):
+            # served last known good predictions, as the RS failed or its circuit is open
+            response['Warning'] = '110 - "Response is Stale"'
+        return response
+
+    def is_windowed(self):
+        return ('cursor' in self.request.query_params
+                or strtobool(self.request.query_params.get('windowed', 'false')))
+
+    @staticmethod
+    def get_restrictions(profiles):
+        """Restriction index and the masks of profiles' forbidden products and required categories."""
+        index = get_restriction_index()
+
+        # a query for all profiles' forbidden products and another for their types
+        forbidden_products_mask = index.products_mask(
+            Profile.forbidden_products.through.objects
+            .filter(profile__in=profiles)
+            .values_list('product_id', flat=True))
+        restrictions_mask = index.categories_mask(
+            {name.lower() for name in ProfileType.objects.filter(profile__in=profiles).values_list('name', flat=True)})
+        return index, forbidden_products_mask, restrictions_mask
+
     def filter_on_users_restrictions(self, recommendations, profiles):
         """ Exclude recommendations that have a forbidden ingredient or not in users' categories. """
-        filtered_recs = []
-
-        # TODO: maybe another prefetch (for the forbidden_products & profiletypes) would be a good idea
-        forbidden_products_pks = {product.pk for profile in profiles for product in profile.forbidden_products.all()}
-        restrictions = {profiletype.name.lower() for profile in profiles for profiletype in profile.profiletypes.all()}
-
-        for recommendation in recommendations:
-            recipe_product_pks_set = {product.pk for product in recommendation.recipe.ingredients.all()}
-            # check if there's any forbidden product in recipe
-            if any(ppk in recipe_product_pks_set for ppk in forbidden_products_pks):
-                continue
-            if recommendation.recipe.dish:
-                dish_categories = {category.name.lower() for category in recommendation.recipe.dish.categories.all()}
-            else:
-                dish_categories = set()
-            # check all profile types are respected
-            if not all(restriction in dish_categories for restriction in restrictions):
-                continue
-            filtered_recs.append(recommendation)
+        index, forbidden_products_mask, restrictions_mask = self.get_restrictions(profiles)
+        return [recommendation for recommendation in recommendations
+                if index.allows(recommendation.recipe_id, forbidden_products_mask, restrictions_mask)]
 
-        return filtered_recs
+    def filter_on_ingredients(self, recommendations, inventory, place=None):
+        if place is not None:
+            # a single place's cookable recipes are kept up to date as its inventory changes
+            cookable = get_cookable_recipe_ids(place.pk)
+            return [rec for rec in recommendations if rec.recipe_id in cookable]
 
-    def filter_on_ingredients(self, recommendations, inventory):
-        user_inventory = inventory.all().prefetch_related('product', 'unit')
-        inv = ComparableInventory(inventory_items=user_inventory)
+        if isinstance(inventory, ComparableInventory):
+            self._comparable_inventory = inventory
+        # built once per request, even if filtering several windows
+        if getattr(self, '_comparable_inventory', None) is None:
+            self._comparable_inventory = ComparableInventory(
+                inventory_items=inventory.all().select_related('product', 'unit'))
+        inv = self._comparable_inventory
 
-        return [rec for rec in recommendations if inv.can_make(rec.recipe)]
+        can_make, _ = inv.can_make_many([rec.recipe_id for rec in recommendations])
+        return [rec for rec, can_make_rec in zip(recommendations, can_make) if can_make_rec]
 
     def postprocess_recommendations(self, recommendations, inventory, profiles=None,
-                                    need_all_ingredients=False, ignore_restrictions=False):
+                                    need_all_ingredients=False, ignore_restrictions=False, place=None):
         if not profiles:
             profiles = [self.request.user.profile]
 
-        # TODO: more optimization can be made here
-        prefetch_related_objects(
-            recommendations,
-            'recipe__dish__categories', 'recipe__ingredients',
-            'recipe__ingredient_set__product', 'recipe__ingredient_set__unit')
-
         filtered_recs = (recommendations
                          if ignore_restrictions
                          else self.filter_on_users_restrictions(recommendations, profiles))
 
         filtered_recs = (filtered_recs
                          if not need_all_ingredients
-                         else self.filter_on_ingredients(filtered_recs, inventory))
+                         else self.filter_on_ingredients(filtered_recs, inventory, place))
 
+        prefetch_related_objects(filtered_recs, 'recipe')
         return filtered_recs
 
+    def get_snapshot(self, place=None, need_all_ingredients=False, ignore_restrictions=False):
+        """Current user's precomputed recommendations, filtered by the database; None if there are no recent ones."""
+        profile = self.request.user.profile
+        snapshot = RecipeRecommendation.objects.filter(
+            profile=profile,
+            computed_at__gte=timezone.now() - timedelta(seconds=RECOMMENDATIONS_SNAPSHOT_MAX_AGE),
+        )
+        if not snapshot.exists():
+            return None
+
+        if not ignore_restrictions:
+            index, forbidden_products_mask, restrictions_mask = self.get_restrictions([profile])
+            snapshot = snapshot.filter(
+                recipe_id__in=index.allowed_recipe_ids(forbidden_products_mask, restrictions_mask))
+        if need_all_ingredients:
+            snapshot = snapshot.filter(recipe_id__in=get_cookable_recipe_ids(place.pk))
+        return snapshot.select_related('recipe').order_by('rank')
+
     def _send_queryset(self, queryset):
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -133,29 +241,55 @@ class RecommendationViewSet(viewsets.GenericViewSet):
                 required=False,
                 default=False,
             ),
+            openapi.Parameter(
+                'windowed',
+                in_=openapi.IN_QUERY,
+                description=("Whether to ask the RS only for as many recommendations as needed for the page. "
+                             "Response has 'next' (with a cursor) and 'results', but no 'count'."),
+                type=openapi.TYPE_BOOLEAN,
+                required=False,
+                default=False,
+            ),
+            openapi.Parameter(
+                'cursor',
+                in_=openapi.IN_QUERY,
+                description="Cursor of the page to get in windowed mode, as given in 'next'. Implies windowed.",
+                type=openapi.TYPE_INTEGER,
+                required=False,
+            ),
         ],
     )
     @action(detail=False, methods=['GET'], url_path='recommend/recipes/me', url_name='recommend-recipes-me')
     def recommend_recipes_me(self, request):
         need_all_ingredients = strtobool(self.request.query_params.get('need_all_ingredients', 'false'))
         ignore_restrictions = strtobool(self.request.query_params.get('ignore_restrictions', 'false'))
-        place = get_place_or_default(self.request.user.profile, self.request.query_params.get('place_id'))
+        place = get_request_place(self.request, self.request.query_params.get('place_id'))
 
         if need_all_ingredients and not place:
             return Response({"error": "You don't have a place"}, status=status.HTTP_400_BAD_REQUEST)
 
+        def postprocess(recommendations):
+            return self.postprocess_recommendations(
+                recommendations,
+                place.inventory.all() if (place and place.inventory) else None,
+                need_all_ingredients=need_all_ingredients,
+                ignore_restrictions=ignore_restrictions,
+                place=place,
+            )
+
+        if self.is_windowed():
+            return self._send_window(None, postprocess)
+
+        snapshot = self.get_snapshot(place, need_all_ingredients, ignore_restrictions)
+        if snapshot is not None:
+            return self._send_queryset(snapshot)
+
         try:
             queryset = self.get_queryset()
         except (RequestException, RemyRSService.RecSysException) as rs_error:
             return Response({"error": repr(rs_error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        queryset = self.postprocess_recommendations(
-            queryset,
-            place.inventory.all() if (place and place.inventory) else None,
-            need_all_ingredients=need_all_ingredients,
-            ignore_restrictions=ignore_restrictions,
-        )
-        return self._send_queryset(queryset)
+        return self._send_queryset(postprocess(queryset))
 
     @swagger_auto_schema(
         method='get',
@@ -184,7 +318,31 @@ class RecommendationViewSet(viewsets.GenericViewSet):
                 required=False,
                 default=False,
             ),
-
+            openapi.Parameter(
+                'windowed',
+                in_=openapi.IN_QUERY,
+                description=("Whether to ask the RS only for as many recommendations as needed for the page. "
+                             "Response has 'next' (with a cursor) and 'results', but no 'count'."),
+                type=openapi.TYPE_BOOLEAN,
+                required=False,
+                default=False,
+            ),
+            openapi.Parameter(
+                'cursor',
+                in_=openapi.IN_QUERY,
+                description="Cursor of the page to get in windowed mode, as given in 'next'. Implies windowed.",
+                type=openapi.TYPE_INTEGER,
+                required=False,
+            ),
+            openapi.Parameter(
+                'aggregation',
+                in_=openapi.IN_QUERY,
+                description=("How attendees' predictions are combined: by the RS ('rs') or here, from each one's "
+                             "predictions. If null, server's default is used."),
+                type=openapi.TYPE_STRING,
+                enum=['rs', *GROUP_AGGREGATIONS],
+                required=False,
+            ),
         ],
     )
     @action(detail=False, methods=['GET'], url_path='recommend/recipes/event', url_name='recommend-recipes-event')
@@ -195,29 +353,43 @@ class RecommendationViewSet(viewsets.GenericViewSet):
 
         event = get_object_or_404(Event.objects.all(), id=event_id)
 
+        aggregation = request.query_params.get('aggregation')
+        if aggregation and aggregation != 'rs' and aggregation not in GROUP_AGGREGATIONS:
+            return Response({"error": f"Unknown aggregation {aggregation}"}, status=status.HTTP_400_BAD_REQUEST)
+
         if need_all_ingredients and not event.place:
             return Response({"error": "Event doesn't have a place"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # always include event's place's inventory (which should be the host's)
-        places_pk = set([event.place.pk])
-        if not event.only_host_inventory:
-            # add each non-host member's inventory, without duplicates
-            for attendee in event.attendees.all():
-                # TODO: assumes event's place is from the host so that we can ignore them here; is this right?
-                if attendee != event.host:
-                    places_pk.add(attendee.default_place.pk)
-        event_inventory = InventoryItem.objects.filter(place__in=places_pk)
+        # TODO: assumes event's place is from the host so that we can ignore them here; is this right?
+        places_pk = get_event_place_ids(event)
+        profile_ids = list(event.attendees.values_list('pk', flat=True))
+
+        def postprocess(recommendations):
+            return self.postprocess_recommendations(
+                recommendations,
+                # only summed up if needed, and then just once per request
+                get_pantry(places_pk) if need_all_ingredients and len(places_pk) > 1 else None,
+                profiles=profile_ids,
+                need_all_ingredients=need_all_ingredients,
+                ignore_restrictions=ignore_restrictions,
+                place=event.place if len(places_pk) == 1 else None,
+            )
+
+        if self.is_windowed():
+            return self._send_window(profile_ids, postprocess)
 
         try:
-            queryset = self.get_queryset(profile_ids=[attendee.pk for attendee in event.attendees.all()])
+            queryset = self.get_queryset(profile_ids=profile_ids)
         except (RequestException, RemyRSService.RecSysException) as rs_error:
             return Response({"error": repr(rs_error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        queryset = self.postprocess_recommendations(
-            queryset,
-            event_inventory,
-            profiles=event.attendees.all(),
-            need_all_ingredients=need_all_ingredients,
-            ignore_restrictions=ignore_restrictions,
-        )
-        return self._send_queryset(queryset)
+        return self._send_queryset(postprocess(queryset))
+
+    @swagger_auto_schema(
+        method='get',
+        operation_summary="Get this worker's call counters and latencies (in seconds) for the RS",
+    )
+    @action(detail=False, methods=['GET'], url_path='rs/stats', url_name='rs-stats',
+            permission_classes=[permissions.IsAdminUser])
+    def rs_stats(self, request):
+        return Response(RemyRSService.stats(), status=status.HTTP_200_OK)
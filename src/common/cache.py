@@ -0,0 +1,116 @@
+import threading
+from uuid import uuid4
+
+from django.core.cache import cache as default_cache
+from django.core.signals import request_started, request_finished
+from django.dispatch import receiver
+
+
+# Generation tokens already read by the current request, so the shared cache is asked once per request
+_request_tokens = threading.local()
+
+
+@receiver(request_started)
+def _start_request_tokens(**_kwargs):
+    _request_tokens.tokens = dict()
+
+
+@receiver(request_finished)
+def _finish_request_tokens(**_kwargs):
+    _request_tokens.tokens = None
+
+
+def _remember(cache, key, token):
+    tokens = getattr(_request_tokens, 'tokens', None)
+    if tokens is not None:
+        tokens[(id(cache), key)] = token
+    return token
+
+
+def _remembered(cache, key):
+    tokens = getattr(_request_tokens, 'tokens', None)
+    return tokens.get((id(cache), key)) if tokens is not None else None
+
+
+def get_generation(cache, key):
+    """Current generation token stored at key in cache.
+
+    Entries that must be invalidated together include the token in their keys, so bumping it
+    makes all of them unreachable at once. Tokens are random so that an evicted generation can
+    never bring back entries from an older one.
+
+    Within a request the token is read once, so the request sees a single generation of each key.
+    """
+    token = _remembered(cache, key)
+    if token is None:
+        token = cache.get(key)
+        if token is None:
+            cache.add(key, uuid4().hex, None)
+            token = cache.get(key)
+        _remember(cache, key, token)
+    return token
+
+
+def bump_generation(cache, key):
+    """Invalidates every entry built with the current generation token at key, and returns the new one."""
+    token = uuid4().hex
+    cache.set(key, token, None)
+    return _remember(cache, key, token)
+
+
+def get_generations(cache, keys):
+    """Current generation tokens at each of keys, as get_generation but in a single round trip when all exist."""
+    tokens = {key: _remembered(cache, key) for key in keys}
+    missing = [key for key, token in tokens.items() if token is None]
+    if missing:
+        tokens.update(cache.get_many(missing))
+        for key in missing:
+            tokens[key] = _remember(cache, key, tokens.get(key) or get_generation(cache, key))
+    return [tokens[key] for key in keys]
+
+
+class ReferenceData:
+    """Every row of a small table that rarely changes, by primary key and by name.
+
+    Shared by all the threads of a process, so the instances must be treated as read-only.
+    """
+
+    def __init__(self, model):
+        self.all = list(model.objects.order_by('pk'))
+        self.by_id = {obj.pk: obj for obj in self.all}
+        self.by_name = {obj.name: obj for obj in self.all}
+        self._derived = dict()
+
+    def derived(self, key, build):
+        """build(self), computed once per version of the table and kept under key."""
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = build(self)
+            return value
+
+
+def _reference_data_key(model):
+    return f'reference:{model._meta.label_lower}'
+
+
+_reference_data = dict()
+_reference_data_lock = threading.Lock()
+
+
+def get_reference_data(model):
+    """This process' ReferenceData of model, rebuilt when it was invalidated (from any process sharing the cache)."""
+    key = _reference_data_key(model)
+    generation = get_generation(default_cache, key)
+    data_generation, data = _reference_data.get(key, (None, None))
+    if data_generation != generation:
+        with _reference_data_lock:
+            data_generation, data = _reference_data.get(key, (None, None))
+            if data_generation != generation:
+                data = ReferenceData(model)
+                _reference_data[key] = (generation, data)
+    return data
+
+
+def invalidate_reference_data(model):
+    bump_generation(default_cache, _reference_data_key(model))
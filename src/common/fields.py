@@ -0,0 +1,56 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+
+from common.cache import get_reference_data
+
+
+class ReferenceSlugRelatedField(serializers.SlugRelatedField):
+    """SlugRelatedField by name for models kept as ReferenceData, so that it doesn't query for each object.
+
+    Names the reference data doesn't know yet are still looked up in the database.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('slug_field', 'name')
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            obj = get_reference_data(self.get_queryset().model).by_name.get(data)
+            if obj is not None:
+                return obj
+        return super().to_internal_value(data)
+
+    def get_attribute(self, instance):
+        # the related object by its id, instead of fetching it through the foreign key
+        if len(self.source_attrs) == 1 and isinstance(instance, models.Model):
+            try:
+                field = instance._meta.get_field(self.source_attrs[0])
+            except FieldDoesNotExist:
+                field = None
+            if field is not None and field.many_to_one:
+                pk = getattr(instance, field.attname)
+                if pk is None:
+                    return None
+                obj = get_reference_data(field.related_model).by_id.get(pk)
+                if obj is not None:
+                    return obj
+        return super().get_attribute(instance)
+
+
+class PrefetchedSlugRelatedField(serializers.SlugRelatedField):
+    """SlugRelatedField that first looks for the object in context[context_key], a dict by slug.
+
+    For views that validate many objects, so that they can fetch all of them in one query.
+    """
+
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        prefetched = self.context.get(self.context_key)
+        if prefetched is not None and isinstance(data, str) and data in prefetched:
+            return prefetched[data]
+        return super().to_internal_value(data)
@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.test import override_settings
+
+
+def local_caches(test):
+    """Runs test (a test method or class) with empty in-memory caches of its own, for tests that count the
+    queries of a feature without those of the shared (database) caches, or that can't query the database."""
+    return override_settings(CACHES={
+        alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'{test.__qualname__}:{alias}'}
+        for alias in settings.CACHES
+    })(test)
@@ -1,4 +1,6 @@
 import os
+import threading
+from decouple import config
 from django.conf import settings
 from django.shortcuts import _get_queryset
 from django.utils.http import urlencode
@@ -7,9 +9,37 @@ from pint import UnitRegistry
 import qrcode
 
 
-ureg = UnitRegistry()
-ureg.load_definitions(os.path.join(settings.BASE_DIR, 'common/unit_definitions/units.txt'))
-Q_ = ureg.Quantity
+UNIT_DEFINITIONS = os.path.join(settings.BASE_DIR, 'common/unit_definitions/units.txt')
+# Where pint keeps the parsed definitions between runs (':auto:' is the user's cache dir, empty disables it)
+UNIT_REGISTRY_CACHE_FOLDER = config('UNIT_REGISTRY_CACHE_FOLDER', ':auto:')
+
+_ureg = None
+_ureg_lock = threading.Lock()
+
+
+def _build_unit_registry(cache_folder):
+    ureg = UnitRegistry(cache_folder=cache_folder or None)
+    ureg.load_definitions(UNIT_DEFINITIONS)
+    return ureg
+
+
+def get_unit_registry():
+    """This process' pint UnitRegistry, built on first use rather than at import time."""
+    global _ureg
+
+    if _ureg is None:
+        with _ureg_lock:
+            if _ureg is None:
+                try:
+                    _ureg = _build_unit_registry(UNIT_REGISTRY_CACHE_FOLDER)
+                except OSError:
+                    # the cache folder can't be written to, e.g. on a read-only filesystem
+                    _ureg = _build_unit_registry(None)
+    return _ureg
+
+
+def Q_(*args, **kwargs):
+    return get_unit_registry().Quantity(*args, **kwargs)
 
 
 def query_reverse(viewname, kwargs=None, query_kwargs=None):
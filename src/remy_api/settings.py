@@ -99,6 +99,41 @@ else:
     DATABASES = {'default': dj_database_url.config()}
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Every cache must be shared by all the workers (by default they are in the database, see
+# `manage.py createcachetable`): 'default' holds the cookable recipes of each place and the generation
+# tokens that tell each worker its in-process indexes are stale
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', 'cache'),
+    },
+    # Predictions from the RS and the generation tokens that drop them when users interact; entries are
+    # culled past MAX_ENTRIES
+    'recommendations': {
+        'BACKEND': config('RECOMMENDATIONS_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('RECOMMENDATIONS_CACHE_LOCATION', 'recommendations'),
+        'TIMEOUT': config('RECOMMENDATIONS_CACHE_TTL', 600, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RECOMMENDATIONS_CACHE_MAX_ENTRIES', 1000, cast=int),
+        },
+    },
+    # Last good predictions from the RS, served while it fails; kept for days, so apart from the entries
+    # above (which would cull them)
+    'recommendations_last_good': {
+        'BACKEND': config('RECOMMENDATIONS_LAST_GOOD_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('RECOMMENDATIONS_LAST_GOOD_CACHE_LOCATION', 'recommendations_last_good'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RECOMMENDATIONS_LAST_GOOD_CACHE_MAX_ENTRIES', 100000, cast=int),
+        },
+    },
+}
+
+# Snapshot written by `manage.py build_local_recommender`, used when the RS can't give predictions
+LOCAL_RECOMMENDER_SNAPSHOT = config('LOCAL_RECOMMENDER_SNAPSHOT', os.path.join(BASE_DIR, 'local_recommender.npz'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 